@@ -1,11 +1,14 @@
 import io
+import asyncio
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from docx import Document
 import os
 import json
 import fitz  # PyMuPDF
 import pytesseract
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from PIL import Image
 import sys
 import aiohttp
@@ -19,7 +22,75 @@ from task_specific_agents.calendar_agent import find_events
 
 load_dotenv()
 
-async def get_text_from_links(links: list, API_URL: str, API_TOKEN: str):
+# Canvas responses are parsed with orjson when it is installed
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# Use the C-backed lxml parser for HTML when it is installed
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# Size of each chunk written to disk while downloading a file
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Number of courses whose data is collected at the same time
+COURSE_CONCURRENCY = 4
+
+# Open connections kept to the Canvas host; enough for every course worker plus its
+# concurrent announcement and event requests
+CANVAS_CONNECTION_LIMIT = COURSE_CONCURRENCY * 3
+# Seconds a resolved Canvas hostname is reused before looking it up again
+CANVAS_DNS_CACHE_SECONDS = 300
+
+def canvas_connector() -> aiohttp.TCPConnector:
+    """Connection pool for Canvas sessions: bounded per host, with DNS lookups cached"""
+    return aiohttp.TCPConnector(limit_per_host=CANVAS_CONNECTION_LIMIT, ttl_dns_cache=CANVAS_DNS_CACHE_SECONDS)
+
+def has_next_page(response: aiohttp.ClientResponse) -> bool:
+    """
+    Whether a paginated Canvas response has a further page. Canvas leaves out the "next"
+    link on the last page, so loops can stop without fetching an empty page.
+    """
+    return "next" in response.links
+
+# OCR runs in the tesseract subprocess, so images within a file are recognized in parallel threads
+OCR_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+
+def ocr_image_bytes(image_bytes: bytes) -> str:
+    """Run OCR on raw image bytes."""
+    image = Image.open(io.BytesIO(image_bytes))
+    return pytesseract.image_to_string(image)
+
+def resolve_ocr_parts(text_parts: list) -> list:
+    """
+    Replace pending OCR jobs in text_parts with their formatted text, keeping document order.
+    Pending jobs are (future, label, error_message) tuples; label is formatted with the OCR text,
+    and error_message (if set) is formatted with the exception when OCR fails.
+    Results with no text are dropped.
+    """
+    resolved = []
+    for part in text_parts:
+        if isinstance(part, str):
+            resolved.append(part)
+            continue
+        future, label, error_message = part
+        try:
+            ocr_text = future.result()
+        except Exception as img_error:
+            if error_message:
+                print(error_message.format(img_error))
+            continue
+        if ocr_text.strip():
+            resolved.append(label.format(ocr_text))
+    return resolved
+
+async def get_text_from_links(links: list, API_URL: str, API_TOKEN: str, session: aiohttp.ClientSession = None):
     """
     Process a list of links and extracts text.
 
@@ -29,6 +100,7 @@ async def get_text_from_links(links: list, API_URL: str, API_TOKEN: str):
     links = [{filename: fileurl}]
     API_URL = "https://psu.instructure.com/api/v1"
     API_TOKEN = "1234567890"
+    session = an open aiohttp.ClientSession to reuse (optional; a new one is opened if not given)
 
     ================================================
 
@@ -40,50 +112,68 @@ async def get_text_from_links(links: list, API_URL: str, API_TOKEN: str):
     """
     complete_text = ""
     try:
-        async with aiohttp.ClientSession() as session:
-            for link_dict in links:
-                for filename, fileurl in link_dict.items():
-                    try:
-                        # Extract file ID and course ID from the Canvas URL
-                        # Example URL: https://psu.instructure.com/courses/123456/files/789012
-                        file_id = fileurl.split('/')[-1].split('?')[0]  # Get file ID (789012)
-                        course_id = fileurl.split('/courses/')[1].split('/')[0]  # Get course ID (123456)
+        if session is None:
+            async with aiohttp.ClientSession() as own_session:
+                complete_text = await _extract_text_from_links(own_session, links, API_URL, API_TOKEN)
+        else:
+            complete_text = await _extract_text_from_links(session, links, API_URL, API_TOKEN)
+    except Exception as e:
+        print(f"text couldn't be extracted: {str(e)}")
+    return complete_text
+
+async def _extract_text_from_links(session: aiohttp.ClientSession, links: list, API_URL: str, API_TOKEN: str):
+    """Download each linked Canvas file over session and return the combined extracted text."""
+    complete_text = ""
+    for link_dict in links:
+        for filename, fileurl in link_dict.items():
+            try:
+                # Extract file ID and course ID from the Canvas URL
+                # Example URL: https://psu.instructure.com/courses/123456/files/789012
+                file_id = fileurl.split('/')[-1].split('?')[0]  # Get file ID (789012)
+                course_id = fileurl.split('/courses/')[1].split('/')[0]  # Get course ID (123456)
                         
-                        # Construct the Canvas API endpoint for file metadata
-                        api_url = f"{API_URL}/courses/{course_id}/files/{file_id}"
+                # Construct the Canvas API endpoint for file metadata
+                api_url = f"{API_URL}/courses/{course_id}/files/{file_id}"
 
-                        # First request: Get file metadata including the actual download URL
-                        headers = {"Authorization": f"Bearer {API_TOKEN}"}
-                        async with session.get(api_url, headers=headers) as response:
-                            if response.status != 200:
-                                continue
+                # First request: Get file metadata including the actual download URL
+                headers = {"Authorization": f"Bearer {API_TOKEN}"}
+                async with session.get(api_url, headers=headers) as response:
+                    if response.status != 200:
+                        continue
 
-                            # Extract the actual download URL from the file metadata
-                            file_data = await response.json()
-                            download_url = file_data.get('url')
+                    # Extract the actual download URL from the file metadata
+                    file_data = await response.json(loads=json_loads)
+                    download_url = file_data.get('url')
                             
-                            if not download_url:
-                                continue
-
-                            # Second request: Download the actual file content
-                            async with session.get(download_url, headers=headers) as file_response:
-                                if file_response.status != 200:
-                                    continue
-
-                                # Get the raw file content as bytes
-                                file_bytes = await file_response.read()
+                    if not download_url:
+                        continue
 
-                                # Determine the file type from the filename extension
-                                file_type = get_file_type(filename)
+                    # Second request: Download the actual file content
+                    async with session.get(download_url, headers=headers) as file_response:
+                        if file_response.status != 200:
+                            continue
 
-                                # Process the file based on its type and extract text
-                                extracted_text = extract_text_and_images(file_bytes, file_type)
-                                complete_text += f"\nText from {filename}:\n{extracted_text}\n\n"
-                    except Exception as e:
-                        print(f"Error processing file {filename}: {str(e)}")
-                        continue
-    except Exception as e:
-        print(f"text couldn't be extracted: {str(e)}")
+                        # Stream the file to disk so it is never held in memory as a whole
+                        temp_file = tempfile.NamedTemporaryFile(delete=False)
+                        try:
+                            try:
+                                async for chunk in file_response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                                    temp_file.write(chunk)
+                            finally:
+                                temp_file.close()
+
+                            # Determine the file type from the filename extension
+                            file_type = get_file_type(filename)
+
+                            # Process the file based on its type and extract text
+                            # Parsing and OCR are blocking, so run them off the event loop
+                            extracted_text = await asyncio.to_thread(extract_text_and_images, temp_file.name, file_type)
+                        finally:
+                            os.remove(temp_file.name)
+                        complete_text += f"\nText from {filename}:\n{extracted_text}\n\n"
+            except Exception as e:
+                print(f"Error processing file {filename}: {str(e)}")
+                continue
     return complete_text
 
 def get_file_type(filename: str):
@@ -108,14 +198,14 @@ def get_file_type(filename: str):
     file_extension = filename.split(".")[-1].lower()
     return file_extension
 
-def extract_text_and_images(file_bytes: bytes, file_type: str):
+def extract_text_and_images(file_source, file_type: str):
     """
     Extract text and images from a file.
 
     ================================================
 
     examples of input parameters:
-    file_bytes = b"this is the raw bytes of a file"
+    file_source = b"this is the raw bytes of a file"  (or a path to the file on disk, e.g. "/tmp/lecture.pdf")
     file_type = "pdf"
 
     ================================================
@@ -126,16 +216,21 @@ def extract_text_and_images(file_bytes: bytes, file_type: str):
     ================================================
     
     """
-    total_text = ""
+    # Collect text pieces and join once at the end instead of repeatedly concatenating
+    text_parts = []
+
+    # Paths are handed to the parsers directly so they read from disk instead of an in-memory copy
+    from_path = isinstance(file_source, str)
 
     try:
         if file_type == "pdf":
             # Handle PDF files
             try:
-                # Create a memory stream from the PDF bytes
-                pdf_stream = io.BytesIO(file_bytes)
-                # Open the PDF document
-                doc = fitz.open(stream=pdf_stream, filetype="pdf")
+                # Open the PDF document from disk or directly from the downloaded bytes (no intermediate stream copy)
+                if from_path:
+                    doc = fitz.open(file_source, filetype="pdf")
+                else:
+                    doc = fitz.open(stream=file_source, filetype="pdf")
                 print(f"\nSuccessfully opened PDF with {len(doc)} pages")
 
                 # Check if PDF is password protected
@@ -150,7 +245,7 @@ def extract_text_and_images(file_bytes: bytes, file_type: str):
                         text = page.get_text()
                         if text:
                             print(f"Successfully extracted text from page {page_num + 1}")
-                            total_text += f"Text from page {page_num + 1}:\n{text}\n"
+                            text_parts.append(f"Text from page {page_num + 1}:\n{text}\n")
 
                         # Extract and process images from the page
                         image_list = page.get_images(full=True)
@@ -158,16 +253,15 @@ def extract_text_and_images(file_bytes: bytes, file_type: str):
                             print(f"Found {len(image_list)} images on page {page_num + 1}")
                         for img_index, img in enumerate(image_list):
                             try:
-                                # Extract image data and perform OCR
+                                # Extract image data and queue it for OCR
                                 xref = img[0]
                                 base_image = doc.extract_image(xref)
                                 if base_image and "image" in base_image:
-                                    image_bytes = base_image["image"]
-                                    image = Image.open(io.BytesIO(image_bytes))
-                                    ocr_text = pytesseract.image_to_string(image)
-                                    if ocr_text:
-                                        print(f"Successfully extracted text from image {img_index + 1} on page {page_num + 1}")
-                                        total_text += f"Image {img_index + 1} from page {page_num + 1}:\n{ocr_text}\n"
+                                    text_parts.append((
+                                        OCR_POOL.submit(ocr_image_bytes, base_image["image"]),
+                                        f"Image {img_index + 1} from page {page_num + 1}:\n{{}}\n",
+                                        None
+                                    ))
                             except Exception:
                                 continue
                     except Exception:
@@ -175,7 +269,6 @@ def extract_text_and_images(file_bytes: bytes, file_type: str):
 
                 # Clean up resources
                 doc.close()
-                pdf_stream.close()
 
             except Exception as pdf_error:
                 return f"Error processing PDF: {pdf_error}"
@@ -183,26 +276,24 @@ def extract_text_and_images(file_bytes: bytes, file_type: str):
         elif file_type == "docx":
             # Handle DOCX files
             try:
-                # Open DOCX file from memory
-                doc = Document(io.BytesIO(file_bytes))
+                # Open DOCX file from disk or memory
+                doc = Document(file_source if from_path else io.BytesIO(file_source))
 
                 # Extract text from paragraphs
                 for paragraph in doc.paragraphs:
                     if paragraph.text:
-                        total_text += paragraph.text + "\n"
+                        text_parts.append(paragraph.text + "\n")
 
                 # Extract text from images in the DOCX file
                 for rel in doc.part.rels.values():
                     if "image" in rel.target_ref:
                         try:
-                            # Get the image data
-                            image_bytes = rel.target_part.blob
-                            image = Image.open(io.BytesIO(image_bytes))
-
-                            # Perform OCR on the image
-                            ocr_text = pytesseract.image_to_string(image)
-                            if ocr_text.strip():
-                                total_text += f"Text from image in DOCX:\n{ocr_text}\n"
+                            # Queue the image data for OCR
+                            text_parts.append((
+                                OCR_POOL.submit(ocr_image_bytes, rel.target_part.blob),
+                                "Text from image in DOCX:\n{}\n",
+                                "Error processing image in DOCX: {}"
+                            ))
                         except Exception as img_error:
                             print(f"Error processing image in DOCX: {img_error}")
                             continue
@@ -214,49 +305,48 @@ def extract_text_and_images(file_bytes: bytes, file_type: str):
         elif file_type == "pptx":
             # Handle PPTX files
             try:
-                # Open PPTX file from memory
-                pptx_stream = io.BytesIO(file_bytes)
-                presentation = Presentation(pptx_stream)
+                # Open PPTX file from disk or memory
+                presentation = Presentation(file_source if from_path else io.BytesIO(file_source))
 
                 # Iterate through slides and extract text
                 for slide_num, slide in enumerate(presentation.slides):
-                    slide_text = f"Slide {slide_num + 1}:\n"
+                    text_parts.append(f"Slide {slide_num + 1}:\n")
                     for shape in slide.shapes:
                         # Extract text from shapes with text
                         if hasattr(shape, "text") and shape.text.strip():
-                            slide_text += shape.text + "\n"
+                            text_parts.append(shape.text + "\n")
 
-                        # Extract text from images using OCR
+                        # Queue images for OCR
                         if shape.shape_type == MSO_SHAPE_TYPE.PICTURE:
                             try:
-                                # Get the image data
-                                image_bytes = io.BytesIO(shape.image.blob)
-                                image = Image.open(image_bytes)
-
-                                # Perform OCR on the image
-                                ocr_text = pytesseract.image_to_string(image)
-                                if ocr_text.strip():
-                                    slide_text += f"Text from image in slide {slide_num + 1}:\n{ocr_text}\n"
+                                text_parts.append((
+                                    OCR_POOL.submit(ocr_image_bytes, shape.image.blob),
+                                    f"Text from image in slide {slide_num + 1}:\n{{}}\n",
+                                    f"Error processing image in slide {slide_num + 1}: {{}}"
+                                ))
                             except Exception as img_error:
                                 print(f"Error processing image in slide {slide_num + 1}: {img_error}")
                                 continue
 
-                    total_text += slide_text
-
-                pptx_stream.close()
             except Exception as pptx_error:
                 return f"Error processing PPTX: {pptx_error}"
 
         elif file_type == "txt":
             # Handle TXT files
             try:
+                if from_path:
+                    with open(file_source, "rb") as f:
+                        file_bytes = f.read()
+                else:
+                    file_bytes = file_source
+
                 # Try different text encodings to handle various text file formats
                 encodings = ['utf-8', 'latin-1', 'ascii', 'iso-8859-1']
                 for encoding in encodings:
                     try:
                         text = file_bytes.decode(encoding)
                         if text:
-                            total_text = text
+                            text_parts.append(text)
                             break
                     except UnicodeDecodeError:
                         continue
@@ -267,17 +357,18 @@ def extract_text_and_images(file_bytes: bytes, file_type: str):
             # Handle image files using OCR
             try:
                 # Open image and perform OCR to extract text
-                image = Image.open(io.BytesIO(file_bytes))
+                image = Image.open(file_source if from_path else io.BytesIO(file_source))
                 ocr_text = pytesseract.image_to_string(image)
                 if ocr_text:
-                    total_text = ocr_text
+                    text_parts.append(ocr_text)
             except Exception as img_error:
                 return f"Error processing image: {img_error}"
 
     except Exception as e:
         return f"Unexpected error: {e}"
 
-    return total_text
+    # Wait for any queued OCR jobs and splice their text back in place
+    return "".join(resolve_ocr_parts(text_parts))
 
 def extract_links_from_html(html_string: str):
     """
@@ -296,7 +387,8 @@ def extract_links_from_html(html_string: str):
     ================================================
     
     """
-    soup = BeautifulSoup(html_string, "html.parser")
+    # Only <a> tags are needed, so skip building the rest of the tree
+    soup = BeautifulSoup(html_string, HTML_PARSER, parse_only=SoupStrainer("a"))
     links_found = []
     for a in soup.find_all("a", href=True):
         url_found = a["href"]
@@ -306,6 +398,448 @@ def extract_links_from_html(html_string: str):
             links_found += [{url_name: url_found}]
     return links_found
 
+async def get_course_announcements(session: aiohttp.ClientSession, API_URL: str, headers: dict, course_id):
+    """
+    Fetch the first two pages of announcements for a course.
+
+    ================================================
+
+    examples of input parameters:
+    API_URL = "https://psu.instructure.com/api/v1"
+    headers = {"Authorization": "Bearer 1234567890"}
+    course_id = 2361510
+
+    ================================================
+
+    examples of output:
+    announcements = [{"id": 123, "title": "Exam 1 moved", "message": "<p>...</p>", "posted_at": "2025-02-01T15:00:00Z", ...}, ...]
+
+    ================================================
+    """
+    announcements = []
+    for i in range(1, 3, 1):
+        async with session.get(
+            f"{API_URL}/announcements",
+            params={
+                "pager": i,
+                "context_codes[]": [f"course_{course_id}"],
+                "enrollment_state": "active"
+            },
+            headers=headers
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                print(f"Error fetching announcements: {error_text}")
+                break
+
+            announcements += await response.json(loads=json_loads)
+    return announcements
+
+async def get_course_data(session: aiohttp.ClientSession, API_URL: str, API_TOKEN: str, headers: dict, course: dict):
+    """
+    Collect the files, assignments, quizzes, announcements and calendar events of one course,
+    and fill in the course's syllabus_body.
+
+    ================================================
+
+    examples of input parameters:
+    API_URL = "https://psu.instructure.com/api/v1"
+    API_TOKEN = "1234567890"
+    headers = {"Authorization": "Bearer 1234567890"}
+    course = {"id": 2361510, "name": "CMPSC 132", "syllabus_body": "...", ...}
+
+    ================================================
+
+    examples of output:
+    course_data = {"files": [...], "announcements": [...], "assignments": [...], "quizzes": [...], "calendar_events": [...]}
+
+    ================================================
+    """
+    course_data = {"files": [], "announcements": [], "assignments": [], "quizzes": [], "calendar_events": []}
+
+    course_id = course.get("id")
+    print(f"\nProcessing course: {course.get('name')} (ID: {course_id})")
+
+    # Announcements and calendar events don't depend on the module and file listings,
+    # so they are fetched while those are paged through
+    announcements_task = asyncio.create_task(get_course_announcements(session, API_URL, headers, course_id))
+    calendar_events_task = asyncio.create_task(find_events(API_URL, API_TOKEN, f"course_{course_id}", session))
+
+    try:
+        print("  - Getting modules and items...")
+        files_added = []
+        assignments_added = []
+        quizzes_added = []
+        page_number = 1
+
+        while True:
+            async with session.get(
+                f"{API_URL}/courses/{course_id}/modules",
+                params={"enrollment_state": "active", "include[]": "all_courses", "page": page_number},
+                headers=headers
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    print(f"Error fetching modules: {error_text}")
+                    break
+                
+                course_modules = await response.json(loads=json_loads)
+                # Read now, since the module item requests below rebind response
+                modules_have_next_page = has_next_page(response)
+        
+                if type(course_modules) is list and course_modules != []:
+                    for module in course_modules:
+                        module_id = module.get("id")
+                        module_name = module.get("name")
+                        module_page_number = 1
+
+                        while True:
+                            async with session.get(
+                                f"{API_URL}/courses/{course_id}/modules/{module_id}/items",
+                                params={"enrollment_state": "active", "include[]": "all_courses", "page": module_page_number},
+                                headers=headers
+                            ) as response:
+                                if response.status != 200:
+                                    error_text = await response.text()
+                                    print(f"Error fetching module items: {error_text}")
+                                    break
+                                
+                                course_module_items = await response.json(loads=json_loads)
+                                items_have_next_page = has_next_page(response)
+                        
+                                if type(course_module_items) is list and course_module_items != []:
+                                    for module_item in course_module_items:
+                                        item_type = module_item.get("type")
+                                    
+                                        if item_type == "File":
+                                        
+                                            if course["syllabus_body"] == []:
+                                                course["syllabus_body"] += [{
+                                                    module_item.get("name"): module_item.get("content_id")
+                                                }]
+                                        
+                                            files_added += [module_item.get("content_id")]
+                                            async with session.get(
+                                                f"{API_URL}/files/{module_item.get('content_id')}",
+                                                params={"enrollment_state": "active"},
+                                                headers=headers
+                                            ) as response:
+                                                if response.status == 200:
+                                                    file = await response.json(loads=json_loads)
+                                                    course_data["files"] += [{
+                                                        "course_id": course_id,
+                                                        "id": file.get("id"),
+                                                        "type": file.get("type"),
+                                                        "folder_id": file.get("folder_id"),
+                                                        "display_name": file.get("display_name"),
+                                                        "filename": file.get("filename"),
+                                                        "url": file.get("url"),
+                                                        "size": file.get("size"),
+                                                        "updated_at": file.get("updated_at"),
+                                                        "locked": file.get("locked"),
+                                                        "lock_explanation": file.get("lock_explanation"),
+                                                        "module_id": module_id,
+                                                        "module_name": module_name
+                                                    }]
+                                        elif item_type == "Assignment":
+                                            assignments_added += [module_item.get("content_id")]
+                                            async with session.get(
+                                                f"{API_URL}/courses/{course_id}/assignments/{module_item.get('content_id')}",
+                                                params={"enrollment_state": "active"},
+                                                headers=headers
+                                            ) as response:
+                                                if response.status == 200:
+                                                    assignment = await response.json(loads=json_loads)
+                                                    course_data["assignments"] += [{
+                                                        "id": assignment.get("id"),
+                                                        "type": assignment.get("type"),
+                                                        "name": assignment.get("name"),
+                                                        "description": assignment.get("description"),
+                                                        "created_at": assignment.get("created_at"),
+                                                        "updated_at": assignment.get("updated_at"),
+                                                        "due_at": assignment.get("due_at"),
+                                                        "course_id": assignment.get("course_id"),
+                                                        "submission_types": assignment.get("submission_types"),
+                                                        "can_submit": assignment.get("can_submit"),
+                                                        "graded_submission_exist": assignment.get("graded_submission_exist"),
+                                                        "can_submit": assignment.get("can_submit"),
+                                                        "graded_submissions_exist": assignment.get("graded_submission_exist"),
+                                                        "module_id": module_id,
+                                                        "module_name": module_name,
+                                                        "content": extract_links_from_html(assignment.get("description") or "")
+                                                    }]
+                                        elif item_type == "Quiz":
+                                            quizzes_added += [module_item.get("content_id")]
+                                            async with session.get(
+                                                f"{API_URL}/courses/{course_id}/quizzes/{module_item.get('content_id')}",
+                                                params={"enrollment_state": "active"},
+                                                headers=headers
+                                            ) as response:
+                                                if response.status == 200:
+                                                    quiz = await response.json(loads=json_loads)
+                                                    course_data["quizzes"] += [{
+                                                        "id": quiz.get("id"),
+                                                        "title": quiz.get("title"),
+                                                        "preview_url": quiz.get("preview_url"),
+                                                        "description": quiz.get("description"),
+                                                        "quiz_type": quiz.get("quiz_type"),
+                                                        "time_limit": quiz.get("time_limit"),
+                                                        "allowed_attempts": quiz.get("allowed_attempts"),
+                                                        "points_possible": quiz.get("points_possible"),
+                                                        "due_at": quiz.get("due_at"),
+                                                        "locked_for_user": quiz.get("locked_for_user"),
+                                                        "lock_explanation": quiz.get("lock_explanation"),
+                                                        "module_id": module_id,
+                                                        "module_name": module_name,
+                                                        "course_id": course_id
+                                                    }]
+                                else:
+                                    break
+                                if not items_have_next_page:
+                                    break
+                                module_page_number += 1
+                else:
+                    break
+                if not modules_have_next_page:
+                    break
+                page_number += 1
+
+        # getting extra files
+        #
+        print("  - Getting additional files...")
+        page_number = 1
+
+        while True:
+            async with session.get(
+                f"{API_URL}/courses/{course_id}/files",
+                params={"enrollment_state": "active", "include[]": "all_courses", "page": page_number},
+                headers=headers
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    print(f"Error fetching files: {error_text}")
+                    break
+                
+                course_files = await response.json(loads=json_loads)
+        
+            
+                if type(course_files) is list and course_files != []:
+                    for i in range(len(course_files)):
+                        #stores the file_name and file_URL of the syllabus if syllabus_body is a list
+                        #syllabus_body is a list if the course has no syllabus_body to begin with
+                        if type(course.get("syllabus_body")) is list and course_files[i].get("name") and "syllabus" in course_files[i].get("name"):
+                            course["syllabus_body"] += [{
+                                course_files[i].get("name"): course_files[i].get("url")
+                            }]
+                    
+                        if course["syllabus_body"] == [] and type(course.get("syllabus_body")) is list and course_files[i].get("name") and "syllabus" in course_files[i].get("name"):
+                            course["syllabus_body"] += [{
+                            course_files[i].get("filename"): course_files[i].get("url")
+                        }]
+
+                        #stores the file object if the file is not already in the files_added list
+                        if course_files[i].get("id") not in files_added:
+                            course_data["files"] += [{
+                                "course_id": course_id,
+                                "id": course_files[i].get("id"),
+                                "type": course_files[i].get("type"),
+                                "folder_id": course_files[i].get("folder_id"),
+                                "display_name": course_files[i].get("display_name"),
+                                "filename": course_files[i].get("filename"),
+                                "url": course_files[i].get("url"),
+                                "size": course_files[i].get("size"),
+                                "updated_at": course_files[i].get("updated_at"),
+                                "locked": course_files[i].get("locked"),
+                                "lock_explanation": course_files[i].get("lock_explanation"),
+                                "module_id": None,
+                                "module_name": None
+                            }]
+                else:
+                    break
+                if not has_next_page(response):
+                    break
+                page_number += 1
+        #
+        # getting files
+
+        # getting announcements
+        #
+        print("  - Getting announcements...")
+        for announcement in await announcements_task:
+            course_data["announcements"] += [{
+                "id": announcement.get("id"),
+                "title": announcement.get("title"),
+                "message": announcement.get("message"),
+                "course_id": course_id,
+                "posted_at": announcement.get("posted_at"),
+                "discussion_type": announcement.get("discussion_type"),
+                "course_name": course.get("name")
+            }]
+
+        # getting calendar events
+        #
+        print("  - Getting calendar events...")
+        calendar_events = await calendar_events_task
+    finally:
+        # If paging failed, stop the side requests before the caller closes the session
+        for task in (announcements_task, calendar_events_task):
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception() # marks a failure as retrieved; the body's own error propagates
+    
+    if calendar_events:
+        for event in calendar_events:
+            course_data["calendar_events"] += [{
+                "id": event.get("id"),
+                "title": event.get("title"),
+                "start_at": event.get("start_at"),
+                "end_at": event.get("end_at"),
+                "description": event.get("description"),
+                "location_name": event.get("location_name"),
+                "location_address": event.get("location_address"),
+                "context_code": event.get("context_code"),
+                "context_name": event.get("context_name"),
+                "all_context_codes": event.get("all_context_codes"),
+                "url": event.get("url"),
+                "course_id": course_id
+            }]
+
+    # getting home page
+    #
+    print("  - Checking for home page...")
+    if course.get("syllabus_body") == [] or course.get("syllabus_body") is None or course.get("syllabus_body") == "":
+        try:
+            async with session.get(
+                f"{API_URL}/courses/{course_id}/front_page",
+                params={"enrollment_state": "active"},
+                headers=headers
+            ) as response:
+                if response.status == 200:
+                    home_page = await response.json(loads=json_loads)
+                    course.update({"syllabus_body": home_page.get("front_page")})
+        except Exception as e:
+            print(f"Error fetching home page: {str(e)}")
+            pass
+    #
+    # getting home page
+   
+    # updating syllabi
+    #
+    print("  - Processing syllabus content...")
+    course_syllabus = course.get("syllabus_body")
+    if course_syllabus:  
+        
+        if isinstance(course_syllabus, str):
+            # Handle case where syllabus is HTML content with embedded links
+            links = extract_links_from_html(course_syllabus)
+            
+            if links:  
+                final_text = await get_text_from_links(links, API_URL, API_TOKEN, session)
+                course_syllabus += f"\n\n{final_text}"
+        
+        elif isinstance(course_syllabus, list):
+            # Handle case where syllabus is a list of direct file link objects
+            final_text = ""
+            for link in course_syllabus:
+                final_text += await get_text_from_links(link, API_URL, API_TOKEN, session)
+            course_syllabus = final_text
+
+        # update the course with the processed syllabus
+        course.update({"syllabus_body": course_syllabus})
+    #
+    # updating syllabi
+
+    # getting assignments
+    # 
+    print("  - Getting assignments...")
+    page_number = 1
+    
+    while True:
+        async with session.get(
+            f"{API_URL}/courses/{course_id}/assignments",
+            params={"enrollment_state": "active", "page": page_number},
+            headers=headers
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                print(f"Error fetching assignments: {error_text}")
+                break
+                
+            course_assignments = await response.json(loads=json_loads)
+
+            if type(course_assignments) is list and course_assignments != []:
+                for i in range(len(course_assignments)):
+                    if course_assignments[i].get("id") not in assignments_added:
+                        course_data["assignments"] += [{
+                            "id": course_assignments[i].get("id"),
+                            "type": course_assignments[i].get("type"),
+                            "name": course_assignments[i].get("name"),
+                            "description": course_assignments[i].get("description"),
+                            "created_at": course_assignments[i].get("created_at"),
+                            "updated_at": course_assignments[i].get("updated_at"),
+                            "due_at": course_assignments[i].get("due_at"),
+                            "course_id": course_id,
+                            "submission_types": course_assignments[i].get("submission_types"),
+                            "can_submit": course_assignments[i].get("can_submit"),
+                            "graded_submission_exist": course_assignments[i].get("graded_submission_exist"),
+                            "can_submit": course_assignments[i].get("can_submit"),
+                            "graded_submissions_exist": course_assignments[i].get("graded_submission_exist"),
+                            "module_id": None,
+                            "module_name": None,
+                            "content": extract_links_from_html(course_assignments[i].get("description") or "")
+                        }]
+            else:
+                break
+            if not has_next_page(response):
+                break
+            page_number += 1
+
+    # getting quizzes
+    # 
+    print("  - Getting quizzes...")
+    page_number = 1
+    
+    while True:
+        async with session.get(
+            f"{API_URL}/courses/{course_id}/quizzes",
+            params={"enrollment_state": "active", "page": page_number},
+            headers=headers
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                print(f"Error fetching quizzes: {error_text}")
+                break
+                
+            course_quizzes = await response.json(loads=json_loads)
+
+            if type(course_quizzes) is list and course_quizzes != []:
+                for i in range(len(course_quizzes)):
+                    if course_quizzes[i].get("id") not in quizzes_added:
+                        course_data["quizzes"] += [{
+                            "id": course_quizzes[i].get("id"),
+                            "title": course_quizzes[i].get("title"),
+                            "preview_url": course_quizzes[i].get("preview_url"),
+                            "description": course_quizzes[i].get("description"),
+                            "quiz_type": course_quizzes[i].get("quiz_type"),
+                            "time_limit": course_quizzes[i].get("time_limit"),
+                            "allowed_attempts": course_quizzes[i].get("allowed_attempts"),
+                            "points_possible": course_quizzes[i].get("points_possible"),
+                            "due_at": course_quizzes[i].get("due_at"),
+                            "locked_for_user": course_quizzes[i].get("locked_for_user"),
+                            "lock_explanation": course_quizzes[i].get("lock_explanation"),
+                            "module_id": None,
+                            "module_name": None,
+                            "course_id": course_id
+                        }]
+            else:
+                break
+            if not has_next_page(response):
+                break
+            page_number += 1
+
+    return course_data
+
 async def get_all_user_data(BASE_DIR: str, API_URL: str, API_TOKEN: str, user_data: dict, courses_selected: dict):
     """
     Retrieves all user data from Canvas and returns it as a dictionary.
@@ -375,7 +909,7 @@ async def get_all_user_data(BASE_DIR: str, API_URL: str, API_TOKEN: str, user_da
     
     # getting courses
     #
-    async with aiohttp.ClientSession() as session:
+    async with aiohttp.ClientSession(connector=canvas_connector()) as session:
         while True: 
         #any "while True" function is always meant to go through multiple pages over and over until there's no more data left to retrieve
             headers = {"Authorization": f"Bearer {API_TOKEN}"}
@@ -393,7 +927,7 @@ async def get_all_user_data(BASE_DIR: str, API_URL: str, API_TOKEN: str, user_da
                     print(f"Error fetching courses: {error_text}")
                     raise ValueError(f"Failed to fetch courses: {error_text}")
                     
-                user_courses = await response.json()
+                user_courses = await response.json(loads=json_loads)
                 
                 # Check if we got a dictionary with an error message instead of a list
                 if isinstance(user_courses, dict) and "errors" in user_courses:
@@ -436,390 +970,40 @@ async def get_all_user_data(BASE_DIR: str, API_URL: str, API_TOKEN: str, user_da
                                 "public_description": user_courses[i].get("public_description"),
                                 "time_zone": user_courses[i].get("time_zone"),
                                 }]
+                if not has_next_page(response):
+                    break
                 page_number += 1
-    #all courses that have a syllabus section have now been added to the "user_data" dictionary
+        #all courses that have a syllabus section have now been added to the "user_data" dictionary
 
-    print(f"\nFound {len(user_data['courses'])} courses to process")
-    
-    print("\n=== SECTION 2: Processing Individual Courses ===")
-    async with aiohttp.ClientSession() as session:
+        print(f"\nFound {len(user_data['courses'])} courses to process")
+        
+        print("\n=== SECTION 2: Processing Individual Courses ===")
+        # Same session as section 1, so the connections opened for the course list are reused
         headers = {"Authorization": f"Bearer {API_TOKEN}"}
-        for course in user_data["courses"]:
-            course_id = course.get("id")
-            print(f"\nProcessing course: {course.get('name')} (ID: {course_id})")
-            
-            print("  - Getting modules and items...")
-            files_added = []
-            assignments_added = []
-            quizzes_added = []
-            page_number = 1
-
-            while True:
-                async with session.get(
-                    f"{API_URL}/courses/{course_id}/modules",
-                    params={"enrollment_state": "active", "include[]": "all_courses", "page": page_number},
-                    headers=headers
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        print(f"Error fetching modules: {error_text}")
-                        break
-                        
-                    course_modules = await response.json()
-                
-                    if type(course_modules) is list and course_modules != []:
-                        for module in course_modules:
-                            module_id = module.get("id")
-                            module_name = module.get("name")
-                            module_page_number = 1
-
-                            while True:
-                                async with session.get(
-                                    f"{API_URL}/courses/{course_id}/modules/{module_id}/items",
-                                    params={"enrollment_state": "active", "include[]": "all_courses", "page": module_page_number},
-                                    headers=headers
-                                ) as response:
-                                    if response.status != 200:
-                                        error_text = await response.text()
-                                        print(f"Error fetching module items: {error_text}")
-                                        break
-                                        
-                                    course_module_items = await response.json()
-                                
-                                    if type(course_module_items) is list and course_module_items != []:
-                                        for module_item in course_module_items:
-                                            item_type = module_item.get("type")
-                                            
-                                            if item_type == "File":
-                                                
-                                                if course["syllabus_body"] == []:
-                                                    course["syllabus_body"] += [{
-                                                        module_item.get("name"): module_item.get("content_id")
-                                                    }]
-                                                
-                                                files_added += [module_item.get("content_id")]
-                                                async with session.get(
-                                                    f"{API_URL}/files/{module_item.get('content_id')}",
-                                                    params={"enrollment_state": "active"},
-                                                    headers=headers
-                                                ) as response:
-                                                    if response.status == 200:
-                                                        file = await response.json()
-                                                        user_data["files"] += [{
-                                                            "course_id": course_id,
-                                                            "id": file.get("id"),
-                                                            "type": file.get("type"),
-                                                            "folder_id": file.get("folder_id"),
-                                                            "display_name": file.get("display_name"),
-                                                            "filename": file.get("filename"),
-                                                            "url": file.get("url"),
-                                                            "size": file.get("size"),
-                                                            "updated_at": file.get("updated_at"),
-                                                            "locked": file.get("locked"),
-                                                            "lock_explanation": file.get("lock_explanation"),
-                                                            "module_id": module_id,
-                                                            "module_name": module_name
-                                                        }]
-                                            elif item_type == "Assignment":
-                                                assignments_added += [module_item.get("content_id")]
-                                                async with session.get(
-                                                    f"{API_URL}/courses/{course_id}/assignments/{module_item.get('content_id')}",
-                                                    params={"enrollment_state": "active"},
-                                                    headers=headers
-                                                ) as response:
-                                                    if response.status == 200:
-                                                        assignment = await response.json()
-                                                        user_data["assignments"] += [{
-                                                            "id": assignment.get("id"),
-                                                            "type": assignment.get("type"),
-                                                            "name": assignment.get("name"),
-                                                            "description": assignment.get("description"),
-                                                            "created_at": assignment.get("created_at"),
-                                                            "updated_at": assignment.get("updated_at"),
-                                                            "due_at": assignment.get("due_at"),
-                                                            "course_id": assignment.get("course_id"),
-                                                            "submission_types": assignment.get("submission_types"),
-                                                            "can_submit": assignment.get("can_submit"),
-                                                            "graded_submission_exist": assignment.get("graded_submission_exist"),
-                                                            "can_submit": assignment.get("can_submit"),
-                                                            "graded_submissions_exist": assignment.get("graded_submission_exist"),
-                                                            "module_id": module_id,
-                                                            "module_name": module_name,
-                                                            "content": extract_links_from_html(assignment.get("description") or "")
-                                                        }]
-                                            elif item_type == "Quiz":
-                                                quizzes_added += [module_item.get("content_id")]
-                                                async with session.get(
-                                                    f"{API_URL}/courses/{course_id}/quizzes/{module_item.get('content_id')}",
-                                                    params={"enrollment_state": "active"},
-                                                    headers=headers
-                                                ) as response:
-                                                    if response.status == 200:
-                                                        quiz = await response.json()
-                                                        user_data["quizzes"] += [{
-                                                            "id": quiz.get("id"),
-                                                            "title": quiz.get("title"),
-                                                            "preview_url": quiz.get("preview_url"),
-                                                            "description": quiz.get("description"),
-                                                            "quiz_type": quiz.get("quiz_type"),
-                                                            "time_limit": quiz.get("time_limit"),
-                                                            "allowed_attempts": quiz.get("allowed_attempts"),
-                                                            "points_possible": quiz.get("points_possible"),
-                                                            "due_at": quiz.get("due_at"),
-                                                            "locked_for_user": quiz.get("locked_for_user"),
-                                                            "lock_explanation": quiz.get("lock_explanation"),
-                                                            "module_id": module_id,
-                                                            "module_name": module_name,
-                                                            "course_id": course_id
-                                                        }]
-                                    else:
-                                        break
-                                    module_page_number += 1
-                    else:
-                        break
-                    page_number += 1
-
-            # getting extra files
-            #
-            print("  - Getting additional files...")
-            page_number = 1
-
-            while True:
-                async with session.get(
-                    f"{API_URL}/courses/{course_id}/files",
-                    params={"enrollment_state": "active", "include[]": "all_courses", "page": page_number},
-                    headers=headers
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        print(f"Error fetching files: {error_text}")
-                        break
-                        
-                    course_files = await response.json()
-                
-                    
-                    if type(course_files) is list and course_files != []:
-                        for i in range(len(course_files)):
-                            #stores the file_name and file_URL of the syllabus if syllabus_body is a list
-                            #syllabus_body is a list if the course has no syllabus_body to begin with
-                            if type(course.get("syllabus_body")) is list and course_files[i].get("name") and "syllabus" in course_files[i].get("name"):
-                                course["syllabus_body"] += [{
-                                    course_files[i].get("name"): course_files[i].get("url")
-                                }]
-                            
-                            if course["syllabus_body"] == [] and type(course.get("syllabus_body")) is list and course_files[i].get("name") and "syllabus" in course_files[i].get("name"):
-                                course["syllabus_body"] += [{
-                                course_files[i].get("filename"): course_files[i].get("url")
-                            }]
-
-                            #stores the file object if the file is not already in the files_added list
-                            if course_files[i].get("id") not in files_added:
-                                user_data["files"] += [{
-                                    "course_id": course_id,
-                                    "id": course_files[i].get("id"),
-                                    "type": course_files[i].get("type"),
-                                    "folder_id": course_files[i].get("folder_id"),
-                                    "display_name": course_files[i].get("display_name"),
-                                    "filename": course_files[i].get("filename"),
-                                    "url": course_files[i].get("url"),
-                                    "size": course_files[i].get("size"),
-                                    "updated_at": course_files[i].get("updated_at"),
-                                    "locked": course_files[i].get("locked"),
-                                    "lock_explanation": course_files[i].get("lock_explanation"),
-                                    "module_id": None,
-                                    "module_name": None
-                                }]
-                    else:
-                        break
-                    page_number += 1
-            #
-            # getting files
-
-            # getting announcements
-            #
-            print("  - Getting announcements...")
-            for i in range(1, 3, 1):
-                async with session.get(
-                    f"{API_URL}/announcements",
-                    params={
-                        "pager": i,
-                        "context_codes[]": [f"course_{course_id}"],
-                        "enrollment_state": "active"
-                    },
-                    headers=headers
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        print(f"Error fetching announcements: {error_text}")
-                        break
-                        
-                    announcements = await response.json()
-                    
-                    for announcement in announcements:
-                        user_data["announcements"] += [{
-                            "id": announcement.get("id"),
-                            "title": announcement.get("title"),
-                            "message": announcement.get("message"),
-                            "course_id": course_id,
-                            "posted_at": announcement.get("posted_at"),
-                            "discussion_type": announcement.get("discussion_type"),
-                            "course_name": course.get("name")
-                        }]
-
-            # getting calendar events
-            #
-            print("  - Getting calendar events...")
-            calendar_events = await find_events(API_URL, API_TOKEN, f"course_{course_id}", session)
-            
-            if calendar_events:
-                for event in calendar_events:
-                    user_data["calendar_events"] += [{
-                        "id": event.get("id"),
-                        "title": event.get("title"),
-                        "start_at": event.get("start_at"),
-                        "end_at": event.get("end_at"),
-                        "description": event.get("description"),
-                        "location_name": event.get("location_name"),
-                        "location_address": event.get("location_address"),
-                        "context_code": event.get("context_code"),
-                        "context_name": event.get("context_name"),
-                        "all_context_codes": event.get("all_context_codes"),
-                        "url": event.get("url"),
-                        "course_id": course_id
-                    }]
-
-            # getting home page
-            #
-            print("  - Checking for home page...")
-            if course.get("syllabus_body") == [] or course.get("syllabus_body") is None or course.get("syllabus_body") == "":
-                try:
-                    async with session.get(
-                        f"{API_URL}/courses/{course_id}/front_page",
-                        params={"enrollment_state": "active"},
-                        headers=headers
-                    ) as response:
-                        if response.status == 200:
-                            home_page = await response.json()
-                            course.update({"syllabus_body": home_page.get("front_page")})
-                except Exception as e:
-                    print(f"Error fetching home page: {str(e)}")
-                    pass
-            #
-            # getting home page
-           
-            # updating syllabi
-            #
-            print("  - Processing syllabus content...")
-            course_syllabus = course.get("syllabus_body")
-            if course_syllabus:  
-                
-                if isinstance(course_syllabus, str):
-                    # Handle case where syllabus is HTML content with embedded links
-                    links = extract_links_from_html(course_syllabus)
-                    
-                    if links:  
-                        final_text = await get_text_from_links(links, API_URL, API_TOKEN)
-                        course_syllabus += f"\n\n{final_text}"
-                
-                elif isinstance(course_syllabus, list):
-                    # Handle case where syllabus is a list of direct file link objects
-                    final_text = ""
-                    for link in course_syllabus:
-                        final_text += await get_text_from_links(link, API_URL, API_TOKEN)
-                    course_syllabus = final_text
-
-                # update the course with the processed syllabus
-                course.update({"syllabus_body": course_syllabus})
-            #
-            # updating syllabi
-
-            # getting assignments
-            # 
-            print("  - Getting assignments...")
-            page_number = 1
-            
-            while True:
-                async with session.get(
-                    f"{API_URL}/courses/{course_id}/assignments",
-                    params={"enrollment_state": "active", "page": page_number},
-                    headers=headers
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        print(f"Error fetching assignments: {error_text}")
-                        break
-                        
-                    course_assignments = await response.json()
-
-                    if type(course_assignments) is list and course_assignments != []:
-                        for i in range(len(course_assignments)):
-                            if course_assignments[i].get("id") not in assignments_added:
-                                user_data["assignments"] += [{
-                                    "id": course_assignments[i].get("id"),
-                                    "type": course_assignments[i].get("type"),
-                                    "name": course_assignments[i].get("name"),
-                                    "description": course_assignments[i].get("description"),
-                                    "created_at": course_assignments[i].get("created_at"),
-                                    "updated_at": course_assignments[i].get("updated_at"),
-                                    "due_at": course_assignments[i].get("due_at"),
-                                    "course_id": course_id,
-                                    "submission_types": course_assignments[i].get("submission_types"),
-                                    "can_submit": course_assignments[i].get("can_submit"),
-                                    "graded_submission_exist": course_assignments[i].get("graded_submission_exist"),
-                                    "can_submit": course_assignments[i].get("can_submit"),
-                                    "graded_submissions_exist": course_assignments[i].get("graded_submission_exist"),
-                                    "module_id": None,
-                                    "module_name": None,
-                                    "content": extract_links_from_html(course_assignments[i].get("description") or "")
-                                }]
-                    else:
-                        break
-                    page_number += 1
-
-            # getting quizzes
-            # 
-            print("  - Getting quizzes...")
-            page_number = 1
-            
-            while True:
-                async with session.get(
-                    f"{API_URL}/courses/{course_id}/quizzes",
-                    params={"enrollment_state": "active", "page": page_number},
-                    headers=headers
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        print(f"Error fetching quizzes: {error_text}")
-                        break
-                        
-                    course_quizzes = await response.json()
-
-                    if type(course_quizzes) is list and course_quizzes != []:
-                        for i in range(len(course_quizzes)):
-                            if course_quizzes[i].get("id") not in quizzes_added:
-                                user_data["quizzes"] += [{
-                                    "id": course_quizzes[i].get("id"),
-                                    "title": course_quizzes[i].get("title"),
-                                    "preview_url": course_quizzes[i].get("preview_url"),
-                                    "description": course_quizzes[i].get("description"),
-                                    "quiz_type": course_quizzes[i].get("quiz_type"),
-                                    "time_limit": course_quizzes[i].get("time_limit"),
-                                    "allowed_attempts": course_quizzes[i].get("allowed_attempts"),
-                                    "points_possible": course_quizzes[i].get("points_possible"),
-                                    "due_at": course_quizzes[i].get("due_at"),
-                                    "locked_for_user": course_quizzes[i].get("locked_for_user"),
-                                    "lock_explanation": course_quizzes[i].get("lock_explanation"),
-                                    "module_id": None,
-                                    "module_name": None,
-                                    "course_id": course_id
-                                }]
-                    else:
-                        break
-                    page_number += 1
+        # Courses are collected concurrently (a few at a time to stay under Canvas rate limits)
+        # and merged back in course order so the output matches a sequential run
+        semaphore = asyncio.Semaphore(COURSE_CONCURRENCY)
+
+        async def get_course_data_limited(course):
+            async with semaphore:
+                return await get_course_data(session, API_URL, API_TOKEN, headers, course)
+
+        course_tasks = [asyncio.create_task(get_course_data_limited(course)) for course in user_data["courses"]]
+        try:
+            all_course_data = await asyncio.gather(*course_tasks)
+        except BaseException:
+            # One course failed: stop the others before the session closes under them
+            for task in course_tasks:
+                task.cancel()
+            await asyncio.gather(*course_tasks, return_exceptions=True)
+            raise
+        for course_data in all_course_data:
+            for key, items in course_data.items():
+                user_data[key] += items
 
     print("\n=== SECTION 3: Finalizing Data Collection ===")
-    user_data_json = json.dumps(user_data)
-    user_data_size_bytes = len(user_data_json.encode('utf-8'))
+    # Measure the encoded size chunk by chunk instead of building the whole JSON string and a UTF-8 copy of it
+    user_data_size_bytes = sum(len(chunk.encode('utf-8')) for chunk in json.JSONEncoder().iterencode(user_data))
     print(f"\nTotal size of user_data: {user_data_size_bytes:,} bytes")
     print(f"Size in MB: {user_data_size_bytes / (1024 * 1024):.2f} MB")
     print("\n=== Data Collection Complete ===")
@@ -85,6 +85,7 @@ async def create_event(
         duplicate_interval: int = None,
         duplicate_frequency: str = None,
         duplicate_append_iterator: bool = None,
+        session: aiohttp.ClientSession = None,
     ) -> dict:
     """
     Create a calendar event using the Canvas API.
@@ -105,6 +106,7 @@ async def create_event(
         duplicate_interval (int, optional): Interval between duplicates; defaults to 1.
         duplicate_frequency (str, optional): Frequency ('daily', 'weekly', or 'monthly'); defaults to "weekly".
         duplicate_append_iterator (bool, optional): If True, appends an increasing counter to the title.
+        session (aiohttp.ClientSession, optional): An existing aiohttp session to use.
 
     Returns:
         dict: The JSON response from the Canvas API if the request is successful.
@@ -146,10 +148,19 @@ async def create_event(
     if duplicate_append_iterator is not None:
         data["calendar_event[duplicate][append_iterator]"] = "true" if duplicate_append_iterator else "false"
 
-    async with aiohttp.ClientSession() as session:
+    # Make the API call
+    should_close_session = False
+    if session is None:
+        session = aiohttp.ClientSession()
+        should_close_session = True
+
+    try:
         async with session.post(url, headers=headers, data=data) as response:
             response.raise_for_status()
             return await response.json()
+    finally:
+        if should_close_session:
+            await session.close()
 
 
 if __name__ == "__main__":
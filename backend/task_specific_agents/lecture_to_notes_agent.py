@@ -24,48 +24,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# === Utility: Download a file asynchronously ===
-async def async_file_download(file_url, api_token):
-    print("=== ASYNC FILE DOWNLOAD: Starting ===")
-    print("File URL: ", file_url)
-    print("API Token: ", api_token)
-    print("====================================")
-    async with aiohttp.ClientSession() as session:
-        async with session.get(file_url, headers={"Authorization": f"Bearer {api_token}"}) as response:
-            if response.status != 200:
-                logger.error(f"Failed to download file. Status code: {response.status}")
-                raise Exception(f"Failed to download file. Status code: {response.status}")
-            return await response.read()
-
-# === Utility: Compile LaTeX using tectonic ===
-def compile_with_tectonic(tex_path, output_dir):
-    try:
-        subprocess.run(
-            ["tectonic", tex_path, "--outdir", output_dir],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        logger.info("✅ PDF created successfully using Tectonic.")
-        return True
-    except subprocess.CalledProcessError as e:
-        logger.error("❌ Tectonic compilation failed:\n" + e.stderr.decode())
-        return False
-
-# === Core Function: Convert prompt to PDF ===
-async def prompt_to_pdf(prompt: str, user_id, domain: str, file_name: str):
-    client = AsyncOpenAI(api_key=os.getenv("LECTURE_TO_PDF_API_KEY"))
-    output_dir = f"{CanvasAI_dir}/media_output/{domain}/{user_id}"
-    latex_file_path = os.path.join(output_dir, "latexoutput.tex")
-
-    os.makedirs(output_dir, exist_ok=True)
-
-    response = await client.chat.completions.create(
-        model="ft:gpt-4o-mini-2024-07-18:personal:input-to-latex:AjGUuIsy",
-        messages=[
-            {
-                "role": "system",
-                "content": r"""
+# Fine-tuned model and system prompt for LaTeX note generation, built once at import
+# instead of on every prompt_to_pdf attempt
+LATEX_MODEL = "ft:gpt-4o-mini-2024-07-18:personal:input-to-latex:AjGUuIsy"
+LATEX_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": r"""
                             You are an advanced LaTeX generation assistant designed to convert user input into highly detailed, accurate, and properly formatted LaTeX documents.
 
                             Your output must follow **all** of these strict rules:
@@ -172,7 +136,49 @@ async def prompt_to_pdf(prompt: str, user_id, domain: str, file_name: str):
                             🎯 **Your Goal**
                             Produce LaTeX documents that are clean, educational, well-formatted, and 100% compilable with **Tectonic** or any strict LaTeX engine. All content must fit within the printable page area — no overflows allowed.
                             """
-            },
+}
+
+# === Utility: Download a file asynchronously ===
+async def async_file_download(file_url, api_token):
+    print("=== ASYNC FILE DOWNLOAD: Starting ===")
+    print("File URL: ", file_url)
+    print("API Token: ", api_token)
+    print("====================================")
+    async with aiohttp.ClientSession() as session:
+        async with session.get(file_url, headers={"Authorization": f"Bearer {api_token}"}) as response:
+            if response.status != 200:
+                logger.error(f"Failed to download file. Status code: {response.status}")
+                raise Exception(f"Failed to download file. Status code: {response.status}")
+            return await response.read()
+
+# === Utility: Compile LaTeX using tectonic ===
+def compile_with_tectonic(tex_path, output_dir):
+    try:
+        subprocess.run(
+            ["tectonic", tex_path, "--outdir", output_dir],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        logger.info("✅ PDF created successfully using Tectonic.")
+        return True
+    except subprocess.CalledProcessError as e:
+        logger.error("❌ Tectonic compilation failed:\n" + e.stderr.decode())
+        return False
+
+# === Core Function: Convert prompt to PDF ===
+async def prompt_to_pdf(prompt: str, user_id, domain: str, file_name: str, client: AsyncOpenAI = None):
+    if client is None:
+        client = AsyncOpenAI(api_key=os.getenv("LECTURE_TO_PDF_API_KEY"))
+    output_dir = f"{CanvasAI_dir}/media_output/{domain}/{user_id}"
+    latex_file_path = os.path.join(output_dir, "latexoutput.tex")
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    response = await client.chat.completions.create(
+        model=LATEX_MODEL,
+        messages=[
+            LATEX_SYSTEM_MESSAGE,
             {"role": "user", "content": prompt}
         ],
     )
@@ -214,19 +220,22 @@ async def _real_processing(file_url, file_name, user_id, domain, canvas_api_toke
         return f"Error: File text could not be extracted. Details: {str(e)}"
 
     logger.info("\n=== STAGE 3: Generating PDF (5 attempts max) ===")
-    for i in range(5):
-        logger.info(f"\nAttempt {i + 1}/5:")
-        try:
-            status = await prompt_to_pdf(file_text, user_id, handler.domain, file_name)
-            if status == "PDF TO LATEX SUCCESSFUL":
-                logger.info("\n=== SUCCESS ===")
-                return "Lecture file to notes pdf successful"
-        except Exception as e:
-            logger.error(f"Attempt failed: {str(e)}")
-            if i == 4:
-                handler.delete_chat_context()
-                logger.error("\n=== FAILED AFTER 5 ATTEMPTS ===")
-                return "ERROR: pdf couldn't be created"
+    # Each job runs on its own event loop, so the client can't be shared process-wide;
+    # one client per job keeps its connection open across retry attempts
+    async with AsyncOpenAI(api_key=os.getenv("LECTURE_TO_PDF_API_KEY")) as client:
+        for i in range(5):
+            logger.info(f"\nAttempt {i + 1}/5:")
+            try:
+                status = await prompt_to_pdf(file_text, user_id, handler.domain, file_name, client=client)
+                if status == "PDF TO LATEX SUCCESSFUL":
+                    logger.info("\n=== SUCCESS ===")
+                    return "Lecture file to notes pdf successful"
+            except Exception as e:
+                logger.error(f"Attempt failed: {str(e)}")
+                if i == 4:
+                    handler.delete_chat_context()
+                    logger.error("\n=== FAILED AFTER 5 ATTEMPTS ===")
+                    return "ERROR: pdf couldn't be created"
 
     return "ERROR: pdf couldn't be created after 5 attempts"
 
@@ -1,442 +1,410 @@
 import asyncio
 import os 
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
+import httpx
+import aiohttp
+import hashlib
+import inspect
 import json
-import sys
-from pathlib import Path
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from string import Template
+from types import MappingProxyType, SimpleNamespace
 import tzlocal
 from datetime import datetime
-from typing import List, Union
-from pydantic import BaseModel
-from backend.task_specific_agents.lecture_to_notes_agent import lecture_file_to_notes_pdf
-from backend.task_specific_agents.grade_calculator_agent import calculate_grade
-
-# Add the project root directory to Python path
-root_dir = Path(__file__).resolve().parent.parent
-sys.path.append(str(root_dir))
-
-from backend.task_specific_agents.calendar_agent import create_event
+from typing import TYPE_CHECKING, AsyncIterator, Optional
 
-# Define the context models locally
-class ContextPair(BaseModel):
-    message: str
-    function: List[str]
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
-class ContextEntry(BaseModel):
-    role: str
-    content: List[ContextPair]
+# orjson is used for JSON on the chat path when installed; its decode errors subclass json.JSONDecodeError
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-class ClassesDict(BaseModel):
-    id: str
-    name: str
-    selected: str
+# fastjsonschema compiles the function parameter schemas into validators when installed
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
 
-class ContextEntry2(BaseModel):
-    role: str
-    id: str
-    domain: str
-    recentDOCS: List[str]
-    content: List[str]
-    classes: List[ClassesDict]
+# HTTP/2 for OpenAI requests needs the optional h2 package
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+from backend.task_specific_agents.grade_calculator_agent import calculate_grade
+from backend.task_specific_agents.calendar_agent import create_event
+from vectordb.db import VectorDatabase
 
-class ContextObject(BaseModel):
-    context: List[Union[ContextEntry, ContextEntry2]]
+if TYPE_CHECKING:
+    # Imported only for annotations; endpoints imports this module
+    from endpoints import ContextObject
 
 load_dotenv()
 
+# Per-call dumps of search parameters and results are debug-level, so they cost nothing
+# unless debug logging is turned on
+logger = logging.getLogger(__name__)
+
 
 openai_api_key = os.getenv("OPENAI_API_KEY")
 canvas_api_token = os.getenv("CANVAS_API_KEY")
 
+# Looked up once instead of on every prompt build
+LOCAL_TIMEZONE = tzlocal.get_localzone()
 
+# Format of the current time shown in the system prompts
+CURRENT_TIME_FORMAT = "%Y-%m-%d %I:%M %p"
+# [minute since epoch, formatted time] for the most recent call to current_time_text
+_current_time_memo = [None, ""]
 
-class ConversationHandler:
-    def __init__(self, student_name, student_id, courses, domain, chat_history,canvas_api_token):
-        self.student_name = student_name
-        self.student_id = student_id
-        self.courses = courses
-        self.domain = domain
-        self.chat_history = chat_history
-        self.canvas_api_url = domain
-        self.canvas_api_token = canvas_api_token
-        self.openai_api_key = openai_api_key
-        self.hf_api_token = os.getenv("HUGGINGFACE_API_KEY")
-        # Define valid types and time range definitions
-        self.valid_types = ["assignment", "file", "quiz", "announcement", "event", "syllabus"]
-        self.time_range_definitions = {
-            "NEAR_FUTURE": {
-                "description": "Items within the next 10 days, including upcoming assignments.",
-                "logic": "now <= item <= now + 10d"
-            },
-            "FUTURE": {
-                "description": "Items to occur after the next 10 days.",
-                "logic": "now + 10d <= item"
-            },
-            "RECENT_PAST": {
-                "description": "Items occurred within the past 10 days.",
-                "logic": "now - 10d <= item <= now"
-            },
-            "PAST": {
-                "description": "Items occurred before the past 10 days.",
-                "logic": "item <= now - 10d"
-            },
-            "ALL_TIME": {
-                "description": "Items that exist at any point in time, regardless of when.",
-                "logic": "item exists"
-            }
-        }
-        self.generality_definitions = {
-            
-            "LOW": {
-                "description": "Used when the user is looking for a small set of focused results about a narrow topic",
-                "examples": ["Find quizzes about neural networks in CMPSC 444", "Show me this week's assignments"],
-                "result_type": "Focused set of results"
-            },
-            "MEDIUM": {
-                "description": "Default level. Used for balanced queries that need a moderate number of results",
-                "examples": ["What assignments do I have?", "Show my upcoming deadlines"],
-                "result_type": "Balanced set of results"
-            },
-            "HIGH": {
-                "description": "Used for broad, exploratory queries or when comprehensiveness is important",
-                "examples": ["Show me everything for my Biology class", "What are the assignments for this semester in Physics?"],
-                "result_type": "Comprehensive set of results"
-            }
-        }
 
+def current_time_text() -> str:
+    """Return the local time in CURRENT_TIME_FORMAT, reformatting at most once a minute"""
+    minute = int(time.time() // 60)
+    if minute != _current_time_memo[0]:
+        _current_time_memo[:] = [minute, datetime.fromtimestamp(minute * 60, LOCAL_TIMEZONE).strftime(CURRENT_TIME_FORMAT)]
+    return _current_time_memo[1]
 
-    def define_functions(self):
-        """Returns a list of function definitions for the OpenAI API"""
-        functions = [
-            {
-                "name": "find_events_and_assignments",
-                "description": "Search for Canvas materials using vector embeddings for semantic retrieval.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "search_parameters": {
-                            "type": "object",
-                            "properties": {
-                                "course_id": {
-                                    "type": "string",
-                                    "description": "Specific Course ID(s) (e.g. 2372294) when mentioned by the user. 'all_courses': if the user asks for information about all courses or they don't mention a specific course"
-                                },
-                                "time_range": {
-                                    "type": "string", 
-                                    "enum": ["NEAR_FUTURE", "FUTURE", "RECENT_PAST", "PAST", "ALL_TIME"],
-                                    "description": "Temporal context for search"
-                                },
-                                "generality": {
-                                    "type": "string", 
-                                    "enum": ["LOW", "MEDIUM", "HIGH"],
-                                    "description": "Context for how many items to retrieve"
-                                },
-                                "item_types": {
-                                    "type": "array",
-                                    "items": {
-                                        "type": "string",
-                                        "enum": ["assignment","quiz","event", "syllabus"]
-                                    },
-                                    "description": "This should always be ['assignments','events']"
-                                },
-                                "specific_dates": {
-                                    "type": "array",
-                                    "items": {
-                                        "type": "string",
-                                        "format": "date"
-                                    },
-                                    "description": "ISO8601 format dates mentioned in query if a specific date is mentioned."
-                                },
-                                "keywords": {
-                                    "type": "array",
-                                    "items": {
-                                        "type": "string" 
-                                    },
-                                    "description": "keywords from the user's query to help with semantic search"
-                                },
-                                "query": {
-                                    "type": "string",
-                                    "description": "User's original query for semantic search"
-                                }
-                            },
-                            "required": ["course_id", "time_range", "item_types","generality","keywords", "query"]
-                        }
-                    },
-                    "required": ["search_parameters"]
-                }
-            },
-            {
-                "name": "create_event",
-                "description": "Create a calendar event or multiple events using the Canvas API.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "context_code": {
-                            "type": "string",
-                            "description": "This should always be the students user id. This should be in the form "
-                        },
-                        "title": {
-                            "type": "string",
-                            "description": "Title of the event."
-                        },
-                        "start_at": {
-                            "type": "string",
-                            "description": "Start date/time in ISO8601 format."
-                        },
-                        "end_at": {
-                            "type": "string",
-                            "description": "End date/time in ISO8601 format."
-                        },
-                        "description": {
-                            "type": "string",
-                            "description": "Description of the event."
-                        },
-                        "location_name": {
-                            "type": "string",
-                            "description": "Name of the location."
-                        },
-                        "location_address": {
-                            "type": "string",
-                            "description": "Address of the location."
-                        },
-                        "all_day": {
-                            "type": "boolean",
-                            "description": "Indicates if the event lasts all day.",
-                            "default": False
-                        },
-                        "duplicate_count": {
-                            "type": "integer",
-                            "description": "Number of times to duplicate the event (max 200)."
-                        },
-                        "duplicate_interval": {
-                            "type": "integer",
-                            "description": "Interval between duplicates; defaults to 1."
-                        },
-                        "duplicate_frequency": {
-                            "type": "string",
-                            "enum": ["daily", "weekly", "monthly"],
-                            "description": "Frequency at which to duplicate the event."
-                        },
-                        "duplicate_append_iterator": {
-                            "type": "boolean",
-                            "description": "If true, an increasing counter will be appended to the event title for each duplicate (e.g., Event 1, Event 2, etc.)."
-                        },
-                        "canvas_base_url": {
-                            "type": "string",
-                            "description": "This should the provided domain of the user"
-                        }
-                    },
-                    "required": [
-                        "context_code",
-                        "title",
-                        "start_at",
-                        "canvas_base_url"
-                    ]
-                }
-            },
-            {
-                "name": "find_course_information",
-                "description": "Find course information using the vector search function",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "search_parameters": {
-                            "type": "object",
-                            "properties": {
-                                "course_id": {
-                                    "type": "string",
-                                    "description": "Specific Course ID(s) (e.g. 2372294) when mentioned by the user. 'all_courses': if the user asks for information about all courses"
-                                },
-                                "time_range": {
-                                    "type": "string", 
-                                    "enum": ["NEAR_FUTURE", "FUTURE", "RECENT_PAST", "PAST", "ALL_TIME"],
-                                    "description": "Temporal context for search"
-                                },
-                                "generality": {
-                                    "type": "string", 
-                                    "enum": ["LOW", "MEDIUM", "HIGH"],
-                                    "description": "Context for how many items to retrieve"
-                                },
-                                "item_types": {
-                                    "type": "array",
-                                    "items": {
-                                        "type": "string",
-                                        "enum": ["assignment", "file", "quiz", "announcement", "event", "syllabus"]
-                                    },
-                                    "description": "This should always be ['syllabus']"
-                                },
-                               "specific_dates": {
-                                    "type": "array",
-                                    "items": {
-                                        "type": "string",
-                                        "format": "date"
-                                    },
-                                    "description": "ISO8601 format dates mentioned in query if a specific date is mentioned."
-                                },
-                                "keywords": {
-                                    "type": "array",
-                                    "items": {
-                                        "type": "string" 
-                                    },
-                                    "description": "This should always be ['course information','course materials'] l"
-                                },
-                                "query": {
-                                    "type": "string",
-                                    "description": "User's original query for semantic search"
-                                }
-                            },
-                            "required": ["course_id", "time_range", "item_types","generality","keywords", "query"]
-                        }
-                    },
-                    "required": ["search_parameters"]
-                }
-            },
-            {
-                "name": "create_notes",
-                "description": "Create notes for a file found in the vector search function",
-                "parameters": {
-                  "type": "object",
-                    "properties": {
-                       "user_id": {
-                       "type": "string",
-                            "description": "The user's ID number"
-                       },
-                       "domain": {
-                            "type": "string",
-                            "description": "The user's canvas base url"
-                        },
-                           "search_parameters": {
-                            "type": "object",
-                            "properties": {
-                            "course_id": {
-                                    "type": "string",
-                                    "description": "Specific Course ID"
-                                },
-                                "time_range": {
-                                    "type": "string", 
-                                    "enum": ["NEAR_FUTURE", "FUTURE", "RECENT_PAST", "PAST", "ALL_TIME"],
-                                    "description": "Temporal context for search"
-                                },
-                                "generality": {
-                                    "type": "string", 
-                                    "enum": ["LOW", "MEDIUM", "HIGH",],
-                                    "description": "Context for how many items to retrieve"
-                                },
-                            "item_types": {
-                                    "type": "array",
-                                    "items": {
-                                        "type": "string",
-                                        "enum": ["assignment", "file", "quiz", "announcement", "event", "syllabus"]
-                                    },
-                                    "description": "This should always be ['file']"
-                                },
-                                "specific_dates": {
-                                "type": "array",
-                                    "items": {
-                                        "type": "string",
-                                        "format": "date"
-                                    },
-                                    "description": "ISO8601 format dates mentioned in query if a specific date is mentioned."
-                                },
-                                "keywords": {
-                                "type": "array",
-                                    "items": {
-                                        "type": "string" 
-                                    },
-                                    "description": "This should always be ['lecture','notes','slides']"
-                                },
-                                "query": {
-                                    "type": "string",
-                                    "description": "User's original query for semantic search"
-                                }
-                            },
-                            "required": ["course_id", "time_range", "item_types", "generality", "keywords", "query"]
-                        }
-                    },
-                       "required": ["user_id", "domain", "search_parameters"]
-                }
-            },
-            {
-                "name": "calculate_grade",
-                "description": "Calculate the grade required to achieve a certain letter grade on an assignment",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "target_grade_letter": {
-                            "type": "string",
-                            "description": "The target grade letter of the assignment"
-                        },
-                        "student_id": {
-                            "type": "string",
-                            "description": "The user's ID number"
-                        },
-                        "search_parameters": {
-                            "type": "object",
-                            "properties": {
-                                "course_id": {
-                                    "type": "string",
-                                    "description": "Specific Course ID"
-                                },
-                                "time_range": {
-                                    "type": "string", 
-                                    "enum": ["NEAR_FUTURE", "FUTURE", "RECENT_PAST", "PAST", "ALL_TIME"],
-                                    "description": "Temporal context for search"
-                                },
-                                "generality": {
-                                    "type": "string", 
-                                    "enum": ["LOW", "MEDIUM", "HIGH",],
-                                    "description": "Context for how many items to retrieve"
-                                },
-                                "item_types": {
-                                    "type": "array",
-                                    "items": {
-                                        "type": "string",
-                                        "enum": ["assignment", "file", "quiz", "announcement", "event", "syllabus"]
-                                    },
-                                    "description": "This should always be ['assignment']"
-                                },
-                                "specific_dates": {
-                                    "type": "array",
-                                    "items": {
-                                        "type": "string",
-                                        "format": "date"
-                                    },
-                                    "description": "ISO8601 format dates mentioned in query if a specific date is mentioned."
-                                },
-                                "keywords": {
-                                    "type": "array",
-                                    "items": {
-                                        "type": "string" 
-                                    },
-                                    "description": "this should always be ['assignment']"
-                                },
-                                "query": {
-                                    "type": "string",
-                                    "description": "User's original query for semantic search"
-                                }
-                            },
-                            "required": ["course_id", "time_range", "item_types", "generality", "keywords", "query"]
-                        }
-                    }   
-                },
-                "required": ["target_grade_letter","student_id", "search_parameters"]
-            }
-        ]
-        return functions
-    
-    def define_system_context(self):
-        local_tz = tzlocal.get_localzone()
-        current_time = datetime.now(local_tz).strftime("%Y-%m-%d %I:%M %p")
-        system_context = f"""
+
+OPENAI_MODEL = "gpt-4o"
+# Replies are short date/assignment answers; a tighter cap also shrinks the
+# per-request token reservation in the rate limiter
+OPENAI_MAX_TOKENS = 512
+# The OpenAI client retries 408/409/429/5xx responses with exponential backoff,
+# honoring the Retry-After header; 400/401/403 fail immediately
+OPENAI_MAX_RETRIES = 5
+
+# Created once per event loop instead of once per ConversationHandler. The connection pool
+# behind it lets requests reuse open TLS connections instead of reconnecting for each chat.
+_openai_client = None
+_openai_client_loop = None
+
+
+def _get_openai_client() -> AsyncOpenAI:
+    """Return the shared AsyncOpenAI client, creating it on first use in the running event loop"""
+    global _openai_client, _openai_client_loop
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Handlers built outside a loop share the client made for no loop
+        loop = None
+    if _openai_client is None or _openai_client_loop is not loop:
+        _openai_client = AsyncOpenAI(
+            api_key=openai_api_key,
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+                timeout=60
+            )
+        )
+        _openai_client_loop = loop
+    return _openai_client
+
+
+# aiohttp session shared by the Canvas tool calls (create_event, calculate_grade).
+# Created on first use, since it must belong to the running event loop.
+_canvas_session = None
+_canvas_session_loop = None
+
+
+def _get_canvas_session() -> aiohttp.ClientSession:
+    """Return the shared Canvas aiohttp session, creating it on first use in the running event loop"""
+    global _canvas_session, _canvas_session_loop
+    loop = asyncio.get_running_loop()
+    if _canvas_session is None or _canvas_session.closed or _canvas_session_loop is not loop:
+        _canvas_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=10, ttl_dns_cache=300, keepalive_timeout=60)
+        )
+        _canvas_session_loop = loop
+    return _canvas_session
+
+
+async def close_shared_clients():
+    """Close the shared OpenAI client and Canvas session; call when the server shuts down"""
+    global _openai_client, _canvas_session
+    if _openai_client is not None:
+        await _openai_client.close()
+        _openai_client = None
+    if _canvas_session is not None:
+        await _canvas_session.close()
+        _canvas_session = None
+
+
+# VectorDatabase instances by (JSON path, Hugging Face token). Building one reads the user's
+# JSON file and opens the ChromaDB client, collection and embedding function, and loading the
+# local data parses the whole file, so both are done once and redone only when the file changes.
+# Only the most recently used students are kept, so memory doesn't grow with every user.
+VECTOR_DB_CACHE_MAX_ENTRIES = 32
+_vector_dbs = OrderedDict() # key -> VectorDatabase, least recently used first
+_vector_db_loaded_mtimes = {} # key -> st_mtime_ns of the JSON file when it was last loaded
+_vector_db_locks = {} # key -> asyncio.Lock, so concurrent searches don't load the same file twice
+
+
+def _evict_vector_dbs():
+    """Drop the least recently used VectorDatabase instances over the limit, skipping any in use"""
+    for key in list(_vector_dbs):
+        if len(_vector_dbs) <= VECTOR_DB_CACHE_MAX_ENTRIES:
+            break
+        lock = _vector_db_locks.get(key)
+        if lock is not None and lock.locked():
+            continue
+        del _vector_dbs[key]
+        _vector_db_loaded_mtimes.pop(key, None)
+        _vector_db_locks.pop(key, None)
+
+
+async def _get_vector_db(vector_db_path: str, hf_api_token: str) -> VectorDatabase:
+    """Return the shared VectorDatabase for a student's data file with its local data loaded"""
+    key = (vector_db_path, hf_api_token)
+    lock = _vector_db_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        vector_db = _vector_dbs.get(key)
+        if vector_db is None:
+            print("Initializing VectorDatabase...")
+            vector_db = _vector_dbs[key] = VectorDatabase(vector_db_path, hf_api_token=hf_api_token)
+        else:
+            _vector_dbs.move_to_end(key)
+
+        try:
+            mtime = os.stat(vector_db_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        # A missing file is never treated as loaded, so it is picked up once it exists
+        if mtime is None or _vector_db_loaded_mtimes.get(key) != mtime:
+            await vector_db.load_local_data_from_json()
+            _vector_db_loaded_mtimes[key] = mtime
+    _evict_vector_dbs()
+    return vector_db
+
+
+# Recent completions keyed by a hash of the full request. The request carries the
+# current time to the minute, so entries only match requests made close together.
+COMPLETION_CACHE_TTL_SECONDS = 5 * 60
+COMPLETION_CACHE_MAX_ENTRIES = 256
+_completion_cache = OrderedDict() # request hash -> (time stored, response)
+
+# Token budget for a function result passed back to the model in the follow-up call
+FUNCTION_RESULT_TOKEN_BUDGET = 12000
+# Token counts of recently seen result items, keyed by a digest of the item JSON
+ITEM_TOKEN_CACHE_MAX_ENTRIES = 8192
+_item_token_counts = OrderedDict() # item JSON digest -> token count
+# Chat history messages (ending with the current user message) re-sent with the function result
+FOLLOW_UP_HISTORY_MESSAGES = 3
+# Functions that run a vector search with the model's search_parameters
+VECTOR_SEARCH_FUNCTIONS = ("find_events_and_assignments", "find_course_information")
+# Function calls from one model response that run at the same time
+FUNCTION_CALL_CONCURRENCY = 8
+
+if tiktoken is not None:
+    try:
+        _token_encoding = tiktoken.encoding_for_model(OPENAI_MODEL)
+    except KeyError:
+        _token_encoding = tiktoken.get_encoding("cl100k_base")
+else:
+    _token_encoding = None
+
+
+def dumps_json(obj) -> str:
+    """Serialize obj to a JSON string, with orjson when it is available"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    # Same compact output as orjson
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def loads_json(text):
+    """Parse a JSON string, with orjson when it is available"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def completion_cache_key(*request_parts) -> str:
+    """Hash the parts of a completion request (messages, function definitions) into a cache key"""
+    return hashlib.blake2b(dumps_json(request_parts).encode(), digest_size=16).hexdigest()
+
+
+def get_cached_completion(cache_key: str):
+    """Return the cached response for cache_key, or None if there is no fresh entry"""
+    cached = _completion_cache.get(cache_key)
+    if cached is None:
+        return None
+    if time.monotonic() - cached[0] >= COMPLETION_CACHE_TTL_SECONDS:
+        del _completion_cache[cache_key]
+        return None
+    _completion_cache.move_to_end(cache_key)
+    return cached[1]
+
+
+def cache_completion(cache_key: str, response):
+    """Store a completion response, evicting the least recently used entries"""
+    _completion_cache[cache_key] = (time.monotonic(), response)
+    _completion_cache.move_to_end(cache_key)
+    while len(_completion_cache) > COMPLETION_CACHE_MAX_ENTRIES:
+        _completion_cache.popitem(last=False)
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens in text for OPENAI_MODEL"""
+    if _token_encoding is not None:
+        return len(_token_encoding.encode(text))
+    # Rough heuristic of ~4 characters per token when tiktoken is not installed
+    return len(text) // 4
+
+
+def _count_item_tokens(item_json: str) -> int:
+    """Token count of one serialized result item; search results repeat across queries"""
+    # The character estimate is cheaper than a cache lookup
+    if _token_encoding is None:
+        return count_tokens(item_json)
+    digest = hashlib.blake2b(item_json.encode(), digest_size=16).digest()
+    token_count = _item_token_counts.get(digest)
+    if token_count is None:
+        token_count = count_tokens(item_json)
+        _item_token_counts[digest] = token_count
+        if len(_item_token_counts) > ITEM_TOKEN_CACHE_MAX_ENTRIES:
+            _item_token_counts.popitem(last=False)
+    else:
+        _item_token_counts.move_to_end(digest)
+    return token_count
+
+
+def fit_function_result(result, token_budget: int = FUNCTION_RESULT_TOKEN_BUDGET):
+    """
+    Trim a function result so its JSON fits within token_budget.
+    Lists are assumed to be in rank order: items are packed greedily from the top,
+    skipping any item that would overflow the budget rather than stopping at it.
+    Long strings are cut at the budget.
+    """
+    if isinstance(result, list):
+        fitted = []
+        used = 2 # surrounding brackets
+        for item in result:
+            item_tokens = _count_item_tokens(dumps_json(item)) + 1
+            if used + item_tokens > token_budget:
+                continue
+            fitted.append(item)
+            used += item_tokens
+        if len(fitted) < len(result):
+            print(f"Trimmed function result from {len(result)} to {len(fitted)} items to fit {token_budget} tokens")
+        return fitted
+    if isinstance(result, str) and count_tokens(result) > token_budget:
+        print(f"Truncated function result to {token_budget} tokens")
+        if _token_encoding is not None:
+            return _token_encoding.decode(_token_encoding.encode(result)[:token_budget])
+        return result[:token_budget * 4]
+    return result
+
+
+def validate_function_arguments(function, arguments) -> Optional[str]:
+    """Check that arguments can be passed to function; returns the problem, or None if they fit"""
+    if not isinstance(arguments, dict):
+        return "arguments must be a JSON object"
+    try:
+        inspect.signature(function).bind(**arguments)
+    except TypeError as e:
+        return str(e)
+    return None
+
+
+class AsyncRateLimiter:
+    """Throttles OpenAI requests against requests-per-minute and tokens-per-minute budgets.
+
+    Capacity refills continuously; callers wait until both budgets can cover the
+    request instead of sending it and backing off on a 429. A budget of None is
+    not enforced, and with neither budget set acquire returns at once.
+    """
+
+    def __init__(self, max_requests_per_minute: Optional[int], max_tokens_per_minute: Optional[int]):
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.available_request_capacity = float(max_requests_per_minute or 0)
+        self.available_token_capacity = float(max_tokens_per_minute or 0)
+        self.last_update = time.monotonic()
+
+    def estimate_tokens(self, messages: list, max_tokens: int) -> int:
+        """Estimate the token cost of a chat request (prompt plus completion budget)."""
+        # Counting is skipped when there is no token budget to charge it to
+        if self.max_tokens_per_minute is None:
+            return max_tokens
+        text = "".join(str(message.get("content") or "") for message in messages)
+        return count_tokens(text) + max_tokens
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.last_update = now
+        if self.max_requests_per_minute is not None:
+            self.available_request_capacity = min(
+                self.available_request_capacity + elapsed * self.max_requests_per_minute / 60.0,
+                float(self.max_requests_per_minute),
+            )
+        if self.max_tokens_per_minute is not None:
+            self.available_token_capacity = min(
+                self.available_token_capacity + elapsed * self.max_tokens_per_minute / 60.0,
+                float(self.max_tokens_per_minute),
+            )
+
+    async def acquire(self, token_cost: int):
+        """Wait until there is capacity for one request costing token_cost tokens."""
+        if self.max_requests_per_minute is None and self.max_tokens_per_minute is None:
+            return
+        if self.max_tokens_per_minute is not None:
+            # A single request larger than the whole window can never fit, so cap it
+            token_cost = min(token_cost, self.max_tokens_per_minute)
+        while True:
+            self._refill()
+            # Seconds until each budget has refilled enough to cover the request
+            wait = 0.0
+            if self.max_requests_per_minute is not None and self.available_request_capacity < 1:
+                wait = (1 - self.available_request_capacity) / (self.max_requests_per_minute / 60.0)
+            if self.max_tokens_per_minute is not None and self.available_token_capacity < token_cost:
+                wait = max(wait, (token_cost - self.available_token_capacity) / (self.max_tokens_per_minute / 60.0))
+            if wait == 0:
+                if self.max_requests_per_minute is not None:
+                    self.available_request_capacity -= 1
+                if self.max_tokens_per_minute is not None:
+                    self.available_token_capacity -= token_cost
+                return
+            await asyncio.sleep(wait)
+
+
+def _budget_from_env(name: str) -> Optional[int]:
+    """Read a per-minute budget from the environment; unset or empty means no limit"""
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+# Shared by every ConversationHandler so concurrent chats draw from the same budget.
+# Off unless OPENAI_MAX_REQUESTS_PER_MINUTE and/or OPENAI_MAX_TOKENS_PER_MINUTE are set.
+openai_rate_limiter = AsyncRateLimiter(
+    max_requests_per_minute=_budget_from_env("OPENAI_MAX_REQUESTS_PER_MINUTE"),
+    max_tokens_per_minute=_budget_from_env("OPENAI_MAX_TOKENS_PER_MINUTE"),
+)
+
+
+# System prompt for the first call, which answers directly or picks a function.
+# A string.Template, so the JSON example needs no brace escaping and the prompt
+# is parsed once at import instead of being rebuilt as an f-string on every call.
+SYSTEM_CONTEXT_TEMPLATE = Template("""
             [ROLE & IDENTITY]
-            You are a highly professional, task-focused AI assistant for {self.student_name!s} (User ID: {self.student_id!s}). You are dedicated to providing academic support while upholding the highest standards of academic integrity. You only assist with tasks that are ethically appropriate.
+            You are a highly professional, task-focused AI assistant for $student_name (User ID: $student_id). You are dedicated to providing academic support while upholding the highest standards of academic integrity. You only assist with tasks that are ethically appropriate.
 
             [STUDENT INFORMATION & RESOURCES]
-            - Courses: {self.courses!r} (Each key is the course name, each value is the corresponding course ID)
-            - The user's canvas base url: {self.domain!s}
-            - Valid Item Types: {self.valid_types!r}
-            - Time Range Definitions: {self.time_range_definitions!r}
+            - Courses: $courses (Each key is the course name, each value is the corresponding course ID)
+            - The user's canvas base url: $domain
+            - Valid Item Types: $valid_types
+            - Time Range Definitions: $time_range_definitions
 
             [GENERAL TASKS]
             You assist with:
@@ -446,11 +414,6 @@ class ConversationHandler:
             - Retrieving Canvas LMS information (e.g., syllabus details, assignment deadlines, course updates)
             - Creating events when requested
 
-            [DATE & TIME]
-            - Current Time: {current_time!s}
-            - All dates and times must be in ISO8601 format.
-            - Use the current time as your reference for "now."
-
             [INSTRUCTIONS FOR FUNCTION CALLS]
             1. **When to Call a Function:**
             - If the user's query requires additional information or action (e.g., retrieving Canvas data or creating an event), you must call the appropriate function from the provided function list.
@@ -459,14 +422,15 @@ class ConversationHandler:
             - Call the create_event function if the user wants to create an event.
             - Call the find_course_information function if the user wants to know information about a course from the syllabus. (Note: this could be about office hours, grading scale, etc.)
             - Call the find_events_and_assignments function if the user wants to know about any other information that would not be on the syllabus. (Note: this could be about finding an assignment, event, announcement, file, etc.)
+            - If the request needs more than one function (e.g., "show my assignments and add an event for the exam"), call all of them in the same response rather than one at a time.
 
 
             2. **Search Parameter Extraction for Retrieval:**
             - Extract a concise search parameters from the user's prompt, ensuring the following elements are captured:
-                - **Course:** The course ID (from {self.courses!r}). If a course is not mentioned or if somebody mentions all courses, default to "all_courses".
-                - **Time Range:** Select from {self.time_range_definitions!r} (e.g., FUTURE, RECENT_PAST, EXTENDED_PAST, ALL_TIME).
-                - **Generality:** Select from {self.generality_definitions!r} (e.g., LOW, MEDIUM, HIGH, SPECIFIC).
-                - **Item Types:** Choose from {self.valid_types!r}.
+                - **Course:** The course ID (from $courses). If a course is not mentioned or if somebody mentions all courses, default to "all_courses".
+                - **Time Range:** Select from $time_range_definitions (e.g., FUTURE, RECENT_PAST, EXTENDED_PAST, ALL_TIME).
+                - **Generality:** Select from $generality_definitions (e.g., LOW, MEDIUM, HIGH, SPECIFIC).
+                - **Item Types:** Choose from $valid_types.
                 - **Specific Dates:** Use date mentioned by the user. Only ever include dates if the user mentions a specific date. Do no try and infer dates.
                 - **Keywords:** Extract a concise list of keywords from the user's prompt. Keywords should be specific and unique to the user's query.
                 - **Synonyms/Related Terms:** Include relevant synonyms (e.g., for "exam", include "midterm" and "final").
@@ -477,8 +441,8 @@ class ConversationHandler:
             3. **JSON Response Structure for Function Calls:**
             - For Canvas search queries, respond with a valid JSON object in the following exact format, but only include the parameters that are needed for the function call:
                 
-                {{
-                    "search_parameters": {{
+                {
+                    "search_parameters": {
                     "course_id": "<course_id>",
                     "time_range": "<FUTURE|RECENT_PAST|EXTENDED_PAST|ALL_TIME>",
                     "generality": "<LOW|MEDIUM|HIGH|SPECIFIC#>",
@@ -486,8 +450,8 @@ class ConversationHandler:
                     "specific_dates": ["YYYY-MM-DD", "YYYY-MM-DD"],
                     "keywords": ["keyword1", "keyword2", ...],
                     "query": "<original user query>"
-                    }}
-                }}
+                    }
+                }
                 
                 
             - For event and assignment retrieval requests, generate arguments as defined in the function list. 
@@ -520,57 +484,545 @@ class ConversationHandler:
             - **Course Fail-Safe:** If the course mentioned does not match exactly, select the closest course based on string similarity.
             - **Generality Fail-Safe:** If the user does not specify a generality, default to "MEDIUM".
             - **Function Fail-Safe:** If unsure about which function to call, default to "find_assignments_and_events".   
+            """)
+
+# The current time goes in its own system message after the chat history. Everything before it
+# (system prompt and earlier turns) is then identical from one turn to the next, which lets
+# OpenAI's automatic prompt caching reuse that prefix.
+CURRENT_TIME_CONTEXT_TEMPLATE = """
+            [DATE & TIME]
+            - Current Time: {current_time}
+            - All dates and times must be in ISO8601 format.
+            - Use the current time as your reference for "now."
             """
-        
-        return system_context
-    
-    def define_system_context_for_function_output(self):
-        local_tz = tzlocal.get_localzone()
-        current_time = datetime.now(local_tz).strftime("%Y-%m-%d %I:%M %p")
-        system_context = f"""
+
+
+# System prompt for the follow-up call that turns a function result into a reply.
+# Kept as one module-level template so each call only fills in the placeholders.
+FUNCTION_OUTPUT_SYSTEM_TEMPLATE = """
             [ROLE & IDENTITY]
-            You are a highly professional, task-focused AI assistant for {self.student_name} (User ID: {self.student_id}). You are dedicated to providing academic support while upholding the highest standards of academic integrity. You only assist with tasks that are ethically appropriate.
+            You are a highly professional, task-focused AI assistant for {student_name} (User ID: {student_id}). You are dedicated to providing academic support while upholding the highest standards of academic integrity. You only assist with tasks that are ethically appropriate.
             
             [STUDENT INFORMATION & RESOURCES]
-            - Courses: {self.courses} (Each key is the course name, each value is the corresponding course ID)
+            - Courses: {courses} (Each key is the course name, each value is the corresponding course ID)
             
-            [DATE & TIME]
-            - Current UTC Time: {current_time}
-            - Use the current UTC time as your reference for "now."
-            - When reviewing the search results in the chat context, ensure to reference 'local time' for the timestamps of the documents. For example, a due date would be "Due Date: April 10, 2025, at 11:59 PM EST", when EST is the local time.
-
             [Instructions for Function Output]
             - For event creation requests, respond with a clear confirmation message such as "The event has been created."
             - For course information requests, you are going to be given a string of text containing the course syllabus. Retrieve information from the text based on the user's query.
             - For assignment and event retrieval requests, you are going to be given a list of assignments and events. Retrieve the information from the list based on the user's query. 
             -For calculating grade requirements, you are going to be ouptuted a required score. This is the score that the user needs to achieve on an assignment to get a certain letter grade. Output with a message like "You need this required score to maintain an A in the class."
 
+            [DATE & TIME]
+            - Current UTC Time: {current_time}
+            - Use the current UTC time as your reference for "now."
+            - When reviewing the search results in the chat context, ensure to reference 'local time' for the timestamps of the documents. For example, a due date would be "Due Date: April 10, 2025, at 11:59 PM EST", when EST is the local time.
+
         """
+
+
+# Function definitions for the OpenAI API. They don't depend on the user, so they are
+# built once at import; callers must treat them as read-only.
+FUNCTION_DEFINITIONS = [
+    {
+        "name": "find_events_and_assignments",
+        "description": "Search for Canvas materials using vector embeddings for semantic retrieval.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "search_parameters": {
+                    "type": "object",
+                    "properties": {
+                        "course_id": {
+                            "type": "string",
+                            "description": "Specific Course ID(s) (e.g. 2372294) when mentioned by the user. 'all_courses': if the user asks for information about all courses or they don't mention a specific course"
+                        },
+                        "time_range": {
+                            "type": "string", 
+                            "enum": ["NEAR_FUTURE", "FUTURE", "RECENT_PAST", "PAST", "ALL_TIME"],
+                            "description": "Temporal context for search"
+                        },
+                        "generality": {
+                            "type": "string", 
+                            "enum": ["LOW", "MEDIUM", "HIGH"],
+                            "description": "Context for how many items to retrieve"
+                        },
+                        "item_types": {
+                            "type": "array",
+                            "items": {
+                                "type": "string",
+                                "enum": ["assignment","quiz","event", "syllabus"]
+                            },
+                            "description": "This should always be ['assignments','events']"
+                        },
+                        "specific_dates": {
+                            "type": "array",
+                            "items": {
+                                "type": "string",
+                                "format": "date"
+                            },
+                            "description": "ISO8601 format dates mentioned in query if a specific date is mentioned."
+                        },
+                        "keywords": {
+                            "type": "array",
+                            "items": {
+                                "type": "string" 
+                            },
+                            "description": "keywords from the user's query to help with semantic search"
+                        },
+                        "query": {
+                            "type": "string",
+                            "description": "User's original query for semantic search"
+                        }
+                    },
+                    "required": ["course_id", "time_range", "item_types","generality","keywords", "query"]
+                }
+            },
+            "required": ["search_parameters"]
+        }
+    },
+    {
+        "name": "create_event",
+        "description": "Create a calendar event or multiple events using the Canvas API.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "context_code": {
+                    "type": "string",
+                    "description": "This should always be the students user id. This should be in the form "
+                },
+                "title": {
+                    "type": "string",
+                    "description": "Title of the event."
+                },
+                "start_at": {
+                    "type": "string",
+                    "description": "Start date/time in ISO8601 format."
+                },
+                "end_at": {
+                    "type": "string",
+                    "description": "End date/time in ISO8601 format."
+                },
+                "description": {
+                    "type": "string",
+                    "description": "Description of the event."
+                },
+                "location_name": {
+                    "type": "string",
+                    "description": "Name of the location."
+                },
+                "location_address": {
+                    "type": "string",
+                    "description": "Address of the location."
+                },
+                "all_day": {
+                    "type": "boolean",
+                    "description": "Indicates if the event lasts all day.",
+                    "default": False
+                },
+                "duplicate_count": {
+                    "type": "integer",
+                    "description": "Number of times to duplicate the event (max 200)."
+                },
+                "duplicate_interval": {
+                    "type": "integer",
+                    "description": "Interval between duplicates; defaults to 1."
+                },
+                "duplicate_frequency": {
+                    "type": "string",
+                    "enum": ["daily", "weekly", "monthly"],
+                    "description": "Frequency at which to duplicate the event."
+                },
+                "duplicate_append_iterator": {
+                    "type": "boolean",
+                    "description": "If true, an increasing counter will be appended to the event title for each duplicate (e.g., Event 1, Event 2, etc.)."
+                },
+                "canvas_base_url": {
+                    "type": "string",
+                    "description": "This should the provided domain of the user"
+                }
+            },
+            "required": [
+                "context_code",
+                "title",
+                "start_at",
+                "canvas_base_url"
+            ]
+        }
+    },
+    {
+        "name": "find_course_information",
+        "description": "Find course information using the vector search function",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "search_parameters": {
+                    "type": "object",
+                    "properties": {
+                        "course_id": {
+                            "type": "string",
+                            "description": "Specific Course ID(s) (e.g. 2372294) when mentioned by the user. 'all_courses': if the user asks for information about all courses"
+                        },
+                        "time_range": {
+                            "type": "string", 
+                            "enum": ["NEAR_FUTURE", "FUTURE", "RECENT_PAST", "PAST", "ALL_TIME"],
+                            "description": "Temporal context for search"
+                        },
+                        "generality": {
+                            "type": "string", 
+                            "enum": ["LOW", "MEDIUM", "HIGH"],
+                            "description": "Context for how many items to retrieve"
+                        },
+                        "item_types": {
+                            "type": "array",
+                            "items": {
+                                "type": "string",
+                                "enum": ["assignment", "file", "quiz", "announcement", "event", "syllabus"]
+                            },
+                            "description": "This should always be ['syllabus']"
+                        },
+                       "specific_dates": {
+                            "type": "array",
+                            "items": {
+                                "type": "string",
+                                "format": "date"
+                            },
+                            "description": "ISO8601 format dates mentioned in query if a specific date is mentioned."
+                        },
+                        "keywords": {
+                            "type": "array",
+                            "items": {
+                                "type": "string" 
+                            },
+                            "description": "This should always be ['course information','course materials'] l"
+                        },
+                        "query": {
+                            "type": "string",
+                            "description": "User's original query for semantic search"
+                        }
+                    },
+                    "required": ["course_id", "time_range", "item_types","generality","keywords", "query"]
+                }
+            },
+            "required": ["search_parameters"]
+        }
+    },
+    {
+        "name": "create_notes",
+        "description": "Create notes for a file found in the vector search function",
+        "parameters": {
+          "type": "object",
+            "properties": {
+               "user_id": {
+               "type": "string",
+                    "description": "The user's ID number"
+               },
+               "domain": {
+                    "type": "string",
+                    "description": "The user's canvas base url"
+                },
+                   "search_parameters": {
+                    "type": "object",
+                    "properties": {
+                    "course_id": {
+                            "type": "string",
+                            "description": "Specific Course ID"
+                        },
+                        "time_range": {
+                            "type": "string", 
+                            "enum": ["NEAR_FUTURE", "FUTURE", "RECENT_PAST", "PAST", "ALL_TIME"],
+                            "description": "Temporal context for search"
+                        },
+                        "generality": {
+                            "type": "string", 
+                            "enum": ["LOW", "MEDIUM", "HIGH",],
+                            "description": "Context for how many items to retrieve"
+                        },
+                    "item_types": {
+                            "type": "array",
+                            "items": {
+                                "type": "string",
+                                "enum": ["assignment", "file", "quiz", "announcement", "event", "syllabus"]
+                            },
+                            "description": "This should always be ['file']"
+                        },
+                        "specific_dates": {
+                        "type": "array",
+                            "items": {
+                                "type": "string",
+                                "format": "date"
+                            },
+                            "description": "ISO8601 format dates mentioned in query if a specific date is mentioned."
+                        },
+                        "keywords": {
+                        "type": "array",
+                            "items": {
+                                "type": "string" 
+                            },
+                            "description": "This should always be ['lecture','notes','slides']"
+                        },
+                        "query": {
+                            "type": "string",
+                            "description": "User's original query for semantic search"
+                        }
+                    },
+                    "required": ["course_id", "time_range", "item_types", "generality", "keywords", "query"]
+                }
+            },
+               "required": ["user_id", "domain", "search_parameters"]
+        }
+    },
+    {
+        "name": "calculate_grade",
+        "description": "Calculate the grade required to achieve a certain letter grade on an assignment",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "target_grade_letter": {
+                    "type": "string",
+                    "description": "The target grade letter of the assignment"
+                },
+                "student_id": {
+                    "type": "string",
+                    "description": "The user's ID number"
+                },
+                "search_parameters": {
+                    "type": "object",
+                    "properties": {
+                        "course_id": {
+                            "type": "string",
+                            "description": "Specific Course ID"
+                        },
+                        "time_range": {
+                            "type": "string", 
+                            "enum": ["NEAR_FUTURE", "FUTURE", "RECENT_PAST", "PAST", "ALL_TIME"],
+                            "description": "Temporal context for search"
+                        },
+                        "generality": {
+                            "type": "string", 
+                            "enum": ["LOW", "MEDIUM", "HIGH",],
+                            "description": "Context for how many items to retrieve"
+                        },
+                        "item_types": {
+                            "type": "array",
+                            "items": {
+                                "type": "string",
+                                "enum": ["assignment", "file", "quiz", "announcement", "event", "syllabus"]
+                            },
+                            "description": "This should always be ['assignment']"
+                        },
+                        "specific_dates": {
+                            "type": "array",
+                            "items": {
+                                "type": "string",
+                                "format": "date"
+                            },
+                            "description": "ISO8601 format dates mentioned in query if a specific date is mentioned."
+                        },
+                        "keywords": {
+                            "type": "array",
+                            "items": {
+                                "type": "string" 
+                            },
+                            "description": "this should always be ['assignment']"
+                        },
+                        "query": {
+                            "type": "string",
+                            "description": "User's original query for semantic search"
+                        }
+                    },
+                    "required": ["course_id", "time_range", "item_types", "generality", "keywords", "query"]
+                }
+            }   
+        },
+        "required": ["target_grade_letter","student_id", "search_parameters"]
+    }
+]
+
+# The same definitions in the tools format used by the chat completions call
+FUNCTION_TOOLS = [{"type": "function", "function": function} for function in FUNCTION_DEFINITIONS]
+
+
+def _compile_argument_validators() -> dict:
+    """Compile a validator for each function's parameter schema (empty without fastjsonschema)"""
+    validators = {}
+    if fastjsonschema is None:
+        return validators
+    for function in FUNCTION_DEFINITIONS:
+        try:
+            validators[function["name"]] = fastjsonschema.compile(function["parameters"])
+        except fastjsonschema.JsonSchemaDefinitionException as e:
+            print(f"Could not compile the parameter schema for {function['name']}: {e}")
+    return validators
+
+
+# Model-supplied arguments are checked against these before the function runs
+ARGUMENT_VALIDATORS = _compile_argument_validators()
+
+
+def first_completion_request(chat: list) -> dict:
+    """
+    Arguments of the first chat completion call, which answers directly or plans function calls.
+    Shared by the streamed and non-streamed paths so both send (and cache) the same request.
+    """
+    return {
+        "model": OPENAI_MODEL,
+        "messages": chat,
+        "tools": FUNCTION_TOOLS,
+        "tool_choice": "auto",
+        "parallel_tool_calls": True,
+        "temperature": 0,
+        "max_tokens": OPENAI_MAX_TOKENS,
+    }
+
+
+def follow_up_completion_request(follow_up_chat: list) -> dict:
+    """Arguments of the follow-up chat completion call, which answers from the function results"""
+    return {
+        "model": OPENAI_MODEL,
+        "messages": follow_up_chat,
+        "temperature": 0.3,
+        "max_tokens": OPENAI_MAX_TOKENS,
+    }
+
+
+@dataclass
+class FollowUp:
+    """Function calls that have run and the follow-up chat that answers from their results"""
+    chat: list
+    function_name: str
+    result: object
+
+
+class ConversationHandler:
+    # Search vocabulary described to the model. It is the same for every handler, so it is
+    # shared at class level and read-only.
+    VALID_TYPES = ("assignment", "file", "quiz", "announcement", "event", "syllabus")
+    TIME_RANGE_DEFINITIONS = MappingProxyType({
+        "NEAR_FUTURE": {
+            "description": "Items within the next 10 days, including upcoming assignments.",
+            "logic": "now <= item <= now + 10d"
+        },
+        "FUTURE": {
+            "description": "Items to occur after the next 10 days.",
+            "logic": "now + 10d <= item"
+        },
+        "RECENT_PAST": {
+            "description": "Items occurred within the past 10 days.",
+            "logic": "now - 10d <= item <= now"
+        },
+        "PAST": {
+            "description": "Items occurred before the past 10 days.",
+            "logic": "item <= now - 10d"
+        },
+        "ALL_TIME": {
+            "description": "Items that exist at any point in time, regardless of when.",
+            "logic": "item exists"
+        }
+    })
+    GENERALITY_DEFINITIONS = MappingProxyType({
+        "LOW": {
+            "description": "Used when the user is looking for a small set of focused results about a narrow topic",
+            "examples": ["Find quizzes about neural networks in CMPSC 444", "Show me this week's assignments"],
+            "result_type": "Focused set of results"
+        },
+        "MEDIUM": {
+            "description": "Default level. Used for balanced queries that need a moderate number of results",
+            "examples": ["What assignments do I have?", "Show my upcoming deadlines"],
+            "result_type": "Balanced set of results"
+        },
+        "HIGH": {
+            "description": "Used for broad, exploratory queries or when comprehensiveness is important",
+            "examples": ["Show me everything for my Biology class", "What are the assignments for this semester in Physics?"],
+            "result_type": "Comprehensive set of results"
+        }
+    })
+    # How they appear in the system prompt: compact JSON, rendered once
+    PROMPT_VALID_TYPES = dumps_json(list(VALID_TYPES))
+    PROMPT_TIME_RANGE_DEFINITIONS = dumps_json(dict(TIME_RANGE_DEFINITIONS))
+    PROMPT_GENERALITY_DEFINITIONS = dumps_json(dict(GENERALITY_DEFINITIONS))
+
+    def __init__(self, student_name, student_id, courses, domain, chat_history,canvas_api_token):
+        self.student_name = student_name
+        self.student_id = student_id
+        self.courses = courses
+        self.domain = domain
+        self.chat_history = chat_history
+        self.canvas_api_url = domain
+        self.canvas_api_token = canvas_api_token
+        self.openai_api_key = openai_api_key
+        # Shared async client so the chat completion requests don't block the event loop
+        self.openai_client = _get_openai_client()
+        self.hf_api_token = os.getenv("HUGGINGFACE_API_KEY")
+        # Only the current time changes between turns, so both system prompts are filled in
+        # here once; the main prompt leaves the time to a separate message and the function
+        # output prompt keeps a placeholder for it
+        # Courses go into the prompts as compact JSON, which is shorter than a dict repr
+        courses_json = dumps_json(self.courses)
+        self.system_context = SYSTEM_CONTEXT_TEMPLATE.substitute(
+            student_name=self.student_name,
+            student_id=self.student_id,
+            courses=courses_json,
+            domain=self.domain,
+            valid_types=self.PROMPT_VALID_TYPES,
+            time_range_definitions=self.PROMPT_TIME_RANGE_DEFINITIONS,
+            generality_definitions=self.PROMPT_GENERALITY_DEFINITIONS
+        )
+        self.function_output_context_without_time = FUNCTION_OUTPUT_SYSTEM_TEMPLATE.format(
+            student_name=self.student_name,
+            student_id=self.student_id,
+            courses=courses_json,
+            current_time="{current_time}"
+        )
+
+
+    def define_functions(self):
+        """Returns a list of function definitions for the OpenAI API"""
+        return FUNCTION_DEFINITIONS
+    
+    def define_system_context(self):
+        return self.system_context
+
+    def define_time_context(self):
+        return CURRENT_TIME_CONTEXT_TEMPLATE.format(current_time=current_time_text())
+    
+    def define_system_context_for_function_output(self):
+        current_time = current_time_text()
+        system_context = self.function_output_context_without_time.replace("{current_time}", current_time)
         return system_context
     
-    async def find_events_and_assignments(self, search_parameters: dict):
-        """Find events and assignments using the vector search function"""
-        print("\n=== FIND_EVENTS_AND_ASSIGNMENTS: Starting ===")
-        print(f"Search parameters received: {json.dumps(search_parameters, indent=2)}")
-        
-        from vectordb.db import VectorDatabase
-        
+    async def search_vector_db(self, search_parameters: dict, function_name: str = "search"):
+        """Load the student's vector database and run a search, returning [] if the search fails"""
         user_id_number = self.student_id.split("_")[1]
         
         vector_db_path = f"user_data/psu/{user_id_number}/user_data.json"
         
-        print("Initializing VectorDatabase...")
-        vector_db = VectorDatabase(vector_db_path, hf_api_token=self.hf_api_token)
-        await vector_db.load_local_data_from_json()
+        vector_db = await _get_vector_db(vector_db_path, self.hf_api_token)
         
         print("Calling vector_db.search...")
         try:
-            events_and_assignments = await vector_db.search(search_parameters=search_parameters)
+            return await vector_db.search(search_parameters, function_name=function_name)
         except Exception as e:
             print(f"ERROR in vector_db.search: {str(e)}")
             print(f"Error type: {type(e)}")
-            events_and_assignments = []
-        print(f"Retrieval: {events_and_assignments}")
+            return []
+
+    async def prefetch_query_embeddings(self, search_parameters_list: list):
+        """Embed the queries of several upcoming vector searches together; failures are left to the searches"""
+        user_id_number = self.student_id.split("_")[1]
+        vector_db_path = f"user_data/psu/{user_id_number}/user_data.json"
+        try:
+            vector_db = await _get_vector_db(vector_db_path, self.hf_api_token)
+            await vector_db.prefetch_query_embeddings(search_parameters_list)
+        except Exception as e:
+            print(f"ERROR prefetching query embeddings: {str(e)}")
+
+    async def find_events_and_assignments(self, search_parameters: dict):
+        """Find events and assignments using the vector search function"""
+        print("\n=== FIND_EVENTS_AND_ASSIGNMENTS: Starting ===")
+        logger.debug("Search parameters received: %s", search_parameters)
+        
+        events_and_assignments = await self.search_vector_db(search_parameters)
+        logger.debug("Retrieval: %s", events_and_assignments)
         return events_and_assignments
 
     async def find_course_information(self, search_parameters: dict):
@@ -586,53 +1038,22 @@ class ConversationHandler:
             - generality
             - query
         """
-        from vectordb.db import VectorDatabase
-        
-        user_id_number = self.student_id.split("_")[1]
-        
-        vector_db_path = f"user_data/psu/{user_id_number}/user_data.json"
-        
-        vector_db = VectorDatabase(vector_db_path, hf_api_token=self.hf_api_token)
-        await vector_db.load_local_data_from_json()
-        
-        print("Calling vector_db.search...")
-
-        try:
-            course_information = await vector_db.search(search_parameters) 
-        except Exception as e:
-            print(f"ERROR in vector_db.search: {str(e)}")
-            print(f"Error type: {type(e)}")
-            course_information = []
-        
-        return course_information
+        return await self.search_vector_db(search_parameters)
 
     async def find_file(self, search_parameters: dict):
         """Find a file using the vector search function"""
         print("\n=== FIND_FILE: Starting ===")
-        print(f"Search parameters received: {json.dumps(search_parameters, indent=2)}")
-        from vectordb.db import VectorDatabase
-        
-        user_id_number = self.student_id.split("_")[1]
-        
-        vector_db_path = f"user_data/psu/{user_id_number}/user_data.json"
+        logger.debug("Search parameters received: %s", search_parameters)
         
-        print("Initializing VectorDatabase...")
-        vector_db = VectorDatabase(vector_db_path, hf_api_token=self.hf_api_token)
-        await vector_db.load_local_data_from_json()
-        
-        try:
-            file = await vector_db.search(search_parameters, function_name="find_file") 
-        except Exception as e:
-            print(f"ERROR in vector_db.search: {str(e)}")
-            print(f"Error type: {type(e)}")
-            file = []
+        file = await self.search_vector_db(search_parameters, function_name="find_file")
         
         file_description = [file[0]["document"]["filename"], file[0]["document"]["url"]]
         return file_description
 
     async def create_notes(self, user_id: str, domain: str, search_parameters: dict):
         """Create notes for a file using the vector search function"""
-        from backend.task_specific_agents.lecture_to_notes_agent import get_file_name_without_type
+        # Imported here: the notes agent pulls in the PDF, Office and OCR stacks, which only this function needs
+        from backend.task_specific_agents.lecture_to_notes_agent import get_file_name_without_type, lecture_file_to_notes_pdf
         search_parameters["specific_dates"] = [""]
         search_parameters["item_types"] = ["file"]
         file_description = await self.find_file(search_parameters)
@@ -659,7 +1080,7 @@ class ConversationHandler:
         return search_parameters
     
 
-    def transform_user_message(self, context: ContextObject):
+    def transform_user_message(self, context: "ContextObject"):
         print("\n=== TRANSFORM USER MESSAGE: Starting ===")
         chat_history = []
         
@@ -669,36 +1090,90 @@ class ConversationHandler:
         
         print("\n=== TRANSFORM USER MESSAGE: Processing messages ===")
 
-        for i in range(len(context_array.context[1].content)-1,-1,-1):
+        # Resolve the assistant and user message lists once instead of on every access in the loop
+        assistant_messages = context_array.context[0].content
+        user_messages = context_array.context[1].content
+        append = chat_history.append
+
+        for i in range(len(user_messages)-1,-1,-1):
             print(f"\nProcessing message pair {i + 1}:")
-            chat_history.append({"role": "user", "content":context_array.context[1].content[i]})
+            append({"role": "user", "content": user_messages[i]})
             
-            if context_array.context[0].content[i].function and context_array.context[0].content[i].function != [""]:
-                print(f"Function detected: {context_array.context[0].content[i].function}")
-                chat_history.append({"role": "function","name":context_array.context[0].content[i].function[0], "content": context_array.context[0].content[i].function[1]})
+            assistant_message = assistant_messages[i]
+            function = assistant_message.function
+            if function and function != [""]:
+                print(f"Function detected: {function}")
+                append({"role": "function","name": function[0], "content": function[1]})
             if i != 0:
-                chat_history.append({"role": "assistant", "content":context_array.context[0].content[i].message})
+                append({"role": "assistant", "content": assistant_message.message})
         
         print("\n=== TRANSFORM USER MESSAGE: Final chat history ===")
         print("=== TRANSFORM USER MESSAGE: Complete ===\n")
         return chat_history
     
-    async def process_user_message(self, chat_history: dict):
-        """Process a user message and return the appropriate response"""
-        print("\n=== PROCESS USER MESSAGE: Starting ===")
-        
-        print("=== PROCESS USER MESSAGE: Generating system context ===")
-        # Generate the system context with enhanced instructions
-        system_context = self.define_system_context()
-        functions = self.define_functions()
-        print(f"System context length: {len(system_context)}")
-        print(f"Functions defined: {[f['name'] for f in functions]}")
-        
-        client = OpenAI(
-            api_key=self.openai_api_key
+    async def stream_completion(self, chat: list) -> AsyncIterator[str]:
+        """Stream a chat completion for the given messages, yielding text as it is generated"""
+        await openai_rate_limiter.acquire(openai_rate_limiter.estimate_tokens(chat, OPENAI_MAX_TOKENS))
+        stream = await self.openai_client.chat.completions.create(
+            **follow_up_completion_request(chat),
+            stream=True,
+            # The final chunk then carries token usage, which streamed responses otherwise omit
+            stream_options={"include_usage": True}
         )
-        print(f"OpenAI client initialized with key: {'*'*len(self.openai_api_key)}")
+        async for chunk in stream:
+            if chunk.choices:
+                yield chunk.choices[0].delta.content or ""
+            elif chunk.usage:
+                print(f"Streamed completion usage: {chunk.usage.total_tokens} tokens")
+
+    async def execute_function(self, function_mapping: dict, function_name: str, arguments: dict):
+        """Run one function call requested by the model and return its result (or an error dict)"""
+        if function_name not in function_mapping:
+            print(f"ERROR: Function '{function_name}' not found in function_mapping")
+            return {"error": f"Function '{function_name}' not implemented."}
+
+        print(f"Executing function: {function_name}")
+        print(f"Function object: {function_mapping[function_name]}")
+        try:
+            print(f"Arguments: {arguments}")
+            # Reject malformed arguments before running the function so the model
+            # is told what was wrong instead of the call failing partway through
+            validation_error = validate_function_arguments(function_mapping[function_name], arguments)
+            if not validation_error and function_name in ARGUMENT_VALIDATORS:
+                try:
+                    ARGUMENT_VALIDATORS[function_name](arguments)
+                except fastjsonschema.JsonSchemaValueException as e:
+                    validation_error = e.message
+            if validation_error:
+                print(f"ERROR: Invalid arguments for {function_name}: {validation_error}")
+                return {"error": f"Invalid arguments for {function_name}: {validation_error}"}
+            result = await function_mapping[function_name](**arguments)
+            print(f"Function execution completed")
+            print(f"Function result type: {type(result)}")
+            if result is None:
+                print("WARNING: Function returned None")
+        except Exception as e:
+            print(f"ERROR during function execution: {str(e)}")
+            print(f"Error type: {type(e)}")
+            result = {"error": f"Error executing function: {str(e)}"}
+        return result
 
+    def build_chat(self, chat_history: list) -> list:
+        """Wrap the transformed chat history with the system context and the current time"""
+        chat = [
+            {"role": "system", "content": self.define_system_context()},
+        ]
+        
+        chat.extend(chat_history)
+        chat.append({"role": "system", "content": self.define_time_context()})
+        return chat
+
+    async def run_function_calls(self, chat_history: list, response_message):
+        """
+        Run the function calls planned in a first completion and build the follow-up chat.
+        Returns a FollowUp, or the finished response when no follow-up is needed (create_notes)
+        or the calls can't be run.
+        """
         function_mapping = {
             "find_events_and_assignments": self.find_events_and_assignments,
             "find_course_information": self.find_course_information,
@@ -708,27 +1183,208 @@ class ConversationHandler:
         }
         print(f"Function mapping: {list(function_mapping.keys())}")
 
-        chat = [
-            {"role": "system", "content": system_context},
+        calls = []
+        for tool_call in response_message.tool_calls:
+            function_name = tool_call.function.name
+            print(f"Function call detected: {function_name}")
+            try:
+                arguments = loads_json(tool_call.function.arguments)
+                # Non-object arguments are left as they are for execute_function to reject
+                if isinstance(arguments, dict) and function_name in ("create_event", "calculate_grade"):
+                    arguments["canvas_base_url"] = self.canvas_api_url
+                    arguments["access_token"] = self.canvas_api_token
+                    if function_name == "calculate_grade":
+                        arguments["hf_api_token"] = self.hf_api_token
+                    # Reuse open connections to Canvas across chat turns
+                    arguments["session"] = _get_canvas_session()
+
+            except json.JSONDecodeError as e:
+                print(f"ERROR decoding function arguments: {str(e)}")
+                print(f"Raw arguments: {tool_call.function.arguments}")
+                return [{"message": "Error processing function arguments", "function": [""]}]
+            calls.append((tool_call, function_name, arguments))
+        
+        print("=== RUN FUNCTION CALLS: Preparing function call ===")
+
+        for tool_call, function_name, arguments in calls:
+            if function_name == "create_notes":
+                return_value = {"message": "Your PDF has been created.", "function": [function_name, dumps_json(arguments), "arrays-pointers"]}
+                self.chat_history.context[0].content[0] = return_value
+                return self.chat_history
+
+        print("\n=== RUN FUNCTION CALLS: Executing function ===")
+        # Embed the queries of several planned vector searches in one request up front
+        search_parameters_list = [
+            arguments["search_parameters"] for _, function_name, arguments in calls
+            if function_name in VECTOR_SEARCH_FUNCTIONS and isinstance(arguments, dict)
+            and isinstance(arguments.get("search_parameters"), dict)
         ]
+        if len(search_parameters_list) > 1:
+            await self.prefetch_query_embeddings(search_parameters_list)
+
+        # Calls planned together in one response are independent, so they run concurrently
+        # (a few at a time); gather keeps the results in the order the model planned them
+        semaphore = asyncio.Semaphore(FUNCTION_CALL_CONCURRENCY)
+
+        async def execute_function_limited(function_name, arguments):
+            async with semaphore:
+                return await self.execute_function(function_mapping, function_name, arguments)
+
+        results = await asyncio.gather(*(
+            execute_function_limited(function_name, arguments)
+            for _, function_name, arguments in calls
+        ))
+
+        # Results share the token budget so several calls don't multiply the prompt size
+        result_token_budget = FUNCTION_RESULT_TOKEN_BUDGET // len(calls)
+        tool_messages = [{
+            "role": "tool",
+            "tool_call_id": tool_call.id,
+            "content": dumps_json(fit_function_result(result, result_token_budget))
+        } for (tool_call, _, _), result in zip(calls, results)]
+
+        # One call is stored as its own result; several are stored together under the first call's name
+        function_name = calls[0][1]
+        if len(calls) == 1:
+            result = results[0]
+        else:
+            result = [{"function": name, "result": call_result} for (_, name, _), call_result in zip(calls, results)]
+       
+        # Context is then passed back to the api in order for it to respond to the user
+        system_context_for_function_output = self.define_system_context_for_function_output()
+        # The reply only needs the most recent turns and the new function results;
+        # older turns (and their function results) are not re-sent
+        follow_up_chat = [{"role": "system", "content": system_context_for_function_output}]
+        follow_up_chat.extend(chat_history[-FOLLOW_UP_HISTORY_MESSAGES:])
+        follow_up_chat.append({
+            "role": "assistant",
+            "content": response_message.content,
+            "tool_calls": [{
+                "id": tool_call.id,
+                "type": "function",
+                "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments}
+            } for tool_call, _, _ in calls]
+        })
+        follow_up_chat.extend(tool_messages)
+        return FollowUp(follow_up_chat, function_name, result)
+
+    async def stream_user_message(self, chat_history: list) -> AsyncIterator[str]:
+        """
+        Stream the reply to a user message, yielding text as it is generated.
+        Direct answers stream straight from the first completion. If the model calls functions
+        instead, they run first and the answer streams from the follow-up completion.
+        """
+        try:
+            chat = self.build_chat(chat_history)
+            request = first_completion_request(chat)
+            cache_key = completion_cache_key(request)
+            response_message = get_cached_completion(cache_key)
+
+            if response_message is None:
+                await openai_rate_limiter.acquire(openai_rate_limiter.estimate_tokens(chat, OPENAI_MAX_TOKENS))
+                stream = await self.openai_client.chat.completions.create(
+                    **request,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+                content_parts = []
+                tool_call_parts = {} # tool call index -> {"id", "name", "arguments"}
+                async for chunk in stream:
+                    if not chunk.choices:
+                        if chunk.usage:
+                            print(f"Streamed completion usage: {chunk.usage.total_tokens} tokens")
+                        continue
+                    delta = chunk.choices[0].delta
+                    if delta.content:
+                        content_parts.append(delta.content)
+                        yield delta.content
+                    for tool_call in delta.tool_calls or []:
+                        parts = tool_call_parts.setdefault(tool_call.index, {"id": "", "name": "", "arguments": ""})
+                        parts["id"] += tool_call.id or ""
+                        if tool_call.function:
+                            parts["name"] += tool_call.function.name or ""
+                            parts["arguments"] += tool_call.function.arguments or ""
+
+                # Rebuild the message in the shape of a non-streamed response for the cache
+                response_message = SimpleNamespace(
+                    content="".join(content_parts) or None,
+                    tool_calls=[
+                        SimpleNamespace(
+                            id=parts["id"],
+                            type="function",
+                            function=SimpleNamespace(name=parts["name"], arguments=parts["arguments"])
+                        )
+                        for _, parts in sorted(tool_call_parts.items())
+                    ] or None
+                )
+                cache_completion(cache_key, response_message)
+                if not response_message.tool_calls:
+                    self.chat_history.context[0].content[0] = {"message": response_message.content or "", "function": [""]}
+                    return
+            elif not response_message.tool_calls:
+                yield response_message.content or ""
+                self.chat_history.context[0].content[0] = {"message": response_message.content or "", "function": [""]}
+                return
+
+            follow_up = await self.run_function_calls(chat_history, response_message)
+            if not isinstance(follow_up, FollowUp):
+                if isinstance(follow_up, list):
+                    self.chat_history.context[0].content[0] = follow_up[0]
+                    yield follow_up[0]["message"]
+                else:
+                    yield follow_up.context[0].content[0]["message"]
+                return
+
+            cache_key = completion_cache_key(follow_up.chat)
+            final_message = get_cached_completion(cache_key)
+            if final_message is None:
+                message_parts = []
+                async for text in self.stream_completion(follow_up.chat):
+                    message_parts.append(text)
+                    yield text
+                final_message = "".join(message_parts)
+                cache_completion(cache_key, final_message)
+            else:
+                yield final_message
+            self.chat_history.context[0].content[0] = {"message": final_message, "function": [follow_up.function_name, dumps_json(follow_up.result)]}
+        except Exception as e:
+            # Same reply process_user_message gives, instead of cutting the response body off
+            print(f"ERROR while streaming reply: {str(e)}")
+            print(f"Error type: {type(e)}")
+            error_message = f"Error processing request: {str(e)}"
+            self.chat_history.context[0].content[0] = {"message": error_message, "function": [""]}
+            yield error_message
+
+    async def process_user_message(self, chat_history: dict):
+        """Process a user message and return the appropriate response"""
+        print("\n=== PROCESS USER MESSAGE: Starting ===")
         
-        chat.extend(chat_history)
+        print("=== PROCESS USER MESSAGE: Generating system context ===")
+        # Generate the system context with enhanced instructions
+        chat = self.build_chat(chat_history)
+        request = first_completion_request(chat)
+        print(f"System context length: {len(chat[0]['content'])}")
+        
+        client = self.openai_client
+        print(f"OpenAI client initialized with key: {'*'*len(self.openai_api_key)}")
+
         print(f"Full chat context length: {len(chat)}")
         print("=== PROCESS USER MESSAGE: Making first API call ===")
         
         try:
             # First API call to get function call or direct response
-            chat_completion = client.chat.completions.create(
-                model='gpt-4o',
-                messages=chat,
-                functions=functions,
-                function_call = "auto",
-                temperature=.3,
-                max_tokens=1024
-            )
-            print("API call completed successfully")
-            
-            response_message = chat_completion.choices[0].message
+            # An identical request within the last few minutes reuses its response
+            cache_key = completion_cache_key(request)
+            response_message = get_cached_completion(cache_key)
+            if response_message is None:
+                await openai_rate_limiter.acquire(openai_rate_limiter.estimate_tokens(chat, OPENAI_MAX_TOKENS))
+                chat_completion = await client.chat.completions.create(**request)
+                print("API call completed successfully")
+                
+                response_message = chat_completion.choices[0].message
+                cache_completion(cache_key, response_message)
+            else:
+                print("Using cached response for first API call")
             response_content = response_message.content
             print("\n=== First API Response Details ===")
             print("Complete response object:")
@@ -742,94 +1398,38 @@ class ConversationHandler:
             return [{"message": f"Error processing request: {str(e)}", "function": [""]}]
         
         print("\n=== PROCESS USER MESSAGE: Processing API response ===")
-        # Check if there's a function call in the response
-        function_call = response_message.function_call
-        print(f"Function call present: {function_call is not None}")
+        # Check if there are tool calls in the response
+        tool_calls = response_message.tool_calls or []
+        print(f"Function call present: {bool(tool_calls)}")
 
-        if function_call:
-            function_name = function_call.name
-            print(f"Function call detected: {function_call.name}")
-            try:
-                arguments = json.loads(function_call.arguments)
-                if function_name == "create_event" or function_name == "calculate_grade":
-                    arguments["canvas_base_url"] = self.canvas_api_url
-                    arguments["access_token"] = self.canvas_api_token
-                    if function_name == "calculate_grade":
-                        arguments["hf_api_token"] = self.hf_api_token
+        if tool_calls:
+            follow_up = await self.run_function_calls(chat_history, response_message)
+            if not isinstance(follow_up, FollowUp):
+                return follow_up
+            function_name, result = follow_up.function_name, follow_up.result
 
-            except json.JSONDecodeError as e:
-                print(f"ERROR decoding function arguments: {str(e)}")
-                print(f"Raw arguments: {function_call.arguments}")
-                return [{"message": "Error processing function arguments", "function": [""]}]
-            
-            print("=== PROCESS USER MESSAGE: Preparing function call ===")
-                    
-            
-
-            print("\n=== PROCESS USER MESSAGE: Executing function ===")
-            if function_name in function_mapping:
-                print(f"Executing function: {function_name}")
-                print(f"Function object: {function_mapping[function_name]}")
-                try:
-                    print(f"Arguments: {arguments}")
-                    if function_name != "create_notes":
-                        result = await function_mapping[function_name](**arguments)
-                    print(f"Function execution completed")
-                    print(f"Function result type: {type(result)}")
-                    if result is None:
-                        print("WARNING: Function returned None")
-                except Exception as e:
-                    print(f"ERROR during function execution: {str(e)}")
-                    print(f"Error type: {type(e)}")
-                    result = {"error": f"Error executing function: {str(e)}"}
-            else:
-                print(f"ERROR: Function '{function_name}' not found in function_mapping")
-                result = {"error": f"Function '{function_name}' not implemented."}
-
-            print("\n=== PROCESS USER MESSAGE: Makixng second API call with function result ===")
-
-            if function_name == "create_notes":
-                return_value = {"message": "Your PDF has been created.", "function": [function_name, json.dumps(arguments), "arrays-pointers"]}
-                self.chat_history.context[0].content[0] = return_value
-                return self.chat_history
-
-            
-            chat.append({
-                'role': "function",
-                "name": function_name,
-                "content": json.dumps(result)
-            })
-
-            
-           
+            print("\n=== PROCESS USER MESSAGE: Making second API call with function result ===")
             try:
-                # Context is then passed back to the api in order for it to respond to the user
-                system_context_for_function_output = self.define_system_context_for_function_output()
-                chat[0]["content"] = system_context_for_function_output
                 print("About to make second OpenAI API call")
-                final_completion = client.chat.completions.create(
-                    model='gpt-4o',
-                    messages=chat,
-                    temperature=0.3,
-                    max_tokens=1024
-                )
-                print("Second API call completed successfully")
+                cache_key = completion_cache_key(follow_up.chat)
+                final_message = get_cached_completion(cache_key)
+                if final_message is None:
+                    await openai_rate_limiter.acquire(openai_rate_limiter.estimate_tokens(follow_up.chat, OPENAI_MAX_TOKENS))
+                    follow_up_completion = await client.chat.completions.create(**follow_up_completion_request(follow_up.chat))
+                    final_message = follow_up_completion.choices[0].message.content
+                    cache_completion(cache_key, final_message)
+                    print("Second API call completed successfully")
+                else:
+                    print("Using cached response for second API call")
                 
-                """print("\n=== Second API Response Details ===")
-                print("Complete response object:")
-                print(f"Response message: {final_completion.choices[0].message}")
-                print(f"Response content: {final_completion.choices[0].message.content}")
-                print(f"Response message dict: {vars(final_completion.choices[0].message)}")
-                print("================================\n")"""
-                final_message = final_completion.choices[0].message.content
                 print(final_message)
-                return_value = {"message": final_message, "function": [function_name, json.dumps(result)]}
+                return_value = {"message": final_message, "function": [function_name, dumps_json(result)]}
                 self.chat_history.context[0].content[0] = return_value
                 
             except Exception as e:
                 print(f"ERROR during second API call: {str(e)}")
                 print(f"Error type: {type(e)}")
-                return_value = [{"message": f"Error processing function result: {str(e)}", "function": [function_name, json.dumps(result)]}]
+                return_value = [{"message": f"Error processing function result: {str(e)}", "function": [function_name, dumps_json(result)]}]
                 self.chat_history.context[0].content[0] = return_value
         else:
             print("=== PROCESS USER MESSAGE: No function call needed ===")
@@ -3,14 +3,16 @@ import os
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Union
-from chat_bot.conversation_handler import ConversationHandler
+from chat_bot.conversation_handler import ConversationHandler, close_shared_clients
 from backend.data_retrieval.data_handler import DataHandler
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 import aiohttp
 from dotenv import load_dotenv
 import time
 import json
 import asyncio
+import hashlib
+from collections import OrderedDict
 
 load_dotenv()
 
@@ -58,6 +60,11 @@ class PushClassesObject(BaseModel):
     classes: List[ClassesDict]
 
 
+# Close the OpenAI client and Canvas session shared across requests
+@app.on_event("shutdown")
+async def shutdown():
+    await close_shared_clients()
+
 # Root directory for testing connection
 @app.get('/')
 async def root():
@@ -89,36 +96,7 @@ async def mainPipelineEntry(contextArray: ContextObject):
     chat_requirements = await check_chat_requirements(contextArray)
     print("these are the chat requirements: ", chat_requirements)
     if chat_requirements == "None":
-            
-
-        print("\n=== STAGE 1: Starting mainPipelineEntry ===")
-        context_data = contextArray.context
-        user_context = context_data[1]
-        user_id = user_context.user_id
-        user_domain = user_context.domain
-
-        
-        handler = DataHandler(user_id, user_domain)
-        user_data = handler.grab_user_data()
-        user_name = user_data["user_metadata"]["name"]
-        user_token = user_data["user_metadata"]["token"]
-        
-        print("=== STAGE 2: Processing context data ===")
-        # Handle both dictionary and Pydantic model access
-        
-        courses = {}  # Changed to a single dictionary
-
-        for class_info in user_context.classes:
-            if class_info.selected == True:
-                # Remove 'course_' prefix from ID and store as a simple key-value pair
-                course_id = class_info.id.replace('course_', '')
-                courses[class_info.name] = course_id
-        
-        print("=== STAGE 3: Initializing ConversationHandler ===")
-        conversation_handler = ConversationHandler(student_name=user_name, student_id=f"user_{user_id}", courses=courses,domain=user_domain,chat_history=contextArray,canvas_api_token=user_token)
-        
-        print("=== STAGE 4: Transforming user message ===")
-        chat_history = conversation_handler.transform_user_message(contextArray)
+        conversation_handler, chat_history = build_conversation(contextArray)
         
         print("=== STAGE 5: Processing chat history ===")
         response = await conversation_handler.process_user_message(chat_history)
@@ -129,7 +107,195 @@ async def mainPipelineEntry(contextArray: ContextObject):
         contextArray.context[0].content[0] = {"message": chat_requirements,"function":[""]}
         return contextArray
 
+# Marks the end of the streamed reply text; the rest of the stream is the JSON reply record
+STREAM_RECORD_SEPARATOR = "\x1e"
+
+async def stream_reply_with_record(conversation_handler: ConversationHandler, chat_history: list):
+    """Yield the streamed reply text, then the separator and the final {"message", "function"} record"""
+    async for text in conversation_handler.stream_user_message(chat_history):
+        yield text
+    record = conversation_handler.chat_history.context[0].content[0]
+    if isinstance(record, BaseModel):
+        record = record.dict()
+    yield STREAM_RECORD_SEPARATOR + json.dumps(record)
+
+# Stream the reply to the main prompt as plain text
+@app.post('/endpoints/mainPipelineStream')
+async def mainPipelineStream(contextArray: ContextObject):
+    """
+    Streaming version of mainPipelineEntry.
+    The reply is sent as it is generated, including answers written from function results.
+
+    ===============================================
+    
+    inputs:
+    contextArray: ContextObject
+
+    outputs:
+    text/plain stream of the assistant's reply, followed by "\\x1e" and the JSON
+    {"message": str, "function": List[str]} record that mainPipelineEntry returns in
+    context[0].content[0]. The client stores that record in its context, so the function
+    history (and create_notes' "arrays-pointers" payload) reaches the next turn.
+
+    ===============================================
+    """
+    chat_requirements = await check_chat_requirements(contextArray)
+    print("these are the chat requirements: ", chat_requirements)
+    if chat_requirements != "None":
+        record = {"message": chat_requirements, "function": [""]}
+        return StreamingResponse(iter([chat_requirements, STREAM_RECORD_SEPARATOR + json.dumps(record)]), media_type="text/plain")
+
+    conversation_handler, chat_history = build_conversation(contextArray)
+
+    print("=== STAGE 5: Streaming chat history ===")
+    return StreamingResponse(stream_reply_with_record(conversation_handler, chat_history), media_type="text/plain")
+
+def build_conversation(contextArray: ContextObject):
+    """
+    Set up the ConversationHandler for a chat request and transform its history.
+
+    outputs:
+    (ConversationHandler, chat history in OpenAI message format)
+    """
+    print("\n=== STAGE 1: Starting mainPipelineEntry ===")
+    context_data = contextArray.context
+    user_context = context_data[1]
+    user_id = user_context.user_id
+    user_domain = user_context.domain
+
+    
+    handler = DataHandler(user_id, user_domain)
+    user_data = handler.grab_user_data()
+    user_name = user_data["user_metadata"]["name"]
+    user_token = user_data["user_metadata"]["token"]
+    
+    print("=== STAGE 2: Processing context data ===")
+    # Handle both dictionary and Pydantic model access
+    
+    courses = {}  # Changed to a single dictionary
+
+    for class_info in user_context.classes:
+        if class_info.selected == True:
+            # Remove 'course_' prefix from ID and store as a simple key-value pair
+            course_id = class_info.id.replace('course_', '')
+            courses[class_info.name] = course_id
+    
+    print("=== STAGE 3: Initializing ConversationHandler ===")
+    conversation_handler = ConversationHandler(student_name=user_name, student_id=f"user_{user_id}", courses=courses,domain=user_domain,chat_history=contextArray,canvas_api_token=user_token)
+    
+    print("=== STAGE 4: Transforming user message ===")
+    chat_history = conversation_handler.transform_user_message(contextArray)
+    return conversation_handler, chat_history
+
+
 
+# Courses requested per Canvas page, and how many pages pullCourses fetches at once
+COURSES_PER_PAGE = 100
+COURSE_PAGE_CONCURRENCY = 10
+
+# Course lists change only a few times a semester, so pullCourses reuses them for a while.
+# Set ENABLE_API_CACHE=false to always fetch from Canvas.
+ENABLE_API_CACHE = os.getenv("ENABLE_API_CACHE", "true").lower() != "false"
+COURSE_CACHE_TTL_SECONDS = 30 * 60
+COURSE_CACHE_MAX_ENTRIES = 1024
+_course_list_cache = OrderedDict() # (api url, token hash) -> (time stored, courses), least recently used first
+
+async def fetch_courses_page(session: aiohttp.ClientSession, api_url: str, headers: dict, page_number: int):
+    """
+    Fetch one page of the user's active courses.
+    Syllabus bodies are not requested, since only course ids and names are used here.
+
+    outputs:
+    (status, courses on the page, last page number from the Link header or None)
+    """
+    async with session.get(
+        f"{api_url}/courses/",
+        params={"enrollment_state": "active", "include[]": ["all_courses"], "page": page_number, "per_page": COURSES_PER_PAGE},
+        headers=headers
+    ) as response:
+        if response.status != 200:
+            return response.status, [], None
+
+        last_page = None
+        last_link = response.links.get("last")
+        if last_link:
+            page = last_link["url"].query.get("page")
+            if page and page.isdigit():
+                last_page = int(page)
+
+        return response.status, await response.json(), last_page
+
+async def fetch_all_courses(api_url: str, token: str):
+    """
+    Fetch every page of the user's active courses.
+
+    outputs:
+    list of course objects, or None if Canvas returned an error
+    """
+    courses = []
+    async with aiohttp.ClientSession() as session:
+        headers = {"Authorization": f"Bearer {token}"}
+
+        # The first page's Link header tells us how many pages there are
+        status, courses_data, last_page = await fetch_courses_page(session, api_url, headers, 1)
+        if status != 200:
+            return None
+        courses += courses_data
+
+        if courses_data and last_page:
+            # Fetch the remaining pages concurrently
+            semaphore = asyncio.Semaphore(COURSE_PAGE_CONCURRENCY)
+
+            async def fetch_page(page_number):
+                async with semaphore:
+                    return await fetch_courses_page(session, api_url, headers, page_number)
+
+            pages = await asyncio.gather(*(fetch_page(page_number) for page_number in range(2, last_page + 1)))
+            for status, courses_data, _ in pages:
+                if status != 200:
+                    return None
+                courses += courses_data
+        else:
+            # No last page advertised, so walk the pages until one comes back empty
+            page_number = 2
+            while courses_data:
+                status, courses_data, _ = await fetch_courses_page(session, api_url, headers, page_number)
+                if status != 200:
+                    return None
+                courses += courses_data
+                page_number += 1
+    return courses
+
+async def fetch_all_courses_cached(api_url: str, token: str):
+    """
+    Return the user's active courses, reusing a fetch from the last COURSE_CACHE_TTL_SECONDS.
+    Only the id and name of each course are kept, since that is all pullCourses displays.
+    """
+    # Key on a hash of the token so raw tokens are not held as dictionary keys
+    cache_key = (api_url, hashlib.sha256(token.encode()).hexdigest())
+    if ENABLE_API_CACHE:
+        cached = _course_list_cache.get(cache_key)
+        if cached:
+            if time.monotonic() - cached[0] < COURSE_CACHE_TTL_SECONDS:
+                _course_list_cache.move_to_end(cache_key)
+                return cached[1]
+            del _course_list_cache[cache_key]
+
+    courses = await fetch_all_courses(api_url, token)
+    if courses is None:
+        return None
+
+    courses = [{"id": course.get("id"), "name": course.get("name")} for course in courses]
+    if ENABLE_API_CACHE:
+        _course_list_cache[cache_key] = (time.monotonic(), courses)
+        _course_list_cache.move_to_end(cache_key)
+        # Drop expired entries from the least recently used end, then any over the limit
+        now = time.monotonic()
+        while _course_list_cache and now - next(iter(_course_list_cache.values()))[0] >= COURSE_CACHE_TTL_SECONDS:
+            _course_list_cache.popitem(last=False)
+        while len(_course_list_cache) > COURSE_CACHE_MAX_ENTRIES:
+            _course_list_cache.popitem(last=False)
+    return courses
 
 @app.get('/endpoints/pullCourses')
 async def pullCourses(user_id, domain):
@@ -159,44 +325,22 @@ async def pullCourses(user_id, domain):
     
     #pull courses selected from user data
     courses_selected = user_data["user_metadata"]["courses_selected"]
-    all_courses = []
-    courses_added = []    
-    
     #only one course is in each course object, but we still need to iterate through the course object to get the course id and course name
-    for course_id, course_name in courses_selected.items():
-            course_formatted = ClassesDict(id=course_id, name=course_name, selected=True)
-            all_courses += [course_formatted]
-            courses_added += [course_id]
+    all_courses = [ClassesDict(id=course_id, name=course_name, selected=True) for course_id, course_name in courses_selected.items()]
+    # Set of ids already listed, for constant-time membership checks
+    courses_added = set(courses_selected)
     
-    courses = []
-    
-    #pull all classes from canvas api
-
-    page_number = 1
-    async with aiohttp.ClientSession() as session:
-        headers = {"Authorization": f"Bearer {handler.grab_user_data()['user_metadata']['token']}"}
-        while True:
-            async with session.get(
-                f"{handler.API_URL}/courses/",
-                params={"enrollment_state": "active", "include[]": ["all_courses", "syllabus_body"], "page": page_number},
-                headers=headers
-            ) as response:
-                if response.status == 200:
-                    courses_data = await response.json()
-                    if not courses_data:  # Break if no more courses are returned
-                        break
-                    courses += courses_data
-                else:
-                    return {"message": "Error pulling courses from Canvas API"}
-            page_number += 1
+    #pull all classes from canvas api (cached for a short time per user)
+    courses = await fetch_all_courses_cached(handler.API_URL, user_data['user_metadata']['token'])
+    if courses is None:
+        return {"message": "Error pulling courses from Canvas API"}
     
     #iterate through all classes and if not in courses_added, add to all_classes
     for course in courses:
-
-        if str(course.get("id")) not in courses_added and course.get("name"):
-            course_formatted = ClassesDict(id=course.get("id"), name=course.get("name"), selected=False)
-            all_courses += [course_formatted]
-            courses_added += [str(course.get("id"))]
+        course_id = str(course.get("id"))
+        if course_id not in courses_added and course.get("name"):
+            all_courses.append(ClassesDict(id=course_id, name=course.get("name"), selected=False))
+            courses_added.add(course_id)
 
     #classes are returned in the format {course_id: course_name}
     return {'courses': all_courses}
@@ -1,94 +1,128 @@
-import io
+import asyncio
 import aiohttp
 from urllib.parse import urlparse
 import os
+import tempfile
 import fitz  # PyMuPDF
 from docx import Document
 from pptx import Presentation
 import re
 
-async def parse_file_content(url: str):
-    """Parse content from PDF, DOCX, or PPTX file at the given URL."""
+# Size of each chunk written to disk while downloading a file
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+async def parse_file_content(url: str, session: aiohttp.ClientSession = None):
+    """
+    Parse content from PDF, DOCX, or PPTX file at the given URL.
     
-    # Download file
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers={"User-Agent": "Mozilla/5.0"}) as response:
-            if response.status != 200:
-                return f"Error downloading file: {response.status}"
-            file_bytes = await response.read()
+    Args:
+        url: URL of the file to download
+        session: Optional shared aiohttp session; a new one is opened if not given
+    """
+    
+    # Download file in chunks to a temporary file so large files are never held in memory
+    temp_file = tempfile.NamedTemporaryFile(delete=False)
+    try:
+        try:
+            if session is None:
+                async with aiohttp.ClientSession() as own_session:
+                    status = await _download_to_file(own_session, url, temp_file)
+            else:
+                status = await _download_to_file(session, url, temp_file)
+        finally:
+            temp_file.close()
+        
+        if status != 200:
+            return f"Error downloading file: {status}"
+        # Parsing is blocking, so run it off the event loop
+        return await asyncio.to_thread(_parse_downloaded_file, temp_file.name)
+    finally:
+        os.remove(temp_file.name)
+
+async def _download_to_file(session: aiohttp.ClientSession, url: str, file_obj) -> int:
+    """Stream the response body at url into file_obj and return the HTTP status."""
+    async with session.get(url, headers={"User-Agent": "Mozilla/5.0"}) as response:
+        if response.status == 200:
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                file_obj.write(chunk)
+        return response.status
+
+def _extract_pdf_text(file_path: str) -> str:
+    """Extract the text of every page of a PDF, joined in one pass."""
+    doc = fitz.open(file_path, filetype="pdf")
+    try:
+        return "".join([page.get_text() + "\n\n" for page in doc])
+    finally:
+        doc.close()
+
+def _extract_pptx_text(file_path: str) -> str:
+    """Extract the text of every shape in a PPTX, one blank line between slides."""
+    prs = Presentation(file_path)
+    parts = []
+    for slide in prs.slides:
+        for shape in slide.shapes:
+            if hasattr(shape, "text") and shape.text.strip():
+                parts.append(shape.text + "\n")
+        parts.append("\n")
+    return "".join(parts)
+
+def _parse_downloaded_file(file_path: str):
+    """Parse content from a downloaded PDF, DOCX, or PPTX file on disk."""
     
     # Check file signature/magic bytes
     file_type = None
-    bytes_data = file_bytes[:8]  # First few bytes for signature detection
+    with open(file_path, 'rb') as f:
+        header = f.read(4000)  # First few bytes for signature detection
     
     # PDF signature: %PDF
-    if file_bytes[:4] == b'%PDF':
+    if header[:4] == b'%PDF':
         file_type = 'pdf'
     # DOCX, PPTX (ZIP-based formats)
-    elif bytes_data[:2] == b'PK':
+    elif header[:2] == b'PK':
         # Further inspect the ZIP contents for Office XML formats
-        byte_stream = io.BytesIO(file_bytes)
-        
         # Try to load as PPTX first (since you mentioned this specific URL is a PPTX)
         try:
-            Presentation(byte_stream)
+            Presentation(file_path)
             file_type = 'pptx'
         except:
-            byte_stream.seek(0)
             try:
-                Document(byte_stream)
+                Document(file_path)
                 file_type = 'docx'
             except:
                 # If both fail, check for content markers
-                if b'ppt/' in file_bytes[:4000] or b'presentation' in file_bytes[:4000]:
+                if b'ppt/' in header or b'presentation' in header:
                     file_type = 'pptx'
-                elif b'word/' in file_bytes[:4000] or b'document.xml' in file_bytes[:4000]:
+                elif b'word/' in header or b'document.xml' in header:
                     file_type = 'docx'
     
     # Process based on detected file type
     text = ""
     try:
         if file_type == 'pdf':
-            doc = fitz.open(stream=io.BytesIO(file_bytes), filetype="pdf")
-            for page in doc:
-                text += page.get_text() + "\n\n"
-            doc.close()
+            text = _extract_pdf_text(file_path)
         elif file_type == 'docx':
-            doc = Document(io.BytesIO(file_bytes))
+            doc = Document(file_path)
             text = "\n".join([p.text for p in doc.paragraphs if p.text])
         elif file_type == 'pptx':
-            prs = Presentation(io.BytesIO(file_bytes))
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text") and shape.text.strip():
-                        text += shape.text + "\n"
-                text += "\n"
+            text = _extract_pptx_text(file_path)
         else:
             # If still unable to determine, try the most common formats
             try:
-                doc = fitz.open(stream=io.BytesIO(file_bytes), filetype="pdf")
-                for page in doc:
-                    text += page.get_text() + "\n\n"
-                doc.close()
+                text += _extract_pdf_text(file_path)
                 if text.strip():
                     return text
             except:
                 pass
                 
             try:
-                prs = Presentation(io.BytesIO(file_bytes))
-                for slide in prs.slides:
-                    for shape in slide.shapes:
-                        if hasattr(shape, "text") and shape.text.strip():
-                            text += shape.text + "\n"
-                    text += "\n"
+                text += _extract_pptx_text(file_path)
                 if text.strip():
                     return text
             except:
                 pass
                 
             try:
-                doc = Document(io.BytesIO(file_bytes))
+                doc = Document(file_path)
                 text = "\n".join([p.text for p in doc.paragraphs if p.text])
                 if text.strip():
                     return text
@@ -48,14 +48,26 @@ import chromadb
 import requests
 from datetime import datetime, timedelta, timezone
 from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from chromadb.config import Settings
 import asyncio
 import aiohttp
 import re
+import threading
+import time
+from collections import OrderedDict
+
+# orjson parses the user data file several times faster than json when it is installed;
+# its decode errors subclass json.JSONDecodeError
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Add the project root directory to Python path
 root_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(root_dir))
 
-from vectordb.embedding_model import create_hf_embedding_function
+from vectordb.embedding_model import create_embedding_function, HFEmbeddingFunction
 from vectordb.content_extraction import parse_file_content, parse_html_content
 from vectordb.text_processing import preprocess_text_for_embedding
 from vectordb.filters import handle_keywords, build_chromadb_query
@@ -63,6 +75,180 @@ from vectordb.post_process import post_process_results, augment_results
 # Load environment variables
 load_dotenv()
 
+def load_json_file(path):
+    """Parse a JSON file, with orjson when it is available."""
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
+
+# Number of documents embedded and upserted to ChromaDB per call in process_data
+UPSERT_BATCH_SIZE = 64
+
+# Cache of raw ChromaDB query results shared by all VectorDatabase instances in the process.
+# Keys include a per-collection write epoch, so any write to a collection invalidates its entries.
+QUERY_CACHE_TTL_SECONDS = 300
+QUERY_CACHE_MAX_ENTRIES = 256
+_query_cache = OrderedDict() # cache key -> (time stored, query results)
+_query_cache_lock = threading.Lock()
+_collection_epochs = {} # collection name -> number of writes seen
+
+
+def canonical_query_text(query_text):
+    """
+    Collapse spacing and drop trailing punctuation, so queries differing only in those
+    ("next assignment?" / "next  assignment") embed the same text and share cached results.
+    """
+    return " ".join(query_text.split()).rstrip("?.! ")
+
+# Approximate cache: a query whose embedding is within APPROX_CACHE_TAU cosine distance
+# of a cached query (same collection, filters, keywords, identifiers and top_k) reuses that
+# query's results. Off unless APPROX_QUERY_CACHE is set, since near-identical embeddings
+# can still ask about different items.
+APPROX_QUERY_CACHE_ENABLED = os.getenv("APPROX_QUERY_CACHE", "").lower() in ("1", "true", "yes")
+APPROX_CACHE_TAU = 0.08
+APPROX_CACHE_MAX_ENTRIES = 1000
+
+
+class ApproxQueryCache:
+    """
+    LRU cache of ChromaDB query results looked up by embedding similarity.
+    Rephrasings of a recent question ("when is my assignment due?" vs
+    "when's the assignment due?") skip the vector index search entirely.
+    """
+
+    def __init__(self, tau: float = APPROX_CACHE_TAU, max_entries: int = APPROX_CACHE_MAX_ENTRIES):
+        self.tau = tau
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # entry id -> (scope, unit query embedding, time stored, results)
+        # scope -> (entry ids, stacked unit embeddings, times stored), rebuilt only after
+        # an entry in that scope is added or evicted
+        self._scope_index = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        # Zero vectors come from failed embedding calls and can't be compared
+        if norm == 0:
+            return None
+        return vector / norm
+
+    def _get_scope_index(self, scope):
+        index = self._scope_index.get(scope)
+        if index is None:
+            entry_ids = [entry_id for entry_id, entry in self._entries.items() if entry[0] == scope]
+            if not entry_ids:
+                return None
+            index = (
+                entry_ids,
+                np.stack([self._entries[entry_id][1] for entry_id in entry_ids]),
+                np.array([self._entries[entry_id][2] for entry_id in entry_ids])
+            )
+            self._scope_index[scope] = index
+        return index
+
+    def lookup(self, scope, embedding):
+        """Return cached results for the most similar query in scope, or None."""
+        query = self._normalize(embedding)
+        if query is None:
+            return None
+        with self._lock:
+            index = self._get_scope_index(scope)
+            if index is None:
+                return None
+            entry_ids, keys, times_stored = index
+            # One matrix-vector product scores every cached query in the scope
+            similarities = keys @ query
+            similarities[time.monotonic() - times_stored >= QUERY_CACHE_TTL_SECONDS] = -np.inf
+            best = int(np.argmax(similarities))
+            if similarities[best] < 1 - self.tau:
+                return None
+            entry_id = entry_ids[best]
+            self._entries.move_to_end(entry_id)
+            return self._entries[entry_id][3]
+
+    def insert(self, scope, embedding, results):
+        """Store results under the query embedding, evicting the least recently used entries."""
+        query = self._normalize(embedding)
+        if query is None:
+            return
+        with self._lock:
+            self._entries[self._next_id] = (scope, query, time.monotonic(), results)
+            self._next_id += 1
+            self._scope_index.pop(scope, None)
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._scope_index.pop(evicted[0], None)
+
+
+_approx_query_cache = ApproxQueryCache()
+
+
+# Instruction prefix the e5-instruct embedding model expects on search queries
+SEARCH_TASK_DESCRIPTION = "Given a student query about course materials, retrieve relevant Canvas resources that provide comprehensive information to answer the query."
+
+
+def format_search_query(normalized_query):
+    """Wrap a normalized query in the instruction format used for query embeddings."""
+    return f"Instruct: {SEARCH_TASK_DESCRIPTION}\nQuery: {canonical_query_text(normalized_query)}"
+
+
+# Words containing a digit ("homework 3" -> "3", "cmpsc465"), which embeddings barely tell apart
+QUERY_IDENTIFIER_PATTERN = re.compile(r"\w*\d\w*")
+
+
+def query_cache_scope(search_parameters):
+    """
+    Scope for cached query results: the search parameters the where clause is built from,
+    plus the query's keywords and identifiers. The where clause itself can't be used, since
+    its time range bounds are computed from the current second; results cached under the
+    same time range are reused within the TTL.
+    """
+    query = search_parameters.get("query") or ""
+    return (
+        search_parameters.get("course_id"),
+        search_parameters.get("time_range"),
+        tuple(sorted(search_parameters.get("item_types") or [])),
+        tuple(sorted(search_parameters.get("specific_dates") or [])),
+        tuple(sorted({str(keyword).casefold().strip() for keyword in search_parameters.get("keywords") or []})),
+        tuple(sorted(set(QUERY_IDENTIFIER_PATTERN.findall(query.casefold())))),
+    )
+
+# Maps requested item types to document types when filtering related documents
+RELATED_TYPE_MAPPING = {
+    "assignment": "assignment",
+    "file": "file",
+    "quiz": "quiz",
+    "announcement": "announcement",
+    "event": "event"
+}
+
+# Default mapping of generality levels to top_k values
+GENERALITY_TOP_K = {
+    "LOW": 5,         # Focused search
+    "MEDIUM": 10,     # Balanced approach (default)
+    "HIGH": 20        # Comprehensive search
+}
+
+# Maps each user_data collection key to the document type of its items
+DOCUMENT_TYPE_KEYS = {
+    'files': 'file', 'announcements': 'announcement', 'assignments': 'assignment',
+    'quizzes': 'quiz', 'calendar_events': 'event'
+}
+
+# Maps each document type to its (source date field, metadata timestamp field).
+# Built once at import instead of once per document in process_data.
+DATE_FIELD_MAPPING = {
+    'assignment': ('due_at', 'due_timestamp'),
+    'announcement': ('posted_at', 'posted_timestamp'),
+    'quiz': ('due_at', 'due_timestamp'),
+    'event': ('start_at', 'start_timestamp'),
+    'file': ('updated_at', 'updated_timestamp')
+}
 
 
 class VectorDatabase:
@@ -84,11 +270,15 @@ class VectorDatabase:
         else:
             self.cache_dir = "chroma_data/"
         
+        # Data parsed here is handed to the first load so the file isn't parsed twice
+        self._parsed_json = None # ((st_mtime_ns, st_size), data)
+
         # Load JSON file to extract user_id if collection_name is not provided
         if collection_name is None:
             try:
-                with open(json_file_path, 'r') as f:
-                    data = json.load(f)
+                file_stat = os.stat(json_file_path)
+                data = load_json_file(json_file_path)
+                self._parsed_json = ((file_stat.st_mtime_ns, file_stat.st_size), data)
                 user_id = data.get('user_metadata', {}).get('id', 'default')
                 self.collection_name = f"canvas_embeddings_{user_id}"
             except Exception as e:
@@ -98,44 +288,40 @@ class VectorDatabase:
             self.collection_name = collection_name
         
         # Initialize ChromaDB client to store files in disk in cache_dir
-        self.client = chromadb.PersistentClient(path=self.cache_dir)
+        # Telemetry is disabled so client operations don't trigger analytics network calls
+        self.client = chromadb.PersistentClient(
+            path=self.cache_dir,
+            settings=Settings(anonymized_telemetry=False)
+        )
         
-        # Use Hugging Face API for embeddings with multilingual-e5-large-instruct model
+        # Use Hugging Face API for embeddings with multilingual-e5-large-instruct model,
+        # or the same model locally when EMBEDDING_BACKEND=local
         self.hf_api_token = hf_api_token
-        if not self.hf_api_token:
-            raise ValueError("Hugging Face API token is required. Provide it as a parameter or set HUGGINGFACE_API_TOKEN environment variable.")
         
-        # Custom embedding function using Hugging Face API
-        self.embedding_function = create_hf_embedding_function(self.hf_api_token)
+        # Custom embedding function (raises if the Hugging Face backend has no API token)
+        self.embedding_function = create_embedding_function(self.hf_api_token)
         
         self.documents = [] # stores documents
         self.document_map = {} # Allows O(1) lookup of documents by ID
         self.course_map = {} # information about courses
         self.syllabus_map = {} # information about syllabi
         
-        try: # Attempts to retrieve existing collection
-            self.collection = self.client.get_collection(
-                name=self.collection_name,
-                embedding_function=self.embedding_function
-            )
-            print(f"Using existing collection: {self.collection_name}")
-        
-        except Exception: # If no existing collection, collection is created
-            print(f"Creating new collection: {self.collection_name}")
-            self.collection = self.client.create_collection(
-                name=self.collection_name,
-                embedding_function=self.embedding_function,
-                # hnsw:space defined the distance function of the embedding space
-                # cosine is currently selected
-                metadata={"hnsw:space": "cosine"}
-            )
-            '''
-            Other hyperparameters to be changed in testing:
-            hnsw:space: euclidean, manhattan, cosine, dot
-            hnsw:ef_construction: determines the size of the candidate list (default: 100)
-            hnsw:search_ef: determines the size of the dynamic list (default: 100)
-            hnsw:m: determines the number of neighbors (edges) each node in the graph can have (default: 16)
-            '''
+        # Retrieves the existing collection or creates it in a single round-trip
+        self.collection = self.client.get_or_create_collection(
+            name=self.collection_name,
+            embedding_function=self.embedding_function,
+            # hnsw:space defined the distance function of the embedding space
+            # cosine is currently selected
+            metadata={"hnsw:space": "cosine"}
+        )
+        print(f"Using collection: {self.collection_name}")
+        '''
+        Other hyperparameters to be changed in testing:
+        hnsw:space: euclidean, manhattan, cosine, dot
+        hnsw:ef_construction: determines the size of the candidate list (default: 100)
+        hnsw:search_ef: determines the size of the dynamic list (default: 100)
+        hnsw:m: determines the number of neighbors (edges) each node in the graph can have (default: 16)
+        '''
     
     async def process_data(self) -> bool:
         """
@@ -148,8 +334,7 @@ class VectorDatabase:
             True if data was processed, False if using cached data.
         """
         try:
-            with open(self.json_file_path, 'r') as f:
-                data = json.load(f)
+            data = self._read_json_data()
         except Exception as e:
             print(f"Error loading JSON file: {e}")
             return False
@@ -161,19 +346,23 @@ class VectorDatabase:
         # Update local data structures
         await self._update_local_data_structures(data)
         
-        removed_count = await self._synchronize_chromadb_with_local_data()
-        print(f"Removed {removed_count} stale documents from ChromaDB.")
-        
-        # Get existing document IDs in the collection
+        # Get existing document IDs in the collection once; the stale ids removed below
+        # are never local document ids, so the set stays valid for skipping existing docs
         existing_ids = await self._get_all_collection_ids()
         
+        removed_count = await self._synchronize_chromadb_with_local_data(existing_ids)
+        print(f"Removed {removed_count} stale documents from ChromaDB.")
+        
         # Prepare lists for documents to add
         ids_to_add = []
         texts_to_add = []
         metadatas_to_add = []
         
+        # Stamp every document in this batch with the same local time
+        local_time = datetime.now().strftime('%Y-%m-%d %I:%M %p')
+        
         # Process syllabi
-        for course_id, syllabus in self.syllabus_map.items():
+        for course_id in self.syllabus_map:
             # Generate a unique ID for the syllabus
             syllabus_id = f"syllabus_{course_id}"
             
@@ -181,29 +370,15 @@ class VectorDatabase:
                 print(f"Syllabus for course {course_id} already exists. Skipping.")
                 continue
             
-            # Parse the HTML content to extract plain text
-            parsed_syllabus = parse_html_content(syllabus)
-            if not parsed_syllabus:
+            # Syllabus HTML was already parsed into a document by _update_local_data_structures
+            syllabus_doc = self.document_map.get(syllabus_id)
+            if not syllabus_doc:
                 print(f"No content extracted from syllabus for course {course_id}")
                 continue
             
-            # Create a syllabus document
-            syllabus_doc = {
-                'id': syllabus_id,
-                'type': 'syllabus',
-                'course_id': course_id,
-                'title': f"Syllabus for {self.course_map[course_id].get('name', f'Course {course_id}')}",
-                'content': parsed_syllabus  # Use the parsed content
-            }
-            
-            # Store document in memory if not already there
-            if syllabus_id not in self.document_map:
-                self.documents.append(syllabus_doc)
-                self.document_map[syllabus_id] = syllabus_doc
-            
             # Prepare for ChromaDB
             ids_to_add.append(syllabus_id)
-            texts_to_add.append(preprocess_text_for_embedding(syllabus_doc))
+            texts_to_add.append(preprocess_text_for_embedding(syllabus_doc, local_time))
             
             # Create metadata
             metadata = {
@@ -231,7 +406,7 @@ class VectorDatabase:
             # Prepare for ChromaDB
             print(f"Processing item: {item_id}")
             ids_to_add.append(item_id)
-            texts_to_add.append(preprocess_text_for_embedding(item))
+            texts_to_add.append(preprocess_text_for_embedding(item, local_time))
             
             # Create base metadata
             metadata = {
@@ -251,17 +426,9 @@ class VectorDatabase:
                 metadata['course_id'] = str(course_id)
             
             # Add date fields to metadata based on document type
-            date_field_mapping = {
-                'assignment': ('due_at', 'due_timestamp'),
-                'announcement': ('posted_at', 'posted_timestamp'),
-                'quiz': ('due_at', 'due_timestamp'),
-                'event': ('start_at', 'start_timestamp'),
-                'file': ('updated_at', 'updated_timestamp')
-            }
-            
             doc_type = item.get('type')
-            if doc_type in date_field_mapping:
-                source_field, target_field = date_field_mapping[doc_type]
+            if doc_type in DATE_FIELD_MAPPING:
+                source_field, target_field = DATE_FIELD_MAPPING[doc_type]
                 if item.get(source_field):
                     try:
                         date_obj = datetime.fromisoformat(item[source_field].replace('Z', '+00:00'))
@@ -279,55 +446,49 @@ class VectorDatabase:
         if ids_to_add:
             print(f"Processing {len(ids_to_add)} documents for collection")
             
-            # Generate embeddings first
-            embeddings = self.embedding_function(texts_to_add)
-            print(f"Generated embeddings with shape: {np.array(embeddings).shape}")
-
-            # Use upsert instead of add to avoid duplicate ID errors
-            try:
-                await asyncio.to_thread(
-                    self.collection.upsert,  # Changed from add to upsert
-                    ids=ids_to_add,
-                    embeddings=embeddings,
-                    documents=texts_to_add,
-                    metadatas=metadatas_to_add
-                )
-                
-                print(f"Successfully processed {len(ids_to_add)} documents in collection")
-                return True
-            except Exception as e:
-                print(f"Error during upsert operation: {e}")
-                
-                # Try processing in smaller batches if the entire batch fails
-                batch_size = 50
-                success = False
-                
+            # Write rows in id order so neighbouring ids land together in Chroma's id index
+            rows = sorted(zip(ids_to_add, texts_to_add, metadatas_to_add), key=lambda row: row[0])
+            ids_to_add, texts_to_add, metadatas_to_add = (list(column) for column in zip(*rows))
+            
+            # Embed and upsert in fixed-size batches so each Chroma write stays small
+            # and documents already written are kept if a later batch fails.
+            # Use upsert instead of add to avoid duplicate ID errors.
+            # The preprocessed text is only needed for embedding; search reads
+            # document content from the local document_map, so it isn't stored
+            # in ChromaDB alongside every row.
+            batch_size = UPSERT_BATCH_SIZE
+            for i in range(0, len(ids_to_add), batch_size):
+                batch_ids = ids_to_add[i:i+batch_size]
+                batch_metadatas = metadatas_to_add[i:i+batch_size]
                 try:
-                    print(f"Retrying with smaller batches of {batch_size} documents")
-                    for i in range(0, len(ids_to_add), batch_size):
-                        batch_ids = ids_to_add[i:i+batch_size]
-                        batch_texts = texts_to_add[i:i+batch_size]
-                        batch_metadatas = metadatas_to_add[i:i+batch_size]
-                        batch_embeddings = embeddings[i:i+batch_size]
-                        
-                        await asyncio.to_thread(
-                            self.collection.upsert,
-                            ids=batch_ids,
-                            embeddings=batch_embeddings,
-                            documents=batch_texts,
-                            metadatas=batch_metadatas
-                        )
-                        print(f"Successfully processed batch {i//batch_size + 1} ({len(batch_ids)} documents)")
-                        success = True
-                    
-                    return success
+                    batch_embeddings = self.embedding_function(texts_to_add[i:i+batch_size])
+                    await asyncio.to_thread(
+                        self.collection.upsert,
+                        ids=batch_ids,
+                        embeddings=batch_embeddings,
+                        metadatas=batch_metadatas
+                    )
+                    print(f"Successfully processed batch {i//batch_size + 1} ({len(batch_ids)} documents)")
                 except Exception as batch_error:
                     print(f"Error during batch upsert: {batch_error}")
                     return False
+                finally:
+                    self._bump_collection_epoch()
+            
+            print(f"Successfully processed {len(ids_to_add)} documents in collection")
+            return True
         else:
             print("No documents to process")
             return False
 
+    async def _extract_file_content(self, doc, session):
+        """Download and parse a file document's content in place."""
+        try:
+            doc['content'] = await parse_file_content(doc.get('url'), session)
+            print(f"Extracted content for file {doc.get('display_name', '')}")
+        except Exception as e:
+            print(f"Failed to extract content for file {doc.get('display_name', '')}: {e}")
+
     def _include_related_documents(self, search_results, search_parameters, minimum_score):
         """
         Include related documents in search results.
@@ -339,36 +500,36 @@ class VectorDatabase:
         """
         related_docs = self._get_related_documents([r['document'].get('id') for r in search_results])
         
-        # Map item types to internal types for filtering
-        type_mapping = {
-            "assignment": "assignment",
-            "file": "file",
-            "quiz": "quiz",
-            "announcement": "announcement",
-            "event": "event"
-        }
+        # Resolve the filters once instead of once per related document
+        course_filter = None
+        if "course_id" in search_parameters and search_parameters["course_id"] != "all_courses":
+            course_filter = str(search_parameters["course_id"])
+        
+        allowed_types = None
+        if "item_types" in search_parameters and search_parameters["item_types"]:
+            # Map item types to internal types for filtering
+            allowed_types = {RELATED_TYPE_MAPPING[t] for t in search_parameters["item_types"] if t in RELATED_TYPE_MAPPING}
+        
+        result_ids = {r['document'].get('id') for r in search_results}
         
         for doc in related_docs:
             # Apply same filters to related documents
             # Check course filter
-            if "course_id" in search_parameters and search_parameters["course_id"] != "all_courses":
-                doc_course_id = str(doc.get('course_id', ''))
-                if doc_course_id != str(search_parameters["course_id"]):
-                    continue
+            if course_filter is not None and str(doc.get('course_id', '')) != course_filter:
+                continue
             
             # Check item type filter
-            if "item_types" in search_parameters and search_parameters["item_types"]:
-                doc_type = doc.get('type', '')
-                if doc_type not in [type_mapping.get(t) for t in search_parameters["item_types"] if t in type_mapping]:
-                    continue
+            if allowed_types is not None and doc.get('type', '') not in allowed_types:
+                continue
             
             # Only add if not already in results
-            if not any(r['document'].get('id') == doc.get('id') for r in search_results):
+            if doc.get('id') not in result_ids:
                 search_results.append({
-                    'document': doc,
+                    'document': dict(doc),
                     'similarity': minimum_score,
                     'is_related': True
                 })
+                result_ids.add(doc.get('id'))
 
     def _determine_top_k(self, search_parameters):
         """
@@ -381,12 +542,6 @@ class VectorDatabase:
         Returns:
             Integer representing the top_k value to use for search
         """
-        # Default mapping of generality levels to top_k values
-        generality_mapping = { 
-            "LOW": 5,         # Focused search
-            "MEDIUM": 10,     # Balanced approach (default)
-            "HIGH": 20        # Comprehensive search
-        }
         # Extract generality from parameters, default to MEDIUM
         generality = search_parameters.get("generality", "MEDIUM")
         
@@ -395,10 +550,10 @@ class VectorDatabase:
             top_k = search_parameters.get("specific_amount")
         else:
             # Handle string generality values
-            if generality in generality_mapping:
-                top_k = generality_mapping[generality]
+            if generality in GENERALITY_TOP_K:
+                top_k = GENERALITY_TOP_K[generality]
             else:
-                top_k = generality_mapping["MEDIUM"]
+                top_k = GENERALITY_TOP_K["MEDIUM"]
 
         course_id = search_parameters.get("course_id", "all_courses")
         if course_id == "all_courses" and not isinstance(top_k, int):
@@ -412,7 +567,101 @@ class VectorDatabase:
         # Ensure reasonable limits
         return max(1, min(top_k, 30))
     
-    async def _execute_chromadb_query(self, query_text, query_where, top_k):
+    def _bump_collection_epoch(self):
+        """Invalidate cached query results for this collection after a write."""
+        with _query_cache_lock:
+            _collection_epochs[self.collection_name] = _collection_epochs.get(self.collection_name, 0) + 1
+
+    async def _execute_chromadb_query(self, query_text, query_where, top_k, cache_scope=None):
+        """
+        Execute a query against ChromaDB, reusing a recent identical or near-identical query's results.
+        
+        Args:
+            query_text: Normalized query text
+            query_where: Where clause for filtering
+            top_k: Number of results to return
+            cache_scope: Hashable description of the filters, used to scope cached results
+                         (defaults to the where clause itself)
+            
+        Returns:
+            Query results or empty dict on error
+        """
+        if cache_scope is None:
+            cache_scope = json.dumps(query_where, sort_keys=True, default=str)
+        with _query_cache_lock:
+            scope = (
+                self.collection_name,
+                _collection_epochs.get(self.collection_name, 0),
+                cache_scope,
+                top_k
+            )
+            cache_key = scope + (query_text,)
+            cached = _query_cache.get(cache_key)
+            if cached and time.monotonic() - cached[0] < QUERY_CACHE_TTL_SECONDS:
+                _query_cache.move_to_end(cache_key)
+                print("Using cached ChromaDB query results")
+                return cached[1]
+
+        # Embed the query once; the embedding serves both the approximate lookup and the query itself
+        query_embedding = await self._embed_query(query_text)
+        # A failed embedding request yields an all-zero placeholder; its matches are meaningless,
+        # so nothing is queried or cached and the next search tries again
+        if query_embedding is not None and not np.any(query_embedding):
+            print("Query embedding failed; skipping ChromaDB query")
+            return {}
+
+        if APPROX_QUERY_CACHE_ENABLED and query_embedding is not None:
+            results = _approx_query_cache.lookup(scope, query_embedding)
+            if results:
+                print("Using cached ChromaDB query results for a similar query")
+                return results
+
+        results = await self._query_chromadb(query_text, query_where, top_k, query_embedding)
+
+        # Failed queries return {} and are not cached
+        if results:
+            with _query_cache_lock:
+                _query_cache[cache_key] = (time.monotonic(), results)
+                _query_cache.move_to_end(cache_key)
+                while len(_query_cache) > QUERY_CACHE_MAX_ENTRIES:
+                    _query_cache.popitem(last=False)
+            if APPROX_QUERY_CACHE_ENABLED and query_embedding is not None:
+                _approx_query_cache.insert(scope, query_embedding, results)
+        return results
+
+    async def _embed_query(self, query_text):
+        """Embed query text. Returns None on failure."""
+        return (await self._embed_queries([query_text]))[0]
+
+    async def _embed_queries(self, query_texts):
+        """
+        Embed several query texts with one embedding request. Recent queries are served from
+        the embedding function's own cache. Returns one embedding per text (None if embedding failed).
+        """
+        unique_texts = list(dict.fromkeys(query_texts))
+        try:
+            new_embeddings = await asyncio.to_thread(self.embedding_function, unique_texts)
+        except Exception as e:
+            print(f"Error embedding query text: {e}")
+            return [None] * len(query_texts)
+        embeddings = dict(zip(unique_texts, new_embeddings))
+        return [embeddings[query_text] for query_text in query_texts]
+
+    async def prefetch_query_embeddings(self, search_parameters_list):
+        """
+        Embed the queries of several upcoming searches in one request.
+        The searches then find their query embeddings in the embedding function's cache instead
+        of embedding one at a time. The local model has no cache and embeds in-process, so it is skipped.
+        """
+        if not isinstance(self.embedding_function, HFEmbeddingFunction):
+            return
+        query_texts = []
+        for search_parameters in search_parameters_list:
+            _, normalized_query = await build_chromadb_query(search_parameters)
+            query_texts.append(format_search_query(normalized_query))
+        await self._embed_queries(query_texts)
+
+    async def _query_chromadb(self, query_text, query_where, top_k, query_embedding=None):
         """
         Execute a query against ChromaDB.
         
@@ -420,10 +669,16 @@ class VectorDatabase:
             query_text: Normalized query text
             query_where: Where clause for filtering
             top_k: Number of results to return
+            query_embedding: Precomputed embedding of query_text, if available
             
         Returns:
             Query results or empty dict on error
         """
+        # Only ids and distances are used; document content comes from the local document_map
+        if query_embedding is not None:
+            query_input = {"query_embeddings": [query_embedding]}
+        else:
+            query_input = {"query_texts": [query_text]}
         try:
             print(f"\n=== CHROMADB QUERY DEBUG ===")
             print(f"Query text: {query_text}")
@@ -431,10 +686,10 @@ class VectorDatabase:
             # Use asyncio to prevent blocking the event loop during the ChromaDB query
             results = await asyncio.to_thread(
                 self.collection.query,
-                query_texts=[query_text],
+                **query_input,
                 n_results=top_k,
                 where=query_where,
-                include=["distances", "documents", "metadatas"]
+                include=["distances"]
             )
             return results
         except Exception as e:
@@ -448,10 +703,10 @@ class VectorDatabase:
                     simplified_where = {"course_id": query_where["course_id"]}
                     results = await asyncio.to_thread(
                         self.collection.query,
-                        query_texts=[query_text],
+                        **query_input,
                         n_results=top_k,
                         where=simplified_where,
-                        include=["distances", "documents", "metadatas"]
+                        include=["distances"]
                     )
                     return results
                 except Exception as e2:
@@ -462,9 +717,9 @@ class VectorDatabase:
                 print("Trying query with no filters...")
                 results = await asyncio.to_thread(
                     self.collection.query,
-                    query_texts=[query_text],
+                    **query_input,
                     n_results=top_k,
-                    include=["distances", "documents", "metadatas"]
+                    include=["distances"]
                 )
                 return results
             except Exception as e3:
@@ -493,11 +748,10 @@ class VectorDatabase:
         print(f"Query where: {query_where}")
         print("--------------------------------\n\n")
 
-        task_description = "Given a student query about course materials, retrieve relevant Canvas resources that provide comprehensive information to answer the query."
-        formatted_query = f"Instruct: {task_description}\nQuery: {normalized_query}"
+        formatted_query = format_search_query(normalized_query)
 
         # Execute ChromaDB query
-        results = await self._execute_chromadb_query(formatted_query, query_where, top_k)
+        results = await self._execute_chromadb_query(formatted_query, query_where, top_k, query_cache_scope(search_parameters))
 
         # Initialize lists (handle empty results gracefully)
         doc_ids = results.get('ids', [[]])[0] if results.get('ids') else []
@@ -518,8 +772,10 @@ class VectorDatabase:
                 #print(f"Skipping doc {doc_id} (semantic) - low similarity: {similarity}")
                 continue
 
+            # Results get file content and display fields added, so they hold copies;
+            # document_map is shared by every search on this (cached) instance
             search_results.append({
-                'document': doc,
+                'document': dict(doc),
                 'similarity': similarity,
                 'type': 'semantic'  # Indicate source
             })
@@ -547,7 +803,7 @@ class VectorDatabase:
             for match in keyword_matches:
                 keyword_similarity = 0.93
                 search_results.append({
-                    'document': match['document'],
+                    'document': dict(match['document']),
                     'similarity': keyword_similarity,
                     'type': match['document'].get('type')
                 })
@@ -557,19 +813,20 @@ class VectorDatabase:
         search_results.sort(key=lambda x: x['similarity'], reverse=True)
 
         # --- Process each document (including file content extraction) ---
+        file_docs = {}
         for result in search_results:
             doc = result['document']
             doc_id = doc['id']
 
             print(f"Processing document: {doc_id}, Type: {result.get('type')}")
 
-            # Check if it's a file and extract content
+            # Collect files so their content can be extracted concurrently
             if doc.get('type') == 'file':
-                try:
-                    doc['content'] = await parse_file_content(doc.get('url'))
-                    print(f"Extracted content for file {doc.get('display_name', '')}")
-                except Exception as e:
-                    print(f"Failed to extract content for file {doc.get('display_name', '')}: {e}")
+                file_docs[doc_id] = doc
+
+        if file_docs:
+            async with aiohttp.ClientSession() as session:
+                await asyncio.gather(*(self._extract_file_content(doc, session) for doc in file_docs.values()))
 
         # Include related documents if requested
         if include_related and search_results:
@@ -587,6 +844,14 @@ class VectorDatabase:
 
         return combined_results[:top_k]
     
+    def _read_json_data(self):
+        """Parse the JSON file, reusing the copy parsed in __init__ if the file hasn't changed since."""
+        file_stat = os.stat(self.json_file_path)
+        parsed, self._parsed_json = self._parsed_json, None
+        if parsed is not None and parsed[0] == (file_stat.st_mtime_ns, file_stat.st_size):
+            return parsed[1]
+        return load_json_file(self.json_file_path)
+
     async def load_local_data_from_json(self):
         """Loads data from the JSON file into memory (document_map, course_map, etc.)
            without performing any database writes or synchronization. 
@@ -618,9 +883,7 @@ class VectorDatabase:
             return # Exit early if file not found
 
         try:
-            # --- Use the Path object to open the file ---
-            with open(path_obj, 'r') as f:
-                data = json.load(f)
+            data = self._read_json_data()
             # Populate self.documents, self.document_map, etc. using the existing internal method
             await self._update_local_data_structures(data) 
             print(f"Successfully loaded local data structures ({len(self.document_map)} docs) from JSON.")
@@ -694,11 +957,7 @@ class VectorDatabase:
                 print(f"Warning: Skipping invalid syllabus for course. parse_html_content failed for course {course_id}")
 
         # Process Document Types
-        document_types_keys = {
-            'files': 'file', 'announcements': 'announcement', 'assignments': 'assignment',
-            'quizzes': 'quiz', 'calendar_events': 'event'
-        }
-        for collection_key, doc_type in document_types_keys.items():
+        for collection_key, doc_type in DOCUMENT_TYPE_KEYS.items():
             for item in data.get(collection_key, []):
                 if isinstance(item, dict) and 'id' in item:
                     item_id_str = str(item['id'])
@@ -720,37 +979,53 @@ class VectorDatabase:
         # Operates on self.documents
         if not self.documents: return
 
+        # Index documents by (course, module) and (course, type) in a single pass
+        # so each document reads its bucket instead of rescanning every document.
+        module_index = {}
+        type_index = {}
+        for doc in self.documents:
+            if not isinstance(doc, dict): continue
+            course_id = doc.get('course_id')
+            if not course_id: continue
+            if doc.get('module_id'):
+                module_index.setdefault((course_id, doc['module_id']), []).append(doc.get('id'))
+            if doc.get('type'):
+                type_index.setdefault((course_id, doc['type']), []).append(doc.get('id'))
+
         for doc in self.documents:
             if not isinstance(doc, dict): continue 
             doc_id = doc.get('id')
             if not doc_id: continue
                 
-            doc['related_docs'] = [] 
+            related_ids = []
             module_id = doc.get('module_id')
             course_id = doc.get('course_id') # Assumed string from _update_local_data
             
             if module_id and course_id:
-                for other_doc in self.documents:
-                    if isinstance(other_doc, dict) and \
-                       other_doc.get('module_id') == module_id and \
-                       other_doc.get('course_id') == course_id and \
-                       other_doc.get('id') != doc_id:
-                        doc['related_docs'].append(other_doc.get('id'))
+                related_ids.extend(
+                    other_id for other_id in module_index.get((course_id, module_id), [])
+                    if other_id != doc_id
+                )
             
             doc_type = doc.get('type')
             if doc_type and course_id:
-                for other_doc in self.documents:
-                     if isinstance(other_doc, dict) and \
-                        other_doc.get('type') == doc_type and \
-                        other_doc.get('course_id') == course_id and \
-                        other_doc.get('id') != doc_id and \
-                        other_doc.get('id') not in doc.get('related_docs', []):
-                         doc['related_docs'].append(other_doc.get('id'))
-
-    async def _synchronize_chromadb_with_local_data(self):
-        """Removes documents from ChromaDB that are no longer in local data."""
+                seen_ids = set(related_ids)
+                for other_id in type_index.get((course_id, doc_type), []):
+                    if other_id != doc_id and other_id not in seen_ids:
+                        related_ids.append(other_id)
+                        seen_ids.add(other_id)
+
+            doc['related_docs'] = related_ids
+
+    async def _synchronize_chromadb_with_local_data(self, chromadb_ids: Optional[set] = None):
+        """Removes documents from ChromaDB that are no longer in local data.
+        
+        Args:
+            chromadb_ids: IDs already fetched from the collection; fetched if not given
+        """
         try:
-            chromadb_ids = await self._get_all_collection_ids()
+            if chromadb_ids is None:
+                chromadb_ids = await self._get_all_collection_ids()
             if not chromadb_ids: return 0
                  
             local_ids = set(self.document_map.keys())
@@ -763,6 +1038,7 @@ class VectorDatabase:
                 print(f"Found {len(ids_to_remove)} stale documents in ChromaDB. Removing...")
                 try:
                     await asyncio.to_thread(self.collection.delete, ids=ids_to_remove)
+                    self._bump_collection_epoch()
                     print(f"Successfully removed {len(ids_to_remove)} stale documents.")
                     return len(ids_to_remove)
                 except Exception as delete_error:
@@ -783,6 +1059,7 @@ class VectorDatabase:
             print(f"Successfully deleted collection: {collection_name_to_clear}")
         except Exception as e:
             print(f"Warning: Could not delete collection '{collection_name_to_clear}' (might not exist): {e}")
+        self._bump_collection_epoch()
 
         try:
             self.collection = await asyncio.to_thread(
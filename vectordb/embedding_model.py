@@ -6,18 +6,70 @@ It supports various embedding models including the multilingual-e5-large-instruc
 
 The main class HFEmbeddingFunction implements the ChromaDB embedding function interface,
 ensuring proper formatting of input texts for specific models like E5 (which requires a "passage:" prefix).
+
+Setting EMBEDDING_BACKEND=local runs the same model in-process with sentence-transformers
+(LocalEmbeddingFunction) instead of calling the Hugging Face Inference API.
 """
 
+import hashlib
 import logging
+import os
 import numpy as np
 import aiohttp
 import requests  # Keep for backward compatibility
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, Union
 
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
 # Configure logging
 logger = logging.getLogger("canvas_vector_db.embedding")
 
+# Estimate for ~512 tokens; longer texts are truncated before embedding
+MAX_INPUT_CHARS = 2000
+
+# Number of recent text embeddings kept by each HFEmbeddingFunction
+EMBEDDING_CACHE_SIZE = 1024
+
+# Texts sent per inference API request, and how many requests may be in flight at once
+EMBEDDING_BATCH_SIZE = 32
+EMBEDDING_MAX_CONCURRENT_REQUESTS = 4
+_embedding_request_pool = ThreadPoolExecutor(max_workers=EMBEDDING_MAX_CONCURRENT_REQUESTS)
+
+# Loaded sentence-transformers models, shared by all local embedding functions
+_local_models = {}
+_local_models_lock = threading.Lock()
+
+# Per-thread HTTP sessions shared by all embedding functions, so calls reuse
+# open keep-alive connections to the inference API instead of reconnecting
+_thread_local = threading.local()
+
+def _get_http_session() -> requests.Session:
+    """Return the calling thread's requests session, creating it on first use."""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        # Retry rate limits and transient server errors with backoff on the pooled connection;
+        # embedding requests are safe to repeat, so POST is retried too
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset(["POST"]),
+            raise_on_status=False
+        )
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=EMBEDDING_MAX_CONCURRENT_REQUESTS, max_retries=retry))
+        _thread_local.session = session
+    return session
+
 class HFEmbeddingFunction:
     """
     Embedding function class for Hugging Face models that implements
@@ -45,6 +97,11 @@ class HFEmbeddingFunction:
             self.embedding_dims = 384
         else:
             self.embedding_dims = 1024  # default to large model dimensions
+        
+        # LRU cache of embeddings keyed by the SHA-256 of the (truncated) input text,
+        # so repeated queries and unchanged documents skip the API round-trip
+        self._embedding_cache = OrderedDict()
+        self._embedding_cache_lock = threading.Lock()
             
         logger.info(f"Initialized HF embedding function with model: {model_id}")
         
@@ -57,57 +114,68 @@ class HFEmbeddingFunction:
             input: List of text strings to embed
             
         Returns:
-            Numpy array of embeddings
+            List of embeddings
         """
-        # For ChromaDB compatibility, provide a synchronous interface
-        # but using requests instead of aiohttp
-        
         # Handle empty input case
         if not input:
             return []
         
-        # Constants
-        max_chars = 2000  # Estimate for ~512 tokens
-        batch_size = 32   # Process in smaller batches
+        keys = [hashlib.sha256(text[:MAX_INPUT_CHARS].encode("utf-8")).digest() for text in input]
+        embeddings = [None] * len(input)
+        missing = []
         
-        result_embeddings = []
+        with self._embedding_cache_lock:
+            for i, key in enumerate(keys):
+                cached = self._embedding_cache.get(key)
+                if cached is not None:
+                    self._embedding_cache.move_to_end(key)
+                    embeddings[i] = cached
+                else:
+                    missing.append(i)
         
-        # Process in batches
-        for i in range(0, len(input), batch_size):
-            batch = input[i:i+batch_size]
-            
-            # Truncate long texts and add prefix
-            formatted_texts = [f"passage: {text[:max_chars]}" for text in batch]
+        if len(missing) < len(input):
+            logger.info(f"Embedding cache hits: {len(input) - len(missing)}/{len(input)}")
+        if not missing:
+            return embeddings
+        
+        new_embeddings = self._embed_uncached([input[i] for i in missing])
+        
+        with self._embedding_cache_lock:
+            for i, embedding in zip(missing, new_embeddings):
+                embeddings[i] = embedding
+                # Placeholder (all-zero) embeddings from failed requests are not cached
+                if any(embedding):
+                    self._embedding_cache[keys[i]] = embedding
+                    self._embedding_cache.move_to_end(keys[i])
+            while len(self._embedding_cache) > EMBEDDING_CACHE_SIZE:
+                self._embedding_cache.popitem(last=False)
+        
+        return embeddings
+    
+    def _embed_uncached(self, input):
+        """
+        Generate embeddings for the input texts through the Hugging Face API.
+        
+        Args:
+            input: Non-empty list of text strings to embed
             
-            try:
-                response = requests.post(
-                    self.api_url,
-                    headers=self.headers,
-                    json={"inputs": formatted_texts, "options": {"wait_for_model": True}}
-                )
-                
-                if response.status_code != 200:
-                    logger.error(f"API request failed with status code {response.status_code}: {response.text}")
-                    # Add placeholders for this batch
-                    for _ in batch:
-                        result_embeddings.append(np.zeros(self.embedding_dims, dtype=np.float32))
-                    continue
-                
-                batch_embeddings = response.json()
-                
-                if isinstance(batch_embeddings, list):
-                    result_embeddings.extend(batch_embeddings)
-                else:
-                    # Handle error by adding placeholder embeddings
-                    logger.error(f"Unexpected API response format: {batch_embeddings}")
-                    for _ in batch:
-                        result_embeddings.append(np.zeros(self.embedding_dims))
-                
-            except Exception as e:
-                logger.error(f"Error calling Hugging Face API for batch {i//batch_size}: {e}")
-                # Add placeholder embeddings for the entire batch
-                for _ in batch:
-                    result_embeddings.append(np.zeros(self.embedding_dims, dtype=np.float32))
+        Returns:
+            List of embeddings, one per input (all zeros where a request failed)
+        """
+        # For ChromaDB compatibility, provide a synchronous interface
+        # but using requests instead of aiohttp
+        batch_size = EMBEDDING_BATCH_SIZE
+        batches = [input[i:i+batch_size] for i in range(0, len(input), batch_size)]
+        
+        # Send the batches concurrently; each worker thread reuses its own keep-alive session
+        if len(batches) > 1:
+            batch_results = _embedding_request_pool.map(self._embed_batch, batches, range(len(batches)))
+        else:
+            batch_results = [self._embed_batch(batches[0], 0)]
+        
+        result_embeddings = []
+        for batch_embeddings in batch_results:
+            result_embeddings.extend(batch_embeddings)
         
         # Important: We must ensure we have exactly one embedding per input document
         if len(result_embeddings) != len(input):
@@ -128,9 +196,48 @@ class HFEmbeddingFunction:
         # Final check to ensure non-empty output
         if final_embeddings.size == 0:
             logger.error("Generated empty embeddings array! Returning placeholder.")
-            return np.zeros((len(input), self.embedding_dims), dtype=np.float32)
+            return np.zeros((len(input), self.embedding_dims), dtype=np.float32).tolist()
         
         return final_embeddings.tolist()
+
+    def _embed_batch(self, batch, batch_index):
+        """
+        Embed one batch of texts with a single inference API request.
+        
+        Args:
+            batch: List of text strings (at most EMBEDDING_BATCH_SIZE)
+            batch_index: Position of the batch in the input, for logging
+            
+        Returns:
+            List of embeddings for the batch (all zeros if the request failed)
+        """
+        # Truncate long texts and add prefix
+        formatted_texts = [f"passage: {text[:MAX_INPUT_CHARS]}" for text in batch]
+        
+        try:
+            response = _get_http_session().post(
+                self.api_url,
+                headers=self.headers,
+                json={"inputs": formatted_texts, "options": {"wait_for_model": True}}
+            )
+            
+            if response.status_code != 200:
+                logger.error(f"API request failed with status code {response.status_code}: {response.text}")
+                # Add placeholders for this batch
+                return [np.zeros(self.embedding_dims, dtype=np.float32) for _ in batch]
+            
+            batch_embeddings = response.json()
+            
+            if isinstance(batch_embeddings, list):
+                return batch_embeddings
+            # Handle error by adding placeholder embeddings
+            logger.error(f"Unexpected API response format: {batch_embeddings}")
+            return [np.zeros(self.embedding_dims) for _ in batch]
+            
+        except Exception as e:
+            logger.error(f"Error calling Hugging Face API for batch {batch_index}: {e}")
+            # Add placeholder embeddings for the entire batch
+            return [np.zeros(self.embedding_dims, dtype=np.float32) for _ in batch]
     
     # For backward compatibility: synchronous method that calls the async one
     def generate_embeddings_sync(self, input: List[str]) -> np.ndarray:
@@ -145,6 +252,72 @@ class HFEmbeddingFunction:
         """
         return asyncio.run(self.generate_embeddings(input))
 
+def _get_local_model(model_id: str):
+    """Load a sentence-transformers model once per process and reuse it."""
+    with _local_models_lock:
+        model = _local_models.get(model_id)
+        if model is None:
+            logger.info(f"Loading local embedding model: {model_id}")
+            model = SentenceTransformer(model_id)
+            _local_models[model_id] = model
+        return model
+
+class LocalEmbeddingFunction:
+    """
+    Embedding function that runs the embedding model locally with sentence-transformers.
+    It uses the same model and input formatting as HFEmbeddingFunction, so its vectors
+    are interchangeable with collections built through the Hugging Face API.
+    """
+    
+    def __init__(self, model_id="intfloat/multilingual-e5-large-instruct"):
+        """
+        Initialize the embedding function, loading the model on first use in this process.
+        
+        Args:
+            model_id: Model ID to use for embeddings (default: "intfloat/multilingual-e5-large-instruct")
+        """
+        if SentenceTransformer is None:
+            raise ImportError("sentence-transformers is required for the local embedding backend.")
+        self.model_id = model_id
+        self.model = _get_local_model(model_id)
+        logger.info(f"Initialized local embedding function with model: {model_id}")
+    
+    def __call__(self, input):
+        """
+        Generate embeddings for the input texts.
+        This signature matches what ChromaDB expects.
+        
+        Args:
+            input: List of text strings to embed
+            
+        Returns:
+            List of embeddings
+        """
+        if not input:
+            return []
+        
+        # Truncate long texts and add prefix, matching HFEmbeddingFunction
+        formatted_texts = [f"passage: {text[:MAX_INPUT_CHARS]}" for text in input]
+        embeddings = self.model.encode(formatted_texts, batch_size=32, convert_to_numpy=True)
+        return embeddings.astype(np.float32).tolist()
+
+def create_embedding_function(api_token=None, model_id="intfloat/multilingual-e5-large-instruct"):
+    """
+    Create the embedding function selected by the EMBEDDING_BACKEND environment variable.
+    
+    Args:
+        api_token: Hugging Face API token (required unless EMBEDDING_BACKEND=local)
+        model_id: Model ID to use for embeddings
+        
+    Returns:
+        LocalEmbeddingFunction if EMBEDDING_BACKEND=local, otherwise HFEmbeddingFunction
+    """
+    if os.getenv("EMBEDDING_BACKEND", "hf").lower() == "local":
+        return LocalEmbeddingFunction(model_id)
+    if not api_token:
+        raise ValueError("Hugging Face API token is required. Provide it as a parameter or set HUGGINGFACE_API_TOKEN environment variable.")
+    return HFEmbeddingFunction(api_token, model_id)
+
 async def create_async_hf_embedding_function(api_token, model_id="intfloat/multilingual-e5-large-instruct"):
     """
     Create and return an async Hugging Face embedding function.
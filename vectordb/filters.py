@@ -4,6 +4,39 @@ from typing import List, Dict, Any
 import re
 from vectordb.text_processing import normalize_text
 
+# Resolved once at import; tzlocal reads /etc/localtime and the environment on every call
+LOCAL_TIMEZONE = tzlocal.get_localzone()
+
+# Maps requested item types to the internal document types used in ChromaDB metadata
+ITEM_TYPE_MAPPING = {
+    "assignment": "assignment",
+    "file": "file",
+    "quiz": "quiz",
+    "announcement": "announcement",
+    "event": "event",
+    "syllabus": "syllabus"
+}
+
+# Field holding each document type's name, used for keyword matching
+DOCUMENT_NAME_FIELDS = {
+    'file': 'display_name',
+    'assignment': 'name',
+    'announcement': 'title',
+    'quiz': 'title',
+    'event': 'title'
+}
+
+# Patterns used to normalize document names and keywords for keyword matching
+FILE_EXTENSION_PATTERN = re.compile(r'\.\w+$')
+NAME_SEPARATOR_PATTERN = re.compile(r'[_\-\s.]')
+
+def _keyword_forms(text: str):
+        """Return (lowercase, without extension, without separators) forms of a name or keyword."""
+        text_lower = text.lower()
+        text_no_ext = FILE_EXTENSION_PATTERN.sub('', text_lower)
+        text_clean = NAME_SEPARATOR_PATTERN.sub('', text_no_ext)
+        return text_lower, text_no_ext, text_clean
+
 def build_time_range_filter(search_parameters: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
         Build time range filter conditions for ChromaDB query.
@@ -20,8 +53,7 @@ def build_time_range_filter(search_parameters: Dict[str, Any]) -> List[Dict[str,
         time_range = search_parameters["time_range"]
 
         # Get current time in local timezone, then convert to UTC for timestamp comparison
-        local_timezone = tzlocal.get_localzone()
-        current_time = datetime.now(local_timezone)
+        current_time = datetime.now(LOCAL_TIMEZONE)
         current_timestamp = int(current_time.timestamp())
         
         # List of all possible timestamp fields across different document types
@@ -90,7 +122,6 @@ def build_specific_dates_filter(search_parameters: Dict[str, Any]) -> List[Dict[
         if not search_parameters or "specific_dates" not in search_parameters or not search_parameters["specific_dates"]:
             return []
         
-        local_timezone = tzlocal.get_localzone()
         specific_dates = []
         
         for date_str in search_parameters["specific_dates"]:
@@ -99,7 +130,7 @@ def build_specific_dates_filter(search_parameters: Dict[str, Any]) -> List[Dict[
                 naive_date = datetime.strptime(date_str, "%Y-%m-%d")
                 
                 # Make it timezone-aware by replacing the tzinfo
-                specific_date = naive_date.replace(tzinfo=local_timezone)
+                specific_date = naive_date.replace(tzinfo=LOCAL_TIMEZONE)
                 
                 specific_dates.append(specific_date)
             except ValueError:
@@ -187,17 +218,8 @@ def build_course_and_type_filter(search_parameters: Dict[str, Any]) -> List[Dict
             item_types = search_parameters["item_types"]
             if item_types and isinstance(item_types, list) and len(item_types) > 0:
                 # Map item types to our internal types
-                type_mapping = {
-                    "assignment": "assignment",
-                    "file": "file",
-                    "quiz": "quiz",
-                    "announcement": "announcement",
-                    "event": "event",
-                    "syllabus": "syllabus"
-                }
-                
-                normalized_types = [type_mapping[item_type] for item_type in item_types 
-                                    if item_type in type_mapping]
+                normalized_types = [ITEM_TYPE_MAPPING[item_type] for item_type in item_types 
+                                    if item_type in ITEM_TYPE_MAPPING]
                 if normalized_types:
                     conditions.append({"type": {"$in": normalized_types}}) # $in: in
                     # filter: item.type in item_types
@@ -218,13 +240,9 @@ def handle_keywords(document_map, keywords, doc_ids, courses, item_types):
             courses = [courses]
 
         keyword_matches = []
-        names = {
-            'file': 'display_name',
-            'assignment': 'name',
-            'announcement': 'title',
-            'quiz': 'title',
-            'event': 'title'
-        }
+        doc_ids = set(doc_ids)
+        # Normalize each keyword once rather than once per document
+        keyword_forms = [_keyword_forms(keyword) for keyword in keywords]
 
         for doc_id, doc in document_map.items():
             if doc_id in doc_ids:  # Skip documents already found by semantic search
@@ -242,30 +260,21 @@ def handle_keywords(document_map, keywords, doc_ids, courses, item_types):
                 #print(f"Skipping doc {doc_id} (course filter)")
                 continue
 
-            doc_name_field = names.get(doc_type)  # Use .get() to handle unknown types
+            doc_name_field = DOCUMENT_NAME_FIELDS.get(doc_type)  # Use .get() to handle unknown types
             if not doc_name_field:
                 #print(f"Warning: Unknown document type '{doc_type}' for doc {doc_id}")
                 continue  # Skip documents with unknown types
 
-            doc_name = doc.get(doc_name_field, '').lower()
-
-            for keyword in keywords:
-                keyword_lower = keyword.lower()
+            # Lowercase, extension-free and separator-free forms of the document name
+            doc_name, doc_name_no_ext, doc_name_clean = _keyword_forms(doc.get(doc_name_field, ''))
 
+            for keyword_lower, keyword_no_ext, keyword_clean in keyword_forms:
                 # Direct substring match
                 if keyword_lower in doc_name:
                     keyword_matches.append({'document': doc})
                     print(f"Added doc {doc_id} to keyword matches (direct match)")
                     break  # Move to the next document after a match
 
-                # Removing file extensions
-                doc_name_no_ext = re.sub(r'\.\w+$', '', doc_name)
-                keyword_no_ext = re.sub(r'\.\w+$', '', keyword_lower)
-
-                # Removing special characters
-                doc_name_clean = re.sub(r'[_\-\s.]', '', doc_name_no_ext)
-                keyword_clean = re.sub(r'[_\-\s.]', '', keyword_no_ext)
-
                 # Check if any normalized version matches
                 if (keyword_no_ext in doc_name_no_ext or doc_name_no_ext in keyword_no_ext or
                     keyword_clean in doc_name_clean or doc_name_clean in keyword_clean):
@@ -1,5 +1,8 @@
-import tzlocal
 from datetime import datetime
+from vectordb.filters import DOCUMENT_NAME_FIELDS, LOCAL_TIMEZONE
+
+# Date fields checked (in order) when adding local and relative times to results
+AUGMENT_DATE_FIELDS = ('due_at', 'posted_at', 'start_at', 'updated_at')
 
 def post_process_results(search_results, normalized_query):
         """
@@ -12,27 +15,21 @@ def post_process_results(search_results, normalized_query):
         Returns:
             Sorted list of search results
         """
-        query_terms = normalized_query.lower().split()
+        query_lower = normalized_query.lower()
+        query_terms = query_lower.split()
         exact_matches = []
         partial_matches = []
         other_results = []
         
         for result in search_results:
             doc = result['document']
-            doc_type = doc.get('type', '')
             
             # Get document name based on type
-            if doc_type == 'file':
-                doc_name = doc.get('display_name', '').lower()
-            elif doc_type == 'assignment':
-                doc_name = doc.get('name', '').lower()
-            elif doc_type in ['announcement', 'quiz', 'event']:
-                doc_name = doc.get('title', '').lower()
-            else:
-                doc_name = ''
+            name_field = DOCUMENT_NAME_FIELDS.get(doc.get('type', ''))
+            doc_name = doc.get(name_field, '').lower() if name_field else ''
             
             # Check for exact match
-            if doc_name == normalized_query.lower():
+            if doc_name == query_lower:
                 result['similarity'] += 0.5  # Boost exact matches
                 exact_matches.append(result)
             # Check for partial matches
@@ -55,7 +52,8 @@ def augment_results(course_map, search_results):
         Args:
             search_results: List of search result dictionaries
         """
-        local_timezone = tzlocal.get_localzone()
+        # Relative times are measured from a single "now" for the whole result set
+        now = datetime.now(LOCAL_TIMEZONE)
         
         for result in search_results:
             doc = result['document']
@@ -72,19 +70,17 @@ def augment_results(course_map, search_results):
                 doc['course_code'] = course_code
 
             # Add time context
-            for date_field in ['due_at', 'posted_at', 'start_at', 'updated_at']:
-                if date_field in doc and doc[date_field]:
+            for date_field in AUGMENT_DATE_FIELDS:
+                date_value = doc.get(date_field)
+                if date_value:
                     try:
                         # Parse date from UTC and convert to local timezone
-                        date_obj = datetime.fromisoformat(doc[date_field].replace('Z', '+00:00'))
-                        local_date = date_obj.astimezone(local_timezone)
+                        date_obj = datetime.fromisoformat(date_value.replace('Z', '+00:00'))
+                        local_date = date_obj.astimezone(LOCAL_TIMEZONE)
                         
                         # Add localized time string
                         doc[f'local_{date_field}'] = local_date.strftime('%Y-%m-%d %H:%M:%S')
                         
-                        # Now calculate relative time using local time
-                        now = datetime.now(local_timezone)
-                        
                         # Add relative time
                         delta = local_date - now
                         days = delta.days
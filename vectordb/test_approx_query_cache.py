@@ -0,0 +1,97 @@
+"""
+Unit tests for ApproxQueryCache and query_cache_scope. No Canvas, ChromaDB or
+embedding service is contacted.
+
+Usage:
+    pytest vectordb/test_approx_query_cache.py
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Add the project root directory to Python path
+root_dir = Path(__file__).resolve().parent.parent
+sys.path.append(str(root_dir))
+
+from vectordb import db
+from vectordb.db import ApproxQueryCache, query_cache_scope
+
+SCOPE = ("course_1", "FUTURE", (), ())
+
+
+def test_lookup_returns_results_of_similar_query():
+    cache = ApproxQueryCache(tau=0.1)
+    cache.insert(SCOPE, [1.0, 0.0, 0.0], {"ids": [["doc_1"]]})
+
+    assert cache.lookup(SCOPE, [0.99, 0.05, 0.0]) == {"ids": [["doc_1"]]}
+
+
+def test_lookup_misses_dissimilar_query():
+    cache = ApproxQueryCache(tau=0.1)
+    cache.insert(SCOPE, [1.0, 0.0, 0.0], {"ids": [["doc_1"]]})
+
+    assert cache.lookup(SCOPE, [0.0, 1.0, 0.0]) is None
+
+
+def test_lookup_is_limited_to_scope():
+    cache = ApproxQueryCache(tau=0.1)
+    cache.insert(SCOPE, [1.0, 0.0, 0.0], {"ids": [["doc_1"]]})
+
+    assert cache.lookup(("course_2", "FUTURE", (), ()), [1.0, 0.0, 0.0]) is None
+
+
+def test_lookup_picks_most_similar_entry():
+    cache = ApproxQueryCache(tau=0.2)
+    cache.insert(SCOPE, [1.0, 0.2, 0.0], {"ids": [["doc_1"]]})
+    cache.insert(SCOPE, [1.0, 0.0, 0.0], {"ids": [["doc_2"]]})
+
+    assert cache.lookup(SCOPE, [1.0, 0.01, 0.0]) == {"ids": [["doc_2"]]}
+
+
+def test_zero_embeddings_are_ignored():
+    cache = ApproxQueryCache()
+    cache.insert(SCOPE, [0.0, 0.0, 0.0], {"ids": [["doc_1"]]})
+
+    assert cache.lookup(SCOPE, [0.0, 0.0, 0.0]) is None
+    assert cache.lookup(SCOPE, [1.0, 0.0, 0.0]) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ApproxQueryCache(tau=0.01, max_entries=2)
+    cache.insert(SCOPE, [1.0, 0.0, 0.0], {"ids": [["doc_1"]]})
+    cache.insert(SCOPE, [0.0, 1.0, 0.0], {"ids": [["doc_2"]]})
+    # Touch the first entry so the second is the least recently used
+    assert cache.lookup(SCOPE, [1.0, 0.0, 0.0]) == {"ids": [["doc_1"]]}
+    cache.insert(SCOPE, [0.0, 0.0, 1.0], {"ids": [["doc_3"]]})
+
+    assert cache.lookup(SCOPE, [0.0, 1.0, 0.0]) is None
+    assert cache.lookup(SCOPE, [1.0, 0.0, 0.0]) == {"ids": [["doc_1"]]}
+    assert cache.lookup(SCOPE, [0.0, 0.0, 1.0]) == {"ids": [["doc_3"]]}
+
+
+def test_expired_entries_are_not_returned(monkeypatch):
+    cache = ApproxQueryCache(tau=0.1)
+    now = 1000.0
+    monkeypatch.setattr(db.time, "monotonic", lambda: now)
+    cache.insert(SCOPE, [1.0, 0.0, 0.0], {"ids": [["doc_1"]]})
+
+    now += db.QUERY_CACHE_TTL_SECONDS
+    assert cache.lookup(SCOPE, [1.0, 0.0, 0.0]) is None
+
+
+def test_scope_separates_numbered_items():
+    homework_3 = query_cache_scope({"course_id": "course_1", "query": "when is homework 3 due"})
+    homework_4 = query_cache_scope({"course_id": "course_1", "query": "When is homework 4 due?"})
+
+    assert homework_3 != homework_4
+
+
+def test_scope_separates_keywords():
+    midterm = query_cache_scope({"course_id": "course_1", "query": "exam", "keywords": ["midterm"]})
+    final = query_cache_scope({"course_id": "course_1", "query": "exam", "keywords": ["Final"]})
+
+    assert midterm != final
+    assert query_cache_scope({"query": "exam", "keywords": ["Final", "exam"]}) == \
+        query_cache_scope({"query": "exam", "keywords": ["EXAM", "final"]})
@@ -1,14 +1,87 @@
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import tzlocal
 
+def _labelled_fields(*fields):
+    """Pair each field name with its display label, e.g. 'due_at' -> 'Due At'."""
+    return tuple((field, field.replace('_', ' ').title()) for field in fields)
 
-def preprocess_text_for_embedding(doc: Dict[str, Any]) -> str:
+# Fields included in the embedding text for each document type, with their labels
+FILE_FIELDS = _labelled_fields('folder_id', 'display_name', 'filename', 'url', 'size',
+                               'updated_at', 'locked', 'lock_explanation')
+ASSIGNMENT_FIELDS = _labelled_fields('name', 'description', 'created_at', 'updated_at', 'due_at',
+                                     'submission_types', 'can_submit', 'graded_submissions_exist')
+ANNOUNCEMENT_FIELDS = _labelled_fields('title', 'message', 'posted_at', 'course_id')
+QUIZ_FIELDS = _labelled_fields('title', 'preview_url', 'description', 'quiz_type', 'time_limit',
+                               'allowed_attempts', 'points_possible', 'due_at',
+                               'locked_for_user', 'lock_explanation')
+EVENT_FIELDS = _labelled_fields('title', 'start_at', 'end_at', 'description', 'location_name',
+                                'location_address', 'context_code', 'context_name',
+                                'all_context_codes', 'url')
+
+def _append_field_parts(doc: Dict[str, Any], fields, parts: list) -> None:
+        """Append a "Label: value" line for each field present in the document."""
+        for field, label in fields:
+            value = doc.get(field)
+            if value is None: # error prevention
+                continue
+            # Normalize any text fields to handle special characters
+            if isinstance(value, str):
+                value = normalize_text(value)
+            parts.append(f"{label}: {value}")
+
+def _append_assignment_parts(doc: Dict[str, Any], fields, parts: list) -> None:
+        """Append assignment fields, listing submission types and any extracted content links."""
+        for field, label in fields:
+            value = doc.get(field)
+            if value is None: # error prevention
+                continue
+            if field == 'submission_types' and isinstance(value, list):
+                # e.g. [online_text_entry, online_upload] -> Submission Types: Online Text Entry, Online Upload
+                parts.append(f"Submission Types: {', '.join(value)}")
+            else:
+                # Normalize any text fields
+                if isinstance(value, str):
+                    value = normalize_text(value)
+                # e.g. HW2 (name) -> Name: HW2
+                parts.append(f"{label}: {value}")
+        
+        # Handle content field which might contain extracted links
+        content = doc.get('content', [])
+        if content and isinstance(content, list):
+            parts.append("Content Link(s): \n")
+            for item in content:
+                if isinstance(item, str):
+                    parts.append(f'\t{item}\n')
+
+def _append_quiz_parts(doc: Dict[str, Any], fields, parts: list) -> None:
+        """Append quiz fields, showing the time limit in minutes."""
+        for field, label in fields:
+            value = doc.get(field)
+            if field == 'time_limit' and isinstance(value, int):
+                parts.append(f"Time Limit: {value} minutes")
+            elif value is not None:
+                # Normalize any text fields
+                if isinstance(value, str):
+                    value = normalize_text(value)
+                parts.append(f"{label}: {value}")
+
+# Document type -> (name field, name label, fields, field appender) used to build embedding text
+EMBEDDING_TEXT_LAYOUTS = {
+    'File': ('display_name', 'Filename', FILE_FIELDS, _append_field_parts),
+    'Assignment': ('name', 'Assignment', ASSIGNMENT_FIELDS, _append_assignment_parts),
+    'Announcement': ('title', 'Announcement', ANNOUNCEMENT_FIELDS, _append_field_parts),
+    'Quiz': ('title', 'Quiz', QUIZ_FIELDS, _append_quiz_parts),
+    'Event': ('title', 'Event', EVENT_FIELDS, _append_field_parts),
+}
+
+def preprocess_text_for_embedding(doc: Dict[str, Any], local_time: Optional[str] = None) -> str:
         """
         Preprocess document text for embedding.
         
         Args:
             doc: Singular Item dictionary from user_data
+            local_time: Formatted local time stamped on the doc; computed if not given
             
         Returns:
             Preprocessed text string that is sent to chromadb for embedding
@@ -43,122 +116,18 @@ def preprocess_text_for_embedding(doc: Dict[str, Any]) -> str:
                 doc[field] = value'''
         
         # Handle different document types
-        if doc_type == 'File':
-            # For files, prioritize the display_name by placing it at the beginning
-            display_name = doc.get('display_name', '')
-            if display_name:
-                # Normalize the display name to improve matching
-                normalized_name = normalize_text(display_name)
-                # Add the name at the beginning for emphasis
-                priority_parts.insert(0, f"Filename: {normalized_name}")
-                # Also add it as a title for better matching
-                priority_parts.insert(0, f"Title: {normalized_name}")
-            
-            for field in ['folder_id', 'display_name', 'filename', 'url', 'size', 
-                            'updated_at', 'locked', 'lock_explanation']:
-                if field in doc and doc[field] is not None: # error prevention
-                    # Normalize any text fields to handle special characters
-                    if isinstance(doc[field], str):
-                        value = normalize_text(doc[field])
-                    else:
-                        value = doc[field]
-                    regular_parts.append(f"{field.replace('_', ' ').title()}: {value}")
-            
-        elif doc_type == 'Assignment':
-            # For assignments, prioritize the name by placing it at the beginning
-            name = doc.get('name', '')
+        layout = EMBEDDING_TEXT_LAYOUTS.get(doc_type)
+        if layout:
+            name_field, name_label, fields, append_parts = layout
+            # Prioritize the document's name by placing it at the beginning
+            name = doc.get(name_field, '')
             if name:
                 # Normalize the name to improve matching
                 normalized_name = normalize_text(name)
-                # Add the name at the beginning for emphasis
-                priority_parts.insert(0, f"Assignment: {normalized_name}")
-                priority_parts.insert(0, f"Title: {normalized_name}")
-            
-            for field in ['name', 'description', 'created_at', 'updated_at', 'due_at', 
-                            'submission_types', 'can_submit', 'graded_submissions_exist']:
-                if field in doc and doc[field] is not None: # error prevention
-                    if field == 'submission_types' and isinstance(doc[field], list):
-                        # e.g. [online_text_entry, online_upload] -> Submission Types: Online Text Entry, Online Upload
-                        regular_parts.append(f"Submission Types: {', '.join(doc[field])}")
-                    else:
-                        # Normalize any text fields
-                        if isinstance(doc[field], str):
-                            value = normalize_text(doc[field])
-                        else:
-                            value = doc[field]
-                        # e.g. HW2 (name) -> Name: HW2
-                        regular_parts.append(f"{field.replace('_', ' ').title()}: {value}")
-            
-            # Handle content field which might contain extracted links
-            content = doc.get('content', [])
-            if content and isinstance(content, list):
-                regular_parts.append("Content Link(s): \n")
-                for item in content:
-                    if isinstance(item, str):
-                        regular_parts.append(f'\t{item}\n')
-            
-        elif doc_type == 'Announcement':
-            # For announcements, prioritize the title by placing it at the beginning
-            title = doc.get('title', '')
-            if title:
-                # Normalize the title to improve matching
-                normalized_title = normalize_text(title)
-                # Add the title at the beginning for emphasis
-                priority_parts.insert(0, f"Announcement: {normalized_title}")
-                priority_parts.insert(0, f"Title: {normalized_title}")
-            
-            for field in ['title', 'message', 'posted_at', 'course_id']:
-                if field in doc and doc[field] is not None: # error prevention
-                    # Normalize any text fields
-                    if isinstance(doc[field], str):
-                        value = normalize_text(doc[field])
-                    else:
-                        value = doc[field]
-                    regular_parts.append(f"{field.replace('_', ' ').title()}: {value}")
-            
-        elif doc_type == 'Quiz':
-            # For quizzes, prioritize the title by placing it at the beginning
-            title = doc.get('title', '')
-            if title:
-                # Normalize the title to improve matching
-                normalized_title = normalize_text(title)
-                # Add the title at the beginning for emphasis
-                priority_parts.insert(0, f"Quiz: {normalized_title}")
-                priority_parts.insert(0, f"Title: {normalized_title}")
-            
-            for field in ['title', 'preview_url', 'description', 'quiz_type', 'time_limit', 
-                            'allowed_attempts', 'points_possible', 'due_at', 
-                            'locked_for_user', 'lock_explanation']:
-                if field == 'time_limit' and isinstance(doc[field], int):
-                    regular_parts.append(f"Time Limit: {doc[field]} minutes")
-                elif field in doc and doc[field] is not None:
-                    # Normalize any text fields
-                    if isinstance(doc[field], str):
-                        value = normalize_text(doc[field])
-                    else:
-                        value = doc[field]
-                    regular_parts.append(f"{field.replace('_', ' ').title()}: {value}")
-            
-        elif doc_type == 'Event':
-            # For events, prioritize the title by placing it at the beginning
-            title = doc.get('title', '')
-            if title:
-                # Normalize the title to improve matching
-                normalized_title = normalize_text(title)
-                # Add the title at the beginning for emphasis
-                priority_parts.insert(0, f"Event: {normalized_title}")
-                priority_parts.insert(0, f"Title: {normalized_title}")
+                # Add it as a title and under its type label for emphasis
+                priority_parts = [f"Title: {normalized_name}", f"{name_label}: {normalized_name}"]
             
-            for field in ['title', 'start_at', 'end_at', 'description', 'location_name', 
-                            'location_address', 'context_code', 'context_name', 
-                            'all_context_codes', 'url']:
-                if field in doc and doc[field] is not None:
-                    # Normalize any text fields
-                    if isinstance(doc[field], str):
-                        value = normalize_text(doc[field])
-                    else:
-                        value = doc[field]
-                    regular_parts.append(f"{field.replace('_', ' ').title()}: {value}")
+            append_parts(doc, fields, regular_parts)
         
         # Add module information
         module_id = doc.get('module_id')
@@ -174,7 +143,8 @@ def preprocess_text_for_embedding(doc: Dict[str, Any]) -> str:
 
 
         # Add local time to doc
-        local_time = datetime.now().strftime('%Y-%m-%d %I:%M %p')
+        if local_time is None:
+            local_time = datetime.now().strftime('%Y-%m-%d %I:%M %p')
         doc['local_time'] = local_time
 
         # Join all parts with newlines for better separation